@@ -292,13 +292,11 @@ if __name__ == '__main__':
         print('usage: python toy.py <src.toy>')
         sys.exit(0)
 
-    with open(sys.argv[1], 'r') as f:
-        code = f.read()
-
     try:
-        lexer = Lexer(code)
-        parser = Parser(lexer)
-        tree = parser.parse()
+        with open(sys.argv[1], 'r') as f:
+            lexer = Lexer.from_file(f)
+            parser = Parser(lexer)
+            tree = parser.parse()
 
         displayer = Displayer(tree, 'ast.html')
         displayer.display()
@@ -306,4 +304,4 @@ if __name__ == '__main__':
         analyzer = SemanticAnalyzer(tree)
         analyzer.analysis()
     except (LexerError, ParserError, SemanticError) as e:
-        print(e)
+        print(e.locate(lexer.line_table()))
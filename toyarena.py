@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+toylang ast arena
+
+a flat struct-of-arrays form of a ast, for very large programs. nodes are
+indices into parallel array columns:
+    kinds     : AST.kind of each node
+    positions : source offset of each node, -1 for nodes without position
+    starts    : index of the first field of each node in `fields`
+    fields    : the fields of all nodes but position, in AST._fields order
+    items     : the items of all list fields, each list is contiguous
+
+a field or a list item is a int, its low 3 bits are a tag of toyserial
+(TAG_NODE, TAG_LIST, ...) and the rest is the payload: node index, list
+index, string id, operator code, ...
+
+`arena.view(index)` returns a read-only node view with the class name and
+the attribute names of the toyast node, so visitors dispatching by class
+name (like toyfmt) work on views. compare `node.kind` rather than
+`type(node)` in a pass which takes both. a view decodes a field on each
+access, walking views is slower than walking the tree.
+
+whole-tree passes should work on indices: `arena.walk()` and
+`arena.children(index)` read the columns directly, and a pass which needs
+no order can scan the columns, like `arena.kinds.count(Name.kind)`.
+"""
+from toytoken import *
+from toyerror import *
+from toyast import *
+from toyserial import TAG_NONE, TAG_NODE, TAG_LIST, TAG_STR, TAG_TRUE, TAG_FALSE, TAG_OP, TAG_INT
+
+from array import array
+import sys
+
+
+TAG_BITS = 3
+TAG_MASK = (1 << TAG_BITS) - 1
+
+
+class AstArena:
+    def __init__(self):
+        self.kinds = array('B')
+        self.positions = array('i')
+        self.starts = array('I')
+        self.fields = array('i')
+        self.items = array('i')
+        self.list_starts = array('I')
+        self.list_lengths = array('I')
+        self.strings = []
+        self.string_ids = {}
+        self.root = None        # index of the root node
+
+    def __len__(self):
+        return len(self.kinds)
+
+    @classmethod
+    def from_tree(cls, tree):
+        arena = cls()
+        arena.root = arena.add_node(tree)
+        return arena
+
+    def add_node(self, node):
+        """append a node and its children (children first), return its index
+        """
+        values = [self.encode(getattr(node, field)) for field in node._fields if field != 'position']
+        index = len(self.kinds)
+        self.kinds.append(node.kind)
+        position = getattr(node, 'position', None)
+        self.positions.append(-1 if position is None else position)
+        self.starts.append(len(self.fields))
+        self.fields.extend(values)
+        return index
+
+    def encode(self, value):
+        if value is None:
+            return TAG_NONE
+        elif value is True:
+            return TAG_TRUE
+        elif value is False:
+            return TAG_FALSE
+        elif isinstance(value, AST):
+            return self.add_node(value) << TAG_BITS | TAG_NODE
+        elif isinstance(value, list):
+            items = [self.encode(item) for item in value]
+            list_index = len(self.list_starts)
+            self.list_starts.append(len(self.items))
+            self.list_lengths.append(len(items))
+            self.items.extend(items)
+            return list_index << TAG_BITS | TAG_LIST
+        elif isinstance(value, str):
+            string_id = self.string_ids.get(value)
+            if string_id is None:
+                string_id = self.string_ids[value] = len(self.strings)
+                self.strings.append(value)
+            return string_id << TAG_BITS | TAG_STR
+        elif isinstance(value, TokenType):
+            return TOKEN_TYPE_CODES[value] << TAG_BITS | TAG_OP
+        elif isinstance(value, int):
+            return value << TAG_BITS | TAG_INT
+        raise SerialError(f'unsupported value type `{type(value).__name__}`')
+
+    def decode(self, code, to_tree=False):
+        """decode a field, child nodes are views, or toyast nodes if to_tree
+        """
+        tag = code & TAG_MASK
+        payload = code >> TAG_BITS
+        if tag == TAG_NODE:
+            return self.node(payload) if to_tree else self.view(payload)
+        elif tag == TAG_STR:
+            return self.strings[payload]
+        elif tag == TAG_LIST:
+            start = self.list_starts[payload]
+            items = self.items[start:start + self.list_lengths[payload]]
+            return [self.decode(item, to_tree) for item in items]
+        elif tag == TAG_OP:
+            return TOKEN_TYPE_LIST[payload]
+        elif tag == TAG_NONE:
+            return None
+        elif tag == TAG_TRUE:
+            return True
+        elif tag == TAG_FALSE:
+            return False
+        return payload      # TAG_INT
+
+    def children(self, index):
+        """yield the indices of the child nodes of a node, in the order of
+        _fields, read from the columns without decoding the node
+        """
+        start = self.starts[index]
+        for code in self.fields[start:start + FIELD_COUNTS[self.kinds[index]]]:
+            tag = code & TAG_MASK
+            if tag == TAG_NODE:
+                yield code >> TAG_BITS
+            elif tag == TAG_LIST:
+                list_index = code >> TAG_BITS
+                item_start = self.list_starts[list_index]
+                for item in self.items[item_start:item_start + self.list_lengths[list_index]]:
+                    if item & TAG_MASK == TAG_NODE:
+                        yield item >> TAG_BITS
+
+    def walk(self, index=None):
+        """yield index (default the root) and the indices of all nodes under
+        it, in source order like toyast.walk
+        """
+        kinds, starts, fields, items = self.kinds, self.starts, self.fields, self.items
+        list_starts, list_lengths = self.list_starts, self.list_lengths
+        stack = [self.root if index is None else index]
+        push = stack.append
+        while stack:
+            index = stack.pop()
+            yield index
+            start = starts[index]
+            # children are pushed last first, like children() reversed
+            for code in reversed(fields[start:start + FIELD_COUNTS[kinds[index]]]):
+                tag = code & TAG_MASK
+                if tag == TAG_NODE:
+                    push(code >> TAG_BITS)
+                elif tag == TAG_LIST:
+                    list_index = code >> TAG_BITS
+                    item_start = list_starts[list_index]
+                    for item in reversed(items[item_start:item_start + list_lengths[list_index]]):
+                        if item & TAG_MASK == TAG_NODE:
+                            push(item >> TAG_BITS)
+
+    def view(self, index):
+        return NODE_VIEW_TYPES[self.kinds[index]](self, index)
+
+    def root_view(self):
+        return self.view(self.root)
+
+    def node(self, index):
+        """build the toyast node at index
+        """
+        node_type = NODE_TYPES[self.kinds[index]]
+        node = node_type.__new__(node_type)
+        start = self.starts[index]
+        for i, field in enumerate(NODE_VIEW_TYPES[node_type.kind]._stored_fields):
+            setattr(node, field, self.decode(self.fields[start + i], to_tree=True))
+        if 'position' in node_type._fields:
+            node.position = self.positions[index]
+        for annotation in node_type._annotations:
+            setattr(node, annotation, None)
+        return node
+
+    def to_tree(self):
+        return self.node(self.root)
+
+    def nbytes(self):
+        """bytes of the array columns
+        """
+        columns = (self.kinds, self.positions, self.starts, self.fields, self.items,
+                   self.list_starts, self.list_lengths)
+        return sum(column.itemsize * len(column) for column in columns)
+
+
+class NodeView:
+    """base of node views, a (arena, index) pair
+    """
+    __slots__ = ('arena', 'index')
+    kind = None
+    _fields = ()
+    _stored_fields = ()     # _fields without position, in the order of arena.fields
+
+    def __init__(self, arena, index):
+        self.arena = arena
+        self.index = index
+
+    def __eq__(self, other):
+        return isinstance(other, NodeView) and self.arena is other.arena and self.index == other.index
+
+    def __hash__(self):
+        return hash((id(self.arena), self.index))
+
+    @property
+    def position(self):
+        position = self.arena.positions[self.index]
+        return None if position < 0 else position
+
+    def children(self):
+        arena = self.arena
+        for index in arena.children(self.index):
+            yield arena.view(index)
+
+
+def _field_property(i):
+    def get(self):
+        arena = self.arena
+        return arena.decode(arena.fields[arena.starts[self.index] + i])
+    return property(get)
+
+
+def _build_view_type(node_type):
+    stored_fields = tuple(field for field in node_type._fields if field != 'position')
+    namespace = {
+        '__slots__': (),
+        '__module__': __name__,
+        'kind': node_type.kind,
+        '_fields': node_type._fields,
+        '_stored_fields': stored_fields,
+    }
+    for i, field in enumerate(stored_fields):
+        namespace[field] = _field_property(i)
+    return type(node_type.__name__, (NodeView,), namespace)
+
+
+NODE_VIEW_TYPES = [_build_view_type(node_type) for node_type in NODE_TYPES]
+FIELD_COUNTS = [len(view_type._stored_fields) for view_type in NODE_VIEW_TYPES]
+
+
+if __name__ == '__main__':
+    from toylexer import *
+    from toyparser import *
+    from toyfmt import Formator
+    from toyserial import same_tree
+    import contextlib
+    import glob
+    import io
+    import os
+
+    def format_output(tree):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            try:
+                Formator(tree).format()
+            except Exception as e:
+                print(f'{e.__class__.__name__}: {e}')
+        return output.getvalue()
+
+    paths = sys.argv[1:] or sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test', '*.toy')))
+    failed = 0
+    print(f'{"file":<24} {"nodes":>8} {"arena bytes":>12}  round-trip  format  walk')
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            try:
+                tree = Parser(Lexer.from_file(f)).parse()
+            except (LexerError, ParserError) as e:
+                print(f'{os.path.basename(path):<24} {"-":>8} {"-":>12}  skipped, {e.__class__.__name__}')
+                continue
+
+        arena = AstArena.from_tree(tree)
+        round_trip = same_tree(tree, arena.to_tree())
+        same_format = format_output(tree) == format_output(arena.root_view())
+        same_walk = [node.kind for node in walk(tree)] == [arena.kinds[index] for index in arena.walk()]
+        failed += not (round_trip and same_format and same_walk)
+        print(f'{os.path.basename(path):<24} {len(arena):>8} {arena.nbytes():>12}  {"ok" if round_trip else "FAILED":<10}  {"ok" if same_format else "FAILED":<6}  {"ok" if same_walk else "FAILED"}')
+    sys.exit(1 if failed else 0)
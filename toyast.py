@@ -14,25 +14,60 @@ name style:
 from toytoken import *
 
 class AST:
-    pass
+    """base of ast nodes
+
+    kind        : stable small int of the node class, index in NODE_TYPES
+    _fields     : attributes of the node, in the order of __init__ params
+    _annotations: attributes set by passes like toyresolver, None until set,
+                  they are not serialized
+    """
+    __slots__ = ()
+    kind = None
+    _fields = ()
+    _annotations = ()
+
+    def children(self):
+        """yield child nodes, in the order of _fields
+        """
+        for field in self._fields:
+            value = getattr(self, field)
+            if isinstance(value, AST):
+                yield value
+            elif isinstance(value, list):
+                for item in value:
+                    if isinstance(item, AST):
+                        yield item
 
 
 class EmptyStat(AST):
-    pass
+    _fields = ()
+    __slots__ = _fields
 
 
 class Program(AST):
+    _fields = ('stats',)
+    __slots__ = _fields
+
     def __init__(self, stats):
         self.stats = stats
 
 
 class BlockStat(AST):
+    _fields = ('stats', 'position')
+    _annotations = ('scope', 'elided')
+    __slots__ = _fields + _annotations
+
     def __init__(self, stats, position):
         self.stats = stats
         self.position = position
+        self.scope = None
+        self.elided = None
 
 
 class VarDeclStat(AST):
+    _fields = ('names', 'exprs', 'const', 'position')
+    __slots__ = _fields
+
     def __init__(self, names, exprs, const, position):
         self.names = names
         self.exprs = exprs
@@ -41,6 +76,9 @@ class VarDeclStat(AST):
 
 
 class IfStat(AST):
+    _fields = ('cond_exprs', 'stats', 'position')
+    __slots__ = _fields
+
     def __init__(self, cond_exprs, stats, position):
         self.cond_exprs = cond_exprs
         self.stats = stats
@@ -48,6 +86,9 @@ class IfStat(AST):
 
 
 class SwitchStat(AST):
+    _fields = ('expr', 'case_exprs', 'case_stats', 'default_stat', 'position')
+    __slots__ = _fields
+
     def __init__(self, expr, case_exprs, case_stats, default_stat, position):
         self.expr = expr
         self.case_exprs = case_exprs
@@ -57,20 +98,36 @@ class SwitchStat(AST):
 
 
 class RepeatStat(AST):
+    _fields = ('expr', 'stat', 'position')
+    _annotations = ('scope', 'elided')
+    __slots__ = _fields + _annotations
+
     def __init__(self, expr, stat, position):
         self.expr = expr
         self.stat = stat
         self.position = position
+        self.scope = None
+        self.elided = None
 
 
 class WhileStat(AST):
+    _fields = ('expr', 'stat', 'position')
+    _annotations = ('scope', 'elided')
+    __slots__ = _fields + _annotations
+
     def __init__(self, expr, stat, position):
         self.expr = expr
         self.stat = stat
         self.position = position
+        self.scope = None
+        self.elided = None
 
 
 class ForloopStat(AST):
+    _fields = ('var_name', 'start_expr', 'end_expr', 'step_expr', 'stat', 'position')
+    _annotations = ('scope',)
+    __slots__ = _fields + _annotations
+
     def __init__(self, var_name, start_expr, end_expr, step_expr, stat, position):
         self.var_name = var_name
         self.start_expr = start_expr
@@ -78,34 +135,52 @@ class ForloopStat(AST):
         self.step_expr = step_expr
         self.stat = stat
         self.position = position
+        self.scope = None
 
 
 class ForeachStat(AST):
+    _fields = ('key_name', 'val_name', 'expr', 'stat', 'position')
+    _annotations = ('scope',)
+    __slots__ = _fields + _annotations
+
     def __init__(self, key_name, val_name, expr, stat, position):
         self.key_name = key_name
         self.val_name = val_name
         self.expr = expr
         self.stat = stat
         self.position = position
+        self.scope = None
 
 
 class BreakStat(AST):
+    _fields = ('position',)
+    __slots__ = _fields
+
     def __init__(self, position):
         self.position = position
 
 
 class ContinueStat(AST):
+    _fields = ('position',)
+    __slots__ = _fields
+
     def __init__(self, position):
         self.position = position
 
 
 class ReturnStat(AST):
+    _fields = ('expr', 'position')
+    __slots__ = _fields
+
     def __init__(self, expr, position):
         self.expr = expr
         self.position = position
 
 
 class AssignStat(AST):
+    _fields = ('left_exprs', 'right_exprs', 'position')
+    __slots__ = _fields
+
     def __init__(self, left_exprs, right_exprs, position):
         self.left_exprs = left_exprs
         self.right_exprs = right_exprs
@@ -113,6 +188,9 @@ class AssignStat(AST):
 
 
 class CompoundAssignStat(AST):
+    _fields = ('operator', 'left_expr', 'right_expr', 'position')
+    __slots__ = _fields
+
     def __init__(self, operator, left_expr, right_expr, position):
         self.operator = operator
         self.left_expr = left_expr
@@ -121,14 +199,22 @@ class CompoundAssignStat(AST):
 
 
 class FuncDef(AST):
+    _fields = ('param_names', 'vararg', 'body', 'position')
+    _annotations = ('scope',)
+    __slots__ = _fields + _annotations
+
     def __init__(self, param_names, vararg, body, position):
         self.param_names = param_names
         self.vararg = vararg
         self.body = body
         self.position = position
+        self.scope = None
 
 
 class FuncCall(AST):
+    _fields = ('func_expr', 'arg_exprs', 'position')
+    __slots__ = _fields
+
     def __init__(self, func_expr, arg_exprs, position):
         self.func_expr = func_expr
         self.arg_exprs = arg_exprs
@@ -136,6 +222,9 @@ class FuncCall(AST):
 
 
 class SelectExpr(AST):
+    _fields = ('cond', 'expr1', 'expr2', 'position')
+    __slots__ = _fields
+
     def __init__(self, cond, expr1, expr2, position):
         self.cond = cond
         self.expr1 = expr1
@@ -144,6 +233,9 @@ class SelectExpr(AST):
 
 
 class BinOpExpr(AST):
+    _fields = ('operator', 'left_expr', 'right_expr', 'position')
+    __slots__ = _fields
+
     def __init__(self, operator, left_expr, right_expr, position):
         """BinOpExpr
 
@@ -156,6 +248,9 @@ class BinOpExpr(AST):
 
 
 class UniOpExpr(AST):
+    _fields = ('operator', 'expr', 'position')
+    __slots__ = _fields
+
     def __init__(self, operator, expr, position):
         self.operator = operator
         self.expr = expr
@@ -163,12 +258,18 @@ class UniOpExpr(AST):
 
 
 class ListCtorExpr(AST):
+    _fields = ('exprs', 'position')
+    __slots__ = _fields
+
     def __init__(self, exprs, position):
         self.exprs = exprs
         self.position = position
 
 
 class MapCtorExpr(AST):
+    _fields = ('key_exprs', 'value_exprs', 'position')
+    __slots__ = _fields
+
     def __init__(self, key_exprs, value_exprs, position):
         self.key_exprs = key_exprs
         self.value_exprs = value_exprs
@@ -176,12 +277,18 @@ class MapCtorExpr(AST):
 
 
 class SetCtorExpr(AST):
+    _fields = ('exprs', 'position')
+    __slots__ = _fields
+
     def __init__(self, exprs, position):
         self.exprs = exprs
         self.position = position
 
 
 class AccessExpr(AST):
+    _fields = ('expr', 'field_expr', 'dot', 'position')
+    __slots__ = _fields
+
     def __init__(self, expr, field_expr, dot: bool, position):
         self.expr = expr
         self.field_expr = field_expr
@@ -190,42 +297,126 @@ class AccessExpr(AST):
 
 
 class Name(AST):
+    _fields = ('identifier', 'position')
+    _annotations = ('depth', 'slot')
+    __slots__ = _fields + _annotations
+
     def __init__(self, identifier, position):
         self.identifier = identifier
         self.position = position
+        self.depth = None
+        self.slot = None
 
 
 class NumLiteral(AST):
+    _fields = ('value', 'is_int', 'position')
+    _annotations = ('constant',)
+    __slots__ = _fields + _annotations
+
     def __init__(self, value, is_int, position):
         self.value = value
         self.is_int = is_int
         self.position = position
+        self.constant = None
 
 
 class StringLiteral(AST):
+    _fields = ('value', 'position')
+    _annotations = ('constant',)
+    __slots__ = _fields + _annotations
+
     def __init__(self, value, position):
         self.value = value
         self.position = position
+        self.constant = None
 
 
 class BoolLiteral(AST):
+    _fields = ('value', 'position')
+    __slots__ = _fields
+
     def __init__(self, value, position):
         self.value = value
         self.position = position
 
 
 class NullLiteral(AST):
+    _fields = ('position',)
+    __slots__ = _fields
+
     def __init__(self, position):
         self.position = position
 
 
+# node kinds are used by serialized asts, append new node types only
+NODE_TYPES = [
+    Program, EmptyStat, BlockStat, VarDeclStat, IfStat, SwitchStat, RepeatStat,
+    WhileStat, ForloopStat, ForeachStat, BreakStat, ContinueStat, ReturnStat,
+    AssignStat, CompoundAssignStat, FuncDef, FuncCall, SelectExpr, BinOpExpr,
+    UniOpExpr, ListCtorExpr, MapCtorExpr, SetCtorExpr, AccessExpr, Name,
+    NumLiteral, StringLiteral, BoolLiteral, NullLiteral,
+]
+for _kind, _node_type in enumerate(NODE_TYPES):
+    _node_type.kind = _kind
+
+
+def walk(node):
+    """yield node and all nodes under it, in source order
+    """
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(reversed(list(node.children())))
+
+
+def copy_tree(node):
+    """deep copy of a tree, annotations are reset
+    """
+    node_type = type(node)
+    copy = node_type.__new__(node_type)
+    for field in node_type._fields:
+        value = getattr(node, field)
+        if isinstance(value, AST):
+            value = copy_tree(value)
+        elif isinstance(value, list):
+            value = [copy_tree(item) if isinstance(item, AST) else item for item in value]
+        setattr(copy, field, value)
+    for annotation in node_type._annotations:
+        setattr(copy, annotation, None)
+    return copy
+
+
+class DispatchTable(dict):
+    """node class -> visit function of a visitor class, filled on first visit
+    """
+    def __init__(self, visitor_type):
+        super().__init__()
+        self.visitor_type = visitor_type
+
+    def __missing__(self, node_type):
+        visitor = getattr(self.visitor_type, 'visit_' + node_type.__name__, self.visitor_type.generic_visitor)
+        self[node_type] = visitor
+        return visitor
+
+
 class AstNodeVistor():
+    """dispatch nodes to `visit_<node class name>` methods
+
+    each visitor class has its own DispatchTable, so a visit is one dict
+    lookup instead of building the method name and getattr
+    """
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._dispatch_table = DispatchTable(cls)
+
     def visit(self, node):
         """dispatches
         """
-        method_name = 'visit_' + type(node).__name__
-        visitor = getattr(self, method_name, self.generic_visitor)
-        return visitor(node)
+        return self._dispatch_table[type(node)](self, node)
 
     def generic_visitor(self, node):
         raise Exception(f'No visit_{type(node).__name__} method')
+
+
+AstNodeVistor._dispatch_table = DispatchTable(AstNodeVistor)
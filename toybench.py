@@ -0,0 +1,693 @@
+# -*- coding: utf-8 -*-
+"""
+toylang benchmarks
+
+usage:
+    python toybench.py lexer [--max-size BYTES]
+    python toybench.py tokens [--size BYTES]
+    python toybench.py relex [--size BYTES]
+    python toybench.py parser [--size BYTES]
+    python toybench.py serial [--size BYTES]
+    python toybench.py nesting [--depth N]
+    python toybench.py many [--files N] [--size BYTES]
+    python toybench.py astmem [--nodes N]
+    python toybench.py arena [--nodes N]
+    python toybench.py dispatch [--n N]
+    python toybench.py engines [--n N] [--loops N]
+    python toybench.py tail [--n N]
+"""
+from toytoken import *
+from toylexer import *
+from toyparser import *
+from toyast import *
+from toycache import parse_many
+from toyarena import AstArena
+from toyinterpreter import Interpreter
+from toyresolver import Resolver
+from toyoptimizer import optimize
+from toyclosure import ClosureInterpreter
+from toycompiler import VMInterpreter
+import toyserial
+
+import argparse
+import gc
+import os
+import pickle
+import tempfile
+import time
+import tracemalloc
+
+
+BENCH_SNIPPET = '''func fibonacci(n) {
+    if n == 0
+        return 1
+    elif n == 1
+        return 1
+    else
+        return fibonacci(n - 1) + fibonacci(n - 2)
+}
+var s, f = `multi
+line`, 1.25
+for n is 0,10
+    println(n, ': ', fibonacci(n))   // comment
+/* block
+   comment */
+'''
+
+
+def make_source(size):
+    """repeat BENCH_SNIPPET to a source of about `size` chars
+    """
+    return BENCH_SNIPPET * max(1, size // len(BENCH_SNIPPET))
+
+
+def measure_memory(func):
+    """return (result of func, bytes allocated by func and still alive)
+    """
+    tracemalloc.start()
+    try:
+        result = func()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, size
+
+
+def bench(func, repeat=1):
+    """run func `repeat` times, return the best elapsed seconds
+    """
+    best = None
+    for _ in range(repeat):
+        gc.collect()        # garbage of the previous run would be collected in this one
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def lex_all(lexer):
+    count = 0
+    while lexer.next_token().type != TokenType.EOF:
+        count += 1
+    return count
+
+
+def bench_lexer(max_size):
+    lexers = [
+        ('Lexer', lambda code: lex_all(Lexer(code))),
+        ('iter_tokens', lambda code: sum(1 for _ in iter_tokens(code)) - 1),
+    ]
+    print(f'{"lexer":<12} {"size":>12} {"tokens":>10} {"seconds":>10} {"us/KB":>10}')
+    for name, lex in lexers:
+        size = 10 * 1024
+        while size <= max_size:
+            code = make_source(size)
+            tokens = []
+            seconds = bench(lambda: tokens.append(lex(code)))
+            print(f'{name:<12} {len(code):>12} {tokens[0]:>10} {seconds:>10.3f} {seconds * 1e6 / (len(code) / 1024):>10.1f}')
+            size *= 10
+
+
+def bench_tokens(size):
+    code = make_source(size)
+    tokens, list_size = measure_memory(lambda: list(iter_tokens(code)))
+    count = len(tokens)
+    del tokens
+    _, buffer_size = measure_memory(lambda: TokenBuffer.from_tokens(iter_tokens(code)))
+    print(f'{"storage":<16} {"tokens":>10} {"bytes":>12} {"bytes/token":>12}')
+    print(f'{"list[Token]":<16} {count:>10} {list_size:>12} {list_size / count:>12.1f}')
+    print(f'{"TokenBuffer":<16} {count:>10} {buffer_size:>12} {buffer_size / count:>12.1f}')
+
+
+def bench_relex(size):
+    code = make_source(size)
+    buffer = tokenize(code)
+    edits = [
+        ('insert char', code.index('fibonacci(n - 1)', len(code) // 2), 0, 'x'),
+        ('open comment', code.index('println', len(code) // 2), 0, '/*'),
+        ('uncomment', code.index('/* block', len(code) // 2), 2, ''),
+    ]
+    full = bench(lambda: tokenize(code), repeat=3)
+    print(f'{"edit":<14} {"tokens":>10} {"full (s)":>10} {"relex (s)":>10}')
+    for name, offset, removed, inserted in edits:
+        result = []
+        seconds = bench(lambda: result.append(relex(buffer, offset, removed, inserted)), repeat=3)
+        print(f'{name:<14} {len(result[0]):>10} {full:>10.4f} {seconds:>10.4f}')
+
+
+EXPR_SNIPPET = '''var x = (a + 1) * b - c / 2 % d
+x = a < b and c >= d or not e == f
+y = f(a, b + 1, [1, 2, 3], {'k': 2 * x}) ? l[i + 1] : m.k << 2 | 1 & 3 ^ 4
+'''
+
+
+def bench_parser(size):
+    sources = [
+        ('statements', make_source(size)),
+        ('expressions', EXPR_SNIPPET * max(1, size // len(EXPR_SNIPPET))),
+    ]
+    print(f'{"source":<12} {"parser":<20} {"tokens":>10} {"seconds":>10} {"Ktokens/s":>10}')
+    for source_name, code in sources:
+        tokens = list(iter_tokens(code))
+        for parser_name, pratt in (('recursive descent', False), ('precedence climbing', True)):
+            seconds = bench(lambda: Parser(tokens, pratt=pratt).parse(), repeat=3)
+            print(f'{source_name:<12} {parser_name:<20} {len(tokens):>10} {seconds:>10.3f} {len(tokens) / seconds / 1000:>10.1f}')
+
+
+def bench_serial(size):
+    code = make_source(size)
+    tree = Parser(iter_tokens(code)).parse()
+    parse = bench(lambda: Parser(iter_tokens(code)).parse())
+    formats = [
+        ('pickle', lambda t: pickle.dumps(t, pickle.HIGHEST_PROTOCOL), pickle.loads),
+        ('toyserial', toyserial.dumps, toyserial.loads),
+    ]
+    print(f'parse {len(code)} chars: {parse:.3f}s')
+    print(f'{"format":<10} {"bytes":>10} {"dump (s)":>10} {"load (s)":>10}')
+    for name, dumps, loads in formats:
+        data = dumps(tree)
+        dump_seconds = bench(lambda: dumps(tree), repeat=3)
+        load_seconds = bench(lambda: loads(data), repeat=3)
+        print(f'{name:<10} {len(data):>10} {dump_seconds:>10.3f} {load_seconds:>10.3f}')
+
+
+def make_nested_sources(depth):
+    return [
+        ('parens', 'x = ' + '(' * depth + '1' + ')' * depth),
+        ('lists', 'x = ' + '[' * depth + '1' + ']' * depth),
+        ('maps', 'x = ' + "{'k': " * depth + '1' + '}' * depth),
+        ('blocks', '{' * depth + 'x = 1' + '}' * depth),
+    ]
+
+
+def bench_nesting(depth):
+    print(f'{"source":<8} {"depth":>8} {"parser":<16} {"seconds":>10}')
+    for source_name, code in make_nested_sources(depth):
+        tokens = list(iter_tokens(code))
+        for parser_type in (Parser, IterativeParser):
+            try:
+                seconds = f'{bench(lambda: parser_type(tokens).parse()):>10.3f}'
+            except RecursionError:
+                seconds = 'RecursionError'
+            print(f'{source_name:<8} {depth:>8} {parser_type.__name__:<16} {seconds:>10}')
+
+
+def bench_many(files, size):
+    code = make_source(size)
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for i in range(files):
+            paths.append(os.path.join(directory, f'{i}.toy'))
+            with open(paths[-1], 'w', encoding='utf-8') as f:
+                f.write(code)
+
+        def serial():
+            trees = []          # kept like the trees parse_many returns
+            for path in paths:
+                with open(path, 'r', encoding='utf-8') as f:
+                    trees.append(Parser(Lexer(f.read())).parse())
+            return trees
+
+        cpus = os.cpu_count() or 1
+        runs = [('serial loop', serial)]
+        for workers in sorted({1, 2, 4, cpus}):
+            runs.append((f'parse_many x{workers}', lambda workers=workers: parse_many(paths, workers, use_cache=False)))
+
+        print(f'{files} files of {len(code)} chars, {cpus} cpus')
+        print(f'{"run":<16} {"seconds":>10} {"files/s":>10} {"MB/s":>10} {"speedup":>10}')
+        serial_seconds = None
+        for name, func in runs:
+            seconds = bench(func)
+            serial_seconds = serial_seconds or seconds
+            print(f'{name:<16} {seconds:>10.3f} {files / seconds:>10.1f} {files * len(code) / seconds / 1e6:>10.2f} {serial_seconds / seconds:>9.2f}x')
+        if cpus == 1:
+            print('one cpu: the pool runs show its overhead, not a multi-core speedup')
+
+
+def count_nodes(node):
+    return sum(1 for _ in walk(node))
+
+
+# node classes with a __dict__ per instance, as toyast was before __slots__
+DICT_NODE_TYPES = {node_type: type(node_type.__name__, (), {}) for node_type in NODE_TYPES}
+
+
+def to_dict_nodes(value):
+    if isinstance(value, AST):
+        node = DICT_NODE_TYPES[type(value)]()
+        for field in value._fields:
+            setattr(node, field, to_dict_nodes(getattr(value, field)))
+        return node
+    if isinstance(value, list):
+        return [to_dict_nodes(item) for item in value]
+    return value
+
+
+def bench_astmem(nodes):
+    per_snippet = count_nodes(Parser(iter_tokens(BENCH_SNIPPET)).parse())
+    tokens = list(iter_tokens(BENCH_SNIPPET * max(1, nodes // per_snippet)))
+    tree, slots_size = measure_memory(lambda: Parser(tokens).parse())
+    count = count_nodes(tree)
+    _, dict_size = measure_memory(lambda: to_dict_nodes(tree))
+    print(f'{"nodes":<10} {"count":>10} {"bytes":>12} {"bytes/node":>12}')
+    print(f'{"__dict__":<10} {count:>10} {dict_size:>12} {dict_size / count:>12.1f}')
+    print(f'{"__slots__":<10} {count:>10} {slots_size:>12} {slots_size / count:>12.1f}')
+
+
+def bench_arena(nodes):
+    per_snippet = count_nodes(Parser(iter_tokens(BENCH_SNIPPET)).parse())
+    tokens = list(iter_tokens(BENCH_SNIPPET * max(1, nodes // per_snippet)))
+    tree, tree_size = measure_memory(lambda: Parser(tokens).parse())
+    count = count_nodes(tree)
+    arena, arena_size = measure_memory(lambda: AstArena.from_tree(tree))
+    print(f'{"storage":<10} {"nodes":>10} {"bytes":>12} {"bytes/node":>12}')
+    print(f'{"tree":<10} {count:>10} {tree_size:>12} {tree_size / count:>12.1f}')
+    print(f'{"arena":<10} {count:>10} {arena_size:>12} {arena_size / count:>12.1f}')
+
+    def tree_names():
+        return sum(1 for node in walk(tree) if type(node) is Name)
+    passes = [
+        ('count Name, tree walk', tree_names),
+        ('count Name, arena kinds', lambda: arena.kinds.count(Name.kind)),
+        ('walk all, tree', lambda: count_nodes(tree)),
+        ('walk all, arena views', lambda: count_nodes(arena.root_view())),
+        ('walk all, arena indices', lambda: sum(1 for _ in arena.walk())),
+    ]
+    print(f'{"pass":<26} {"seconds":>10}')
+    for name, func in passes:
+        print(f'{name:<26} {bench(func, repeat=3):>10.4f}')
+
+
+FIB_SNIPPET = '''func fibonacci(n) {
+    if n == 0
+        return 1
+    elif n == 1
+        return 1
+    else
+        return fibonacci(n - 1) + fibonacci(n - 2)
+}
+var result = fibonacci(%d)
+'''
+
+
+class GetattrDispatchInterpreter(Interpreter):
+    """Interpreter with the visit dispatch before the dispatch table
+    """
+    def visit(self, node):
+        method_name = 'visit_' + type(node).__name__
+        visitor = getattr(self, method_name, self.generic_visitor)
+        return visitor(node)
+
+
+def bench_dispatch(n):
+    tree = Parser(iter_tokens(FIB_SNIPPET % n)).parse()
+    literal = NumLiteral('1', is_int=True, position=0)
+    visits = 1000000
+
+    def visit_literals(interpreter):
+        visit = interpreter.visit
+        for _ in range(visits):
+            visit(literal)
+
+    runs = (('getattr', GetattrDispatchInterpreter), ('dispatch table', Interpreter))
+    fib_seconds = [bench(lambda: interpreter_type().interpret(tree), repeat=3) for _, interpreter_type in runs]
+    visit_seconds = [bench(lambda: visit_literals(interpreter_type()), repeat=3) for _, interpreter_type in runs]
+    print(f'{"dispatch":<16} {"fibonacci(" + str(n) + ") s":>16} {"ns/visit":>10}')
+    for (name, _), seconds, visit in zip(runs, fib_seconds, visit_seconds):
+        print(f'{name:<16} {seconds:>16.3f} {visit * 1e9 / visits:>10.1f}')
+
+
+LOOP_SNIPPET = '''var total = 0
+for i is 0, %d {
+    var j = 0
+    while j < 10 {
+        j += 1
+        if j == 5 continue
+        total += j
+    }
+}
+'''
+
+
+def bench_engines(n, loops):
+    programs = (
+        (f'fibonacci({n})', Parser(iter_tokens(FIB_SNIPPET % n)).parse()),
+        (f'loops({loops})', Parser(iter_tokens(LOOP_SNIPPET % loops)).parse()),
+    )
+    engines = (('tree', Interpreter), ('closure', ClosureInterpreter), ('vm', VMInterpreter))
+    print(f'{"program":<16}' + ''.join(f' {name + " s":>12}' for name, _ in engines) + f' {"speedup":>8}')
+    for program, tree in programs:
+        seconds = [bench(lambda: engine_type().interpret(tree), repeat=3) for _, engine_type in engines]
+        print(f'{program:<16}' + ''.join(f' {s:>12.3f}' for s in seconds) + f' {seconds[0] / seconds[-1]:>7.2f}x')
+
+
+NAMES_SNIPPET = '''var total = 0
+func run(n) {
+    var step = 1
+    for i is 0, n {
+        {
+            var j = 0
+            while j < 10 {
+                j += step
+                total += j
+            }
+        }
+    }
+}
+run(%d)
+'''
+
+
+def bench_names(loops):
+    source = NAMES_SNIPPET % loops
+    print(f'{"lookup":<16} {"seconds":>10}')
+    for lookup, resolve in (('by name', False), ('resolved', True)):
+        seconds = bench(lambda: Interpreter(resolve=resolve).interpret(Parser(iter_tokens(source)).parse()), repeat=3)
+        print(f'{lookup:<16} {seconds:>10.3f}')
+
+
+RECORDS_SNIPPET = '''var total = 0
+var i = 0
+while i < %d {
+    i += 1
+    var j = 0
+    while j < 10 {
+        j += 1
+        if j > 5 {
+            total += j
+        } else {
+            total -= 1
+        }
+    }
+}
+'''
+
+
+def bench_records(loops):
+    source = RECORDS_SNIPPET % loops
+    print(f'{"records":<16} {"seconds":>10}')
+    for records, elide in (('every block', False), ('elided', True)):
+        def run():
+            interpreter = Interpreter()
+            interpreter.resolver = Resolver(elide=elide)
+            interpreter.interpret(Parser(iter_tokens(source)).parse())
+        print(f'{records:<16} {bench(run, repeat=3):>10.3f}')
+
+
+JUMPS_SNIPPETS = (
+    ('no exits', '''var total = 0
+for i is 0, %d {
+    var j = 0
+    while j < 10 {
+        j += 1
+        {
+            total += j
+        }
+    }
+}
+'''),
+    ('continue', '''var total = 0
+for i is 0, %d {
+    var j = 0
+    while j < 10 {
+        j += 1
+        {
+            if j > 5 continue
+        }
+        total += j
+    }
+}
+'''),
+    ('break', '''var total = 0
+for i is 0, %d {
+    var j = 0
+    while true {
+        j += 1
+        {
+            if j == 10 break
+        }
+        total += j
+    }
+}
+'''),
+    ('return', '''var total = 0
+func find(n) {
+    var j = 0
+    while true {
+        j += 1
+        {
+            if j == n return j
+        }
+    }
+}
+for i is 0, %d {
+    total += find(10)
+}
+'''),
+)
+
+
+def bench_jumps(loops):
+    print(f'{"loop body":<16} {"seconds":>10}')
+    for program, snippet in JUMPS_SNIPPETS:
+        tree = Parser(iter_tokens(snippet % loops)).parse()
+        print(f'{program:<16} {bench(lambda: Interpreter().interpret(tree), repeat=3):>10.3f}')
+
+
+FOLD_SNIPPET = '''const WIDTH = 40
+const HALF = WIDTH / 2
+var total = 0
+for i is 0, %d {
+    var j = 0
+    while j < WIDTH / 4 {
+        j += 1
+        total += (WIDTH - HALF) * 2 + j * (3 - 1)
+    }
+}
+'''
+
+
+def bench_fold(loops):
+    source = FOLD_SNIPPET % loops
+    print(f'{"tree":<16} {"seconds":>10}')
+
+    def run(optimized):
+        tree = Parser(iter_tokens(source)).parse()
+        if optimized:
+            optimize(tree)
+        Interpreter().interpret(tree)
+    print(f'{"as parsed":<16} {bench(lambda: run(False), repeat=3):>10.3f}')
+    print(f'{"folded":<16} {bench(lambda: run(True), repeat=3):>10.3f}')
+
+
+DEAD_SNIPPET = '''const DEBUG = false
+const MODE = 2
+var total = 0
+for i is 0, %d {
+    if DEBUG {
+        print('step', i)
+    } elif MODE == 1 {
+        total += 2
+    } else {
+        total += 1
+    }
+    switch MODE:
+    case 1: total -= 1
+    case 2: total += 1
+    default: total = 0
+    while DEBUG { print('wait') }
+}
+'''
+
+
+def bench_dead(loops):
+    source = DEAD_SNIPPET % loops
+    print(f'{"tree":<16} {"seconds":>10}')
+
+    def run(optimized):
+        tree = Parser(iter_tokens(source)).parse()
+        if optimized:
+            optimize(tree)
+        Interpreter().interpret(tree)
+    print(f'{"as parsed":<16} {bench(lambda: run(False), repeat=3):>10.3f}')
+    print(f'{"pruned":<16} {bench(lambda: run(True), repeat=3):>10.3f}')
+
+
+INLINE_SNIPPET = '''var total = 0
+func add_points(n) {
+    if n <= 0    return;
+    total += n
+}
+func double(n) { return n * 2 }
+for i is 0, %d {
+    add_points(i - 5)
+    total += double(i) + double(1)
+}
+'''
+
+
+def bench_inline(loops):
+    source = INLINE_SNIPPET % loops
+    print(f'{"tree":<16} {"seconds":>10}')
+
+    def run(optimized):
+        tree = Parser(iter_tokens(source)).parse()
+        if optimized:
+            optimize(tree)
+        Interpreter().interpret(tree)
+    print(f'{"calls":<16} {bench(lambda: run(False), repeat=3):>10.3f}')
+    print(f'{"inlined":<16} {bench(lambda: run(True), repeat=3):>10.3f}')
+
+
+LITERALS_SNIPPET = '''var total = 0
+var names = []
+for i is 0, %d {
+    var s = 'item'
+    names = [s, 'a', 'b', null, true]
+    total += 1 + 2 + 3
+    total -= 4.5 - 0.5
+}
+'''
+
+
+def bench_literals(loops):
+    tree = Parser(iter_tokens(LITERALS_SNIPPET % loops)).parse()
+    engines = (('tree', Interpreter), ('closure', ClosureInterpreter), ('vm', VMInterpreter))
+    print(f'{"engine":<16} {"seconds":>10}')
+    for name, engine_type in engines:
+        print(f'{name:<16} {bench(lambda: engine_type().interpret(tree), repeat=3):>10.3f}')
+
+
+TAIL_SNIPPET = '''func loop(n, acc) {
+    if n == 0   return acc
+    return loop(n - 1, acc + n)
+}
+func is_even(n) {
+    if n == 0   return true
+    return is_odd(n - 1)
+}
+func is_odd(n) {
+    if n == 0   return false
+    return is_even(n - 1)
+}
+loop(%d, 0)
+is_even(%d)
+'''
+
+
+def bench_tail(n):
+    print(f'{"calls":<16} {"seconds":>10}')
+    for calls in (min(n, 200), n):
+        tree = Parser(iter_tokens(TAIL_SNIPPET % (calls, calls))).parse()
+        try:
+            seconds = f'{bench(lambda: Interpreter().interpret(tree), repeat=3):>10.3f}'
+        except RecursionError:
+            seconds = f'{"RecursionError":>10}'
+        print(f'{calls:<16} {seconds}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='toylang benchmarks')
+    subparsers = parser.add_subparsers(dest='bench', required=True)
+
+    p = subparsers.add_parser('lexer', help='lexer scaling over 10KB -> max-size sources')
+    p.add_argument('--max-size', type=int, default=10 * 1024 * 1024, help='largest source size in bytes')
+
+    p = subparsers.add_parser('tokens', help='memory of list[Token] vs TokenBuffer')
+    p.add_argument('--size', type=int, default=1024 * 1024, help='source size in bytes')
+
+    p = subparsers.add_parser('relex', help='incremental relex vs full tokenize after an edit')
+    p.add_argument('--size', type=int, default=1024 * 1024, help='source size in bytes')
+
+    p = subparsers.add_parser('parser', help='recursive descent vs precedence climbing expr parser')
+    p.add_argument('--size', type=int, default=256 * 1024, help='source size in bytes')
+
+    p = subparsers.add_parser('serial', help='pickle vs toyserial ast size and speed')
+    p.add_argument('--size', type=int, default=256 * 1024, help='source size in bytes')
+
+    p = subparsers.add_parser('nesting', help='Parser vs IterativeParser on deeply nested sources')
+    p.add_argument('--depth', type=int, default=10000, help='nesting depth')
+
+    p = subparsers.add_parser('many', help='serial parse loop vs parse_many process pool')
+    p.add_argument('--files', type=int, default=200, help='number of source files')
+    p.add_argument('--size', type=int, default=16 * 1024, help='size of each source in bytes')
+
+    p = subparsers.add_parser('astmem', help='memory of ast nodes with __dict__ vs __slots__')
+    p.add_argument('--nodes', type=int, default=100000, help='about how many nodes in the tree')
+
+    p = subparsers.add_parser('arena', help='memory and whole-tree passes of tree vs AstArena')
+    p.add_argument('--nodes', type=int, default=100000, help='about how many nodes in the tree')
+
+    p = subparsers.add_parser('dispatch', help='getattr vs dispatch table visit on fibonacci recursion')
+    p.add_argument('--n', type=int, default=18, help='fibonacci(n) to run')
+
+    p = subparsers.add_parser('engines', help='tree walking vs closure engine vs bytecode vm on recursive and loop programs')
+    p.add_argument('--n', type=int, default=18, help='fibonacci(n) to run')
+    p.add_argument('--loops', type=int, default=5000, help='iterations of the outer loop')
+
+    p = subparsers.add_parser('names', help='name lookup by walking records vs resolved frame slots')
+    p.add_argument('--loops', type=int, default=5000, help='iterations of the outer loop')
+
+    p = subparsers.add_parser('records', help='a record for every block and loop vs elided records on nested loops')
+    p.add_argument('--loops', type=int, default=5000, help='iterations of the outer loop')
+
+    p = subparsers.add_parser('jumps', help='tree walking loops without and with break, continue and return')
+    p.add_argument('--loops', type=int, default=5000, help='iterations of the outer loop')
+
+    p = subparsers.add_parser('fold', help='constant arithmetic in a loop as parsed vs folded by toyoptimizer')
+    p.add_argument('--loops', type=int, default=2000, help='iterations of the outer loop')
+
+    p = subparsers.add_parser('dead', help='a loop with constant branches as parsed vs pruned by toyoptimizer')
+    p.add_argument('--loops', type=int, default=20000, help='iterations of the loop')
+
+    p = subparsers.add_parser('inline', help='calls of small functions in a loop as parsed vs inlined by toyoptimizer')
+    p.add_argument('--loops', type=int, default=20000, help='iterations of the loop')
+
+    p = subparsers.add_parser('literals', help='literals and compound assignment in a loop on each engine')
+    p.add_argument('--loops', type=int, default=20000, help='iterations of the loop')
+
+    p = subparsers.add_parser('tail', help='self and mutual tail recursion on the tree walking interpreter')
+    p.add_argument('--n', type=int, default=100000, help='depth of the recursion')
+
+    args = parser.parse_args()
+
+    if args.bench == 'lexer':
+        bench_lexer(args.max_size)
+    elif args.bench == 'tokens':
+        bench_tokens(args.size)
+    elif args.bench == 'relex':
+        bench_relex(args.size)
+    elif args.bench == 'parser':
+        bench_parser(args.size)
+    elif args.bench == 'serial':
+        bench_serial(args.size)
+    elif args.bench == 'nesting':
+        bench_nesting(args.depth)
+    elif args.bench == 'many':
+        bench_many(args.files, args.size)
+    elif args.bench == 'astmem':
+        bench_astmem(args.nodes)
+    elif args.bench == 'arena':
+        bench_arena(args.nodes)
+    elif args.bench == 'dispatch':
+        bench_dispatch(args.n)
+    elif args.bench == 'engines':
+        bench_engines(args.n, args.loops)
+    elif args.bench == 'names':
+        bench_names(args.loops)
+    elif args.bench == 'records':
+        bench_records(args.loops)
+    elif args.bench == 'jumps':
+        bench_jumps(args.loops)
+    elif args.bench == 'fold':
+        bench_fold(args.loops)
+    elif args.bench == 'dead':
+        bench_dead(args.loops)
+    elif args.bench == 'inline':
+        bench_inline(args.loops)
+    elif args.bench == 'literals':
+        bench_literals(args.loops)
+    elif args.bench == 'tail':
+        bench_tail(args.n)
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+toylang parse cache
+
+the ast of a source file is saved to `__toycache__/<file>.toyc` next to it,
+and is loaded instead of parsing while the content of the source and the
+toylang version are unchanged.
+
+a cache file is the hex cache key followed by the ast in toyserial format.
+"""
+from toyerror import *
+from toylexer import *
+from toyparser import *
+import toyserial
+
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import hashlib
+import mmap
+import os
+import tempfile
+import time
+
+
+TOYLANG_VERSION = '0.1.0'       # bump when the ast changes, invalidates all caches
+CACHE_DIR = '__toycache__'
+CACHE_SUFFIX = '.toyc'
+
+
+def cache_path(src_path):
+    directory, filename = os.path.split(os.path.abspath(src_path))
+    return os.path.join(directory, CACHE_DIR, filename + CACHE_SUFFIX)
+
+
+def read_source(src_path):
+    """read the source once, the key and the tree are both made from the text
+
+    Returns:
+      (text, cache key, LineTable of the source)
+    """
+    with open(src_path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    digest = hashlib.sha256(TOYLANG_VERSION.encode())
+    digest.update(text.encode('utf-8'))
+    return text, digest.hexdigest(), LineTable.from_text(text)
+
+
+def load_cache(path, key):
+    """return the cached tree, None if missing, stale or broken
+    """
+    try:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:len(key)] == key.encode():
+                return toyserial.loads(data, len(key))
+    except (OSError, ValueError, SerialError):
+        # missing, empty (mmap raises ValueError), a bad string in the pool
+        # (UnicodeDecodeError, a ValueError) or truncated (SerialError)
+        pass
+    return None
+
+
+def read_cache(path, key):
+    """return the cached ast in toyserial format, None if missing or stale
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    if data[:len(key)] == key.encode() and data[len(key):len(key) + len(toyserial.MAGIC)] == toyserial.MAGIC:
+        return data[len(key):]
+    return None
+
+
+def save_cache(path, key, data):
+    """write the key and the ast in toyserial format to a temp file then
+    rename it, so a concurrent run never reads a partial cache
+    """
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(key.encode())
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    except OSError:
+        pass        # cache is optional, e.g. the directory is read-only
+
+
+def parse_text(text, line_table):
+    try:
+        return Parser(Lexer(text)).parse()
+    except (LexerError, ParserError) as e:
+        raise e.locate(line_table)
+
+
+def parse_file(src_path, use_cache=True):
+    """parse a source file, through the cache if use_cache
+
+    Returns:
+      (Program, LineTable of the source)
+
+    Raises:
+      LexerError, ParserError: located by the LineTable
+    """
+    if not use_cache:
+        with open(src_path, 'r', encoding='utf-8') as f:
+            lexer = Lexer.from_file(f)
+            try:
+                return Parser(lexer).parse(), lexer.line_table()
+            except (LexerError, ParserError) as e:
+                raise e.locate(lexer.line_table())
+
+    text, key, line_table = read_source(src_path)
+    path = cache_path(src_path)
+    tree = load_cache(path, key)
+    if tree is None:
+        tree = parse_text(text, line_table)
+        save_cache(path, key, toyserial.dumps(tree))
+    return tree, line_table
+
+
+def parse_file_data(src_path, use_cache=True):
+    """like parse_file, but return the ast in toyserial format
+
+    a valid cache entry is returned as is, without decoding it
+    """
+    text, key, line_table = read_source(src_path)
+    path = cache_path(src_path)
+    if use_cache:
+        data = read_cache(path, key)
+        if data is not None:
+            return data, line_table
+    data = toyserial.dumps(parse_text(text, line_table))
+    if use_cache:
+        save_cache(path, key, data)
+    return data, line_table
+
+
+def _parse_worker(src_path, use_cache, trees):
+    try:
+        data, _ = parse_file_data(src_path, use_cache)
+        return (data if trees else None), None
+    except (LexerError, ParserError, OSError) as e:
+        return None, e
+
+
+def parse_many(paths, workers=None, use_cache=True, trees=True):
+    """parse source files in a process pool
+
+    with one worker the files are parsed in this process and no tree is
+    encoded. the workers of a pool send the trees back in toyserial format,
+    which is much smaller and faster to transfer than pickled trees, and
+    they are decoded here. encoding and decoding cost about half a parse,
+    which the pool must win back on more cpus
+
+    Args:
+      workers: number of processes, default os.cpu_count(), 1 parses in this process
+      trees: False only parses (and caches) the files, no tree is returned
+
+    Returns:
+      list of (path, tree, error) in the order of paths. tree is None if the
+      file fails with error (LexerError, ParserError or OSError), or if not trees
+    """
+    paths = list(paths)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(paths) <= 1:
+        results = []
+        for path in paths:
+            try:
+                tree, _ = parse_file(path, use_cache)
+                results.append((path, tree if trees else None, None))
+            except (LexerError, ParserError, OSError) as e:
+                results.append((path, None, e))
+        return results
+
+    chunksize = max(1, len(paths) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(_parse_worker, paths, [use_cache] * len(paths), [trees] * len(paths), chunksize=chunksize))
+    return [(path, None if data is None else toyserial.loads(data), error) for path, (data, error) in zip(paths, results)]
+
+
+def collect_sources(paths):
+    """expand directories to the .toy files in them
+    """
+    result = []
+    for path in paths:
+        if not os.path.isdir(path):
+            result.append(path)
+            continue
+        for directory, dirnames, filenames in os.walk(path):
+            dirnames[:] = sorted(d for d in dirnames if d != CACHE_DIR)
+            result.extend(os.path.join(directory, filename) for filename in sorted(filenames) if filename.endswith('.toy'))
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='precompile toylang sources into __toycache__')
+    parser.add_argument('paths', nargs='+', help='source files or directories')
+    parser.add_argument('-j', '--workers', type=int, help='number of processes, default cpu count')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results = parse_many(collect_sources(args.paths), args.workers, trees=False)
+    failed = 0
+    for path, _, error in results:
+        if error is not None:
+            failed += 1
+            print(f'{path}: {error}')
+    print(f'{len(results)} files, {failed} failed, {time.perf_counter() - start:.3f}s')
@@ -0,0 +1,581 @@
+# -*- coding: utf-8 -*-
+"""
+toylang closure engine
+
+each ast node is compiled once into a python closure, then the program runs
+by calling the closures instead of visiting the ast:
+- a expr compiles to `f() -> Value`
+- a stat compiles to `f() -> completion`, the completion is None, or
+  BREAK/CONTINUE/RETURN which the enclosing loop or function call handles,
+  the value of a return is passed in `ClosureInterpreter.retval`
+
+activation records, name lookup and errors are the same as Interpreter, so
+programs behave the same in both engines.
+"""
+from toyerror import *
+from toyast import *
+from toyvalue import *
+from toyinterpreter import *
+
+
+BREAK    = 1
+CONTINUE = 2
+RETURN   = 3
+
+
+class ClosureCompiler(AstNodeVistor):
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.in_loop = False        # break/continue are valid
+        self.in_function = False    # return is valid
+
+    def error(self, position, message):
+        raise InterpreterError(position, message)
+
+    def compile(self, node):
+        return self.visit(node)
+
+    def statement(self, node):
+        code = self.visit(node)
+        if node.kind == FuncCall.kind:      # discard the value of a func call stat
+            def call_stat():
+                code()
+            return call_stat
+        return code
+
+    def statements(self, nodes):
+        return [self.statement(node) for node in nodes]
+
+    def loop_body(self, node):
+        in_loop, self.in_loop = self.in_loop, True
+        body = self.statement(node)
+        self.in_loop = in_loop
+        return body
+
+    def bool_expr(self, node):
+        """compile a condition to `f() -> bool`
+        """
+        expr = self.visit(node)
+        error = self.error
+        position = node.position
+        convert_to_bool = OpImpl.convert_to_bool
+
+        def cond():
+            try:
+                return convert_to_bool(expr())._val
+            except ValueTypeError as e:
+                error(position, ErrorInfo.expr_value_error(e.message))
+        return cond
+
+    def visit_Program(self, node: Program):
+        stats = self.statements(node.stats)
+
+        def program():
+            for stat in stats:
+                stat()
+        return program
+
+    def visit_EmptyStat(self, node: EmptyStat):
+        def empty_stat():
+            pass
+        return empty_stat
+
+    def visit_BlockStat(self, node: BlockStat):
+        stats = self.statements(node.stats)
+        name = f'block<{node.position}>'
+        interpreter = self.interpreter
+
+        def block_stat():
+            interpreter.enter_ar(ActivationRecord(name, ARType.BLOCK))
+            completion = None
+            for stat in stats:
+                completion = stat()
+                if completion:
+                    break
+            interpreter.exit_ar()
+            return completion
+        return block_stat
+
+    def visit_VarDeclStat(self, node: VarDeclStat):
+        identifiers = [name.identifier for name in node.names]
+        positions = [name.position for name in node.names]
+        right_num = len(node.exprs) if node.exprs else 0
+        exprs = [self.visit(node.exprs[i]) if i < right_num else NullValue for i in range(len(identifiers))]
+        const = node.const
+        call_stack = self.interpreter.call_stack
+        error = self.error
+
+        def var_decl_stat():
+            values = [unshare(expr()) for expr in exprs]
+            ar = call_stack.current_ar
+            for identifier, position, value in zip(identifiers, positions, values):
+                if identifier in ar.members:
+                    error(position, ErrorInfo.name_duplicate_declared(identifier))
+                ar.members[identifier] = [value, const]
+        return var_decl_stat
+
+    def visit_IfStat(self, node: IfStat):
+        branches = [(self.bool_expr(cond_expr), self.statement(stat)) for cond_expr, stat in zip(node.cond_exprs, node.stats)]
+
+        def if_stat():
+            for cond, stat in branches:
+                if cond():
+                    return stat()
+        return if_stat
+
+    def visit_SwitchStat(self, node: SwitchStat):
+        expr = self.visit(node.expr)
+        cases = [(self.visit(case_expr), self.statement(case_stat)) for case_expr, case_stat in zip(node.case_exprs, node.case_stats)]
+        default_stat = self.statement(node.default_stat) if node.default_stat else None
+        eq = OpImpl.eq
+
+        def switch_stat():
+            switch_val = expr()
+            for case_expr, case_stat in cases:
+                if eq(switch_val, case_expr())._val:
+                    return case_stat()
+            if default_stat:
+                return default_stat()
+        return switch_stat
+
+    def visit_RepeatStat(self, node: RepeatStat):
+        stat = self.loop_body(node.stat)
+        until = self.bool_expr(node.expr)
+        name = f'repeat<{node.position}>'
+        interpreter = self.interpreter
+
+        def repeat_stat():
+            interpreter.enter_ar(ActivationRecord(name, ARType.LOOP))
+            completion = None
+            while True:
+                completion = stat()
+                if completion == RETURN:
+                    break
+                elif completion == BREAK:
+                    completion = None
+                    break
+                if until():
+                    completion = None
+                    break
+            interpreter.exit_ar()
+            return completion
+        return repeat_stat
+
+    def visit_WhileStat(self, node: WhileStat):
+        cond = self.bool_expr(node.expr)
+        stat = self.loop_body(node.stat)
+        name = f'while<{node.position}>'
+        interpreter = self.interpreter
+
+        def while_stat():
+            interpreter.enter_ar(ActivationRecord(name, ARType.LOOP))
+            completion = None
+            while cond():
+                completion = stat()
+                if completion == RETURN:
+                    break
+                elif completion == BREAK:
+                    completion = None
+                    break
+            else:
+                completion = None
+            interpreter.exit_ar()
+            return completion
+        return while_stat
+
+    def visit_ForloopStat(self, node: ForloopStat):
+        start_expr = self.visit(node.start_expr)
+        end_expr = self.visit(node.end_expr)
+        step_expr = self.visit(node.step_expr) if node.step_expr else None
+        stat = self.loop_body(node.stat)
+        identifier = node.var_name.identifier
+        start_position = node.start_expr.position
+        end_position = node.end_expr.position
+        name = f'for<{node.position}>'
+        interpreter = self.interpreter
+        error = self.error
+        lt = OpImpl.lt
+        add = OpImpl.add
+        one = interpreter.constants.num('1', True)
+
+        def forloop_stat():
+            ar = ActivationRecord(name, ARType.LOOP)
+            start_val = start_expr()
+            if not isinstance(start_val, NumValue):
+                error(start_position, ErrorInfo.expr_type_error('num'))
+            end_val = end_expr()
+            if not isinstance(end_val, NumValue):
+                error(end_position, ErrorInfo.expr_type_error('num'))
+            step_val = step_expr() if step_expr else one
+            members = ar.members
+            members[identifier] = [unshare(start_val), True]
+            interpreter.enter_ar(ar)
+            completion = None
+            while True:
+                val = members[identifier][0]
+                if not lt(val, end_val)._val:
+                    break
+                completion = stat()
+                if completion == RETURN:
+                    break
+                elif completion == BREAK:
+                    completion = None
+                    break
+                completion = None
+                members[identifier] = [add(val, step_val), True]
+            interpreter.exit_ar()
+            return completion
+        return forloop_stat
+
+    def visit_ForeachStat(self, node: ForeachStat):
+        expr = self.visit(node.expr)
+        stat = self.loop_body(node.stat)
+        key_identifier = node.key_name.identifier
+        val_identifier = node.val_name.identifier if node.val_name is not None else None
+        name = f'for<{node.position}>'
+        position = node.position
+        interpreter = self.interpreter
+        error = self.error
+        next_ = OpImpl.next
+
+        def foreach_stat():
+            ar = ActivationRecord(name, ARType.LOOP)
+            interpreter.enter_ar(ar)
+            c = expr()
+            if type(c) not in (ListValue, MapValue):
+                error(position, 'TODO: foreach now only support list and map')
+            members = ar.members
+            k = NullValue()
+            completion = None
+            while True:
+                k, v = next_(c, k)
+                if type(k) == NullValue:
+                    break
+                if val_identifier is not None:
+                    members[key_identifier] = [k, True]
+                    members[val_identifier] = [v, True]
+                else:
+                    members[key_identifier] = [v, True]
+                completion = stat()
+                if completion == RETURN:
+                    break
+                elif completion == BREAK:
+                    completion = None
+                    break
+                completion = None
+            interpreter.exit_ar()
+            return completion
+        return foreach_stat
+
+    def jump_stat(self, node, completion, valid, keyword):
+        error = self.error
+        position = node.position
+
+        if not valid:
+            def invalid_stat():
+                error(position, ErrorInfo.invalid_syntax(keyword))
+            return invalid_stat
+
+        def jump():
+            return completion
+        return jump
+
+    def visit_BreakStat(self, node: BreakStat):
+        return self.jump_stat(node, BREAK, self.in_loop, 'break')
+
+    def visit_ContinueStat(self, node: ContinueStat):
+        return self.jump_stat(node, CONTINUE, self.in_loop, 'continue')
+
+    def visit_ReturnStat(self, node: ReturnStat):
+        if not self.in_function:
+            return self.jump_stat(node, RETURN, False, 'return')
+        expr = self.visit(node.expr) if node.expr is not None else NullValue
+        interpreter = self.interpreter
+
+        def return_stat():
+            interpreter.retval = expr()
+            return RETURN
+        return return_stat
+
+    def assign_target(self, left_expr):
+        """compile a lvalue_expr to `f(value)`
+        """
+        error = self.error
+        if left_expr.kind == Name.kind:
+            identifier = left_expr.identifier
+            position = left_expr.position
+            call_stack = self.interpreter.call_stack
+
+            def assign_name(value):
+                ar = call_stack.current_ar
+                while ar is not None:
+                    vv = ar.members.get(identifier)
+                    if vv is not None:
+                        if vv[1]:
+                            error(position, ErrorInfo.name_not_assignable(identifier))
+                        ar.members[identifier] = [value, vv[1]]
+                        return
+                    ar = ar.outer
+                error(position, ErrorInfo.name_not_declared(identifier))
+            return assign_name
+
+        assert(left_expr.kind == AccessExpr.kind)
+        container_expr = self.visit(left_expr.expr)
+        field_expr = self.visit(left_expr.field_expr)
+        container_position = left_expr.expr.position
+        position = left_expr.position
+        set_member = OpImpl.set_member
+
+        def assign_member(value):
+            c = container_expr()
+            if type(c) not in (ListValue, MapValue):
+                error(container_position, ErrorInfo.general('expr not list or map'))
+            try:
+                set_member(container=c, key=field_expr(), value=value)
+            except MemberAccessError as e:
+                error(position, ErrorInfo.general(e.message))
+        return assign_member
+
+    def visit_AssignStat(self, node: AssignStat):
+        right_num = len(node.right_exprs)
+        exprs = [self.visit(node.right_exprs[i]) if i < right_num else NullValue for i in range(len(node.left_exprs))]
+        targets = [self.assign_target(left_expr) for left_expr in node.left_exprs]
+
+        def assign_stat():
+            values = [unshare(expr()) for expr in exprs]
+            for target, value in zip(targets, values):
+                target(value)
+        return assign_stat
+
+    def visit_CompoundAssignStat(self, node: CompoundAssignStat):
+        left_expr = self.visit(node.left_expr)
+        right_expr = self.visit(node.right_expr)
+        impl = BINOP_IMPL_TABLE.get(node.operator)
+        operator = node.operator
+        position = node.position
+        error = self.error
+
+        def compoundassign_stat():
+            left_val = left_expr()
+            right_val = right_expr()
+            if impl is None:
+                error(position, ErrorInfo.op_not_implemented(operator.value))
+            try:
+                impl(left_val, right_val)
+            except ValueTypeError as e:
+                error(position, ErrorInfo.expr_value_error(e.message))
+        return compoundassign_stat
+
+    def visit_FuncDef(self, node: FuncDef):
+        in_loop, in_function = self.in_loop, self.in_function
+        self.in_loop, self.in_function = False, True
+        body = self.statements(node.body)
+        self.in_loop, self.in_function = in_loop, in_function
+
+        def func_def():
+            func = FunctionValue(_ast=node)
+            func.code = body
+            return func
+        return func_def
+
+    def visit_FuncCall(self, node: FuncCall):
+        func_expr = self.visit(node.func_expr)
+        arg_exprs = [self.visit(arg_expr) for arg_expr in node.arg_exprs] if node.arg_exprs else []
+        arg_num = len(arg_exprs)
+        position = node.position
+        interpreter = self.interpreter
+        error = self.error
+
+        def func_call():
+            func_val = func_expr()
+            if type(func_val) == HostFunctionValue:
+                args = [unshare(arg_expr()) for arg_expr in arg_exprs]
+                try:
+                    result = func_val._func(args)
+                except ValueTypeError as e:
+                    error(position, ErrorInfo.general(e.message))
+                if result:
+                    if isinstance(result, Value):
+                        return result
+                    error(position, ErrorInfo.general("host function return invalid type value"))
+                return NullValue()
+
+            assert(type(func_val) == FunctionValue)
+            func_ast = func_val._ast
+            ar = ActivationRecord(f'{func_val.signature}<{position}>', ARType.FUNCTION)
+            i = 0
+            if func_ast.param_names:
+                members = ar.members
+                for param_name in func_ast.param_names:
+                    members[param_name.identifier] = [unshare(arg_exprs[i]()) if i < arg_num else None, False]
+                    i += 1
+            if func_ast.vararg and i < arg_num:
+                error(position, "TODO: vararg")
+            interpreter.enter_ar(ar)
+            retval = None
+            for stat in func_val.code:
+                if stat() == RETURN:
+                    retval = interpreter.retval
+                    interpreter.retval = None
+                    break
+            interpreter.exit_ar()
+            return retval if retval else NullValue()
+        return func_call
+
+    def visit_SelectExpr(self, node: SelectExpr):
+        cond = self.bool_expr(node.cond)
+        expr1 = self.visit(node.expr1)
+        expr2 = self.visit(node.expr2)
+
+        def select_expr():
+            return expr1() if cond() else expr2()
+        return select_expr
+
+    def visit_BinOpExpr(self, node: BinOpExpr):
+        left_expr = self.visit(node.left_expr)
+        right_expr = self.visit(node.right_expr)
+        position = node.position
+        error = self.error
+
+        operator = node.operator
+        reverse = False
+        if operator == TokenType.NE:
+            reverse = True
+            operator = TokenType.EQ
+        elif operator == TokenType.GE:
+            reverse = True
+            operator = TokenType.LT
+        elif operator == TokenType.GT:
+            reverse = True
+            operator = TokenType.LE
+
+        impl = BINOP_IMPL_TABLE.get(operator)
+        if impl is None:
+            def binop_not_implemented():
+                left_expr()
+                right_expr()
+                error(position, ErrorInfo.op_not_implemented(operator.value))
+            return binop_not_implemented
+
+        if reverse:
+            def reversed_binop_expr():
+                left_val = left_expr()
+                right_val = right_expr()
+                try:
+                    result = impl(left_val, right_val)
+                    result._val = not result._val
+                except ValueTypeError as e:
+                    error(position, ErrorInfo.expr_value_error(e.message))
+                return result
+            return reversed_binop_expr
+
+        def binop_expr():
+            left_val = left_expr()
+            right_val = right_expr()
+            try:
+                return impl(left_val, right_val)
+            except ValueTypeError as e:
+                error(position, ErrorInfo.expr_value_error(e.message))
+        return binop_expr
+
+    def visit_UniOpExpr(self, node: UniOpExpr):
+        expr = self.visit(node.expr)
+        impl = UNIOP_IMPL_TABLE.get(node.operator)
+        operator = node.operator
+        position = node.position
+        error = self.error
+
+        def uniop_expr():
+            expr_value = expr()
+            if impl is None:
+                error(position, ErrorInfo.op_not_implemented(operator.value))
+            try:
+                return impl(expr_value)
+            except ValueTypeError as e:
+                error(position, ErrorInfo.expr_value_error(e.message))
+        return uniop_expr
+
+    def visit_ListCtorExpr(self, node: ListCtorExpr):
+        exprs = [self.visit(expr) for expr in node.exprs] if node.exprs else []
+
+        def list_ctor_expr():
+            return ListValue(_val=[unshare(expr()) for expr in exprs])
+        return list_ctor_expr
+
+    def visit_MapCtorExpr(self, node: MapCtorExpr):
+        pairs = [(self.visit(key_expr), self.visit(value_expr) if value_expr else NullValue)
+                 for key_expr, value_expr in zip(node.key_exprs, node.value_exprs)]
+        set_member = OpImpl.set_member
+
+        def map_ctor_expr():
+            value = MapValue(_val={})
+            for key_expr, value_expr in pairs:
+                key = unshare(key_expr())
+                set_member(value, key, unshare(value_expr()))
+            return value
+        return map_ctor_expr
+
+    def visit_SetCtorExpr(self, node: SetCtorExpr):
+        error = self.error
+        position = node.position
+
+        def set_ctor_expr():
+            error(position, 'TODO: set not implement!')
+        return set_ctor_expr
+
+    def visit_AccessExpr(self, node: AccessExpr):
+        expr = self.visit(node.expr)
+        field_expr = self.visit(node.field_expr)
+        position = node.position
+        error = self.error
+        get_member = OpImpl.get_member
+
+        def access_expr():
+            container = expr()
+            key = field_expr()
+            if type(container) in (ListValue, MapValue):
+                try:
+                    return get_member(container, key)
+                except MemberAccessError as e:
+                    error(position, ErrorInfo.general(e.message))
+            else:
+                error(position, 'TODO: built-in field access not implement!')
+        return access_expr
+
+    def visit_Name(self, node: Name):
+        identifier = node.identifier
+        position = node.position
+        call_stack = self.interpreter.call_stack
+        error = self.error
+
+        def name():
+            ar = call_stack.current_ar
+            while ar is not None:
+                vv = ar.members.get(identifier)
+                if vv is not None and vv[0] is not None:
+                    return vv[0]
+                ar = ar.outer
+            error(position, ErrorInfo.name_not_declared(identifier))
+        return name
+
+    # literals return a value from the constant pool, shared by every evaluation
+
+    def literal(self, node):
+        value = self.interpreter.constants.literal(node)
+
+        def literal():
+            return value
+        return literal
+
+    visit_NumLiteral = visit_StringLiteral = visit_BoolLiteral = visit_NullLiteral = literal
+
+
+class ClosureInterpreter(Interpreter):
+    """Interpreter which runs compiled closures instead of visiting the ast
+    """
+    def __init__(self):
+        super().__init__(resolve=False)
+        self.retval = None      # value of the return stat being handled
+
+    def interpret(self, tree):
+        ClosureCompiler(self).compile(tree)()
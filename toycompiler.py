@@ -0,0 +1,887 @@
+# -*- coding: utf-8 -*-
+"""
+toylang bytecode compiler and virtual machine
+
+a Program compiles to a CodeObject, each FuncDef to a nested CodeObject in
+the constant pool. instructions are parallel columns:
+    ops       : opcode of each instruction
+    args      : int argument, a slot, a constant, a ref, a count or a jump target
+    positions : source offset of each instruction, used by errors
+
+variables:
+- names declared in a block, loop or function scope get a slot of the frame,
+  a slot is None until the declaration runs and is cleared when the scope exits
+- names declared at program level are in the global activation record
+- a name is looked up in the slots of its enclosing scopes, then by name in
+  the caller frames and the global record, same as the dynamic scope of
+  Interpreter
+
+statements don't leave values on the stack, break/continue/return are jumps.
+"""
+from toyerror import *
+from toylexer import *
+from toyparser import *
+from toyast import *
+from toyvalue import *
+from toyinterpreter import Interpreter
+from toyresolver import declared_names, body_names
+
+from array import array
+import argparse
+
+
+# opcodes, ordered by how often the vm meets them
+OPNAMES = [
+    'LOAD_SLOT',            # slot: push the value of a slot, or look it up by name
+    'LOAD_NAME',            # ref (name, slots): look up in slots, then by name
+    'LOAD_NUM',             # const: push a shared NumValue
+    'BINOP',                # ref (impl, reverse, operator)
+    'POP_JUMP_IF_FALSE',    # target: pop a condition, jump if false
+    'JUMP',                 # target
+    'CALL_BEGIN',           # mark the function on top of stack
+    'ARG_GUARD',            # target: skip the args a function has no param for
+    'CALL',                 # call the marked function with the args above it
+    'RETURN',               # return the top of stack to the caller frame
+    'POP_TOP',
+    'STORE_SLOT',           # slot: pop to a declared slot, or assign by name
+    'STORE_NAME',           # ref (name, slots)
+    'COMPOUND',             # ref (impl, operator): pop r, pop l, impl(l, r)
+    'FOR_TEST',             # target: stack [end, step, cell], jump if not cell < end
+    'FOR_STEP',             # target: cell += step, jump
+    'FOREACH_NEXT',         # target: stack [container, key], push key, value or jump
+    'SET_LOOP_VAR',         # slot: pop to a const slot
+    'LOAD_STRING',          # const
+    'LOAD_BOOL',            # 0 or 1
+    'LOAD_NULL',
+    'GET_MEMBER',           # pop key, pop container, push member
+    'UNIOP',                # ref (impl, operator)
+    'DECLARE_SLOT',         # ref (slot, const): pop to a new slot
+    'DECLARE_GLOBAL',       # ref (name, const): pop to a new global
+    'EXIT_SCOPE',           # scope: clear the slots of a scope
+    'JUMP_IF_NOT_EQUAL',    # target: pop case value, compare with the switch value
+    'REVERSE',              # count: reverse the top values
+    'MAKE_FUNCTION',        # const: a CodeObject
+    'BUILD_LIST',           # count
+    'BUILD_MAP',
+    'MAP_ADD',              # pop value, pop key, set to the map on top
+    'CHECK_CONTAINER',      # the top is a list or a map to assign to
+    'SET_MEMBER',           # pop key, pop container, pop value
+    'CHECK_NUM',            # the top is a num
+    'FOR_INIT',             # slot: stack [start, end, step] -> [end, step, cell]
+    'FOREACH_BEGIN',        # check the container, push the first key
+    'POP_N',                # count
+    'RAISE',                # ref: error message
+    'HALT',
+]
+for _code, _name in enumerate(OPNAMES):
+    globals()[_name] = _code
+
+JUMP_OPS = {POP_JUMP_IF_FALSE, JUMP, ARG_GUARD, FOR_TEST, FOR_STEP, FOREACH_NEXT, JUMP_IF_NOT_EQUAL}
+SLOT_OPS = {LOAD_SLOT, STORE_SLOT, SET_LOOP_VAR, FOR_INIT}
+CONST_OPS = {LOAD_NUM, LOAD_STRING, MAKE_FUNCTION}
+REF_OPS = {LOAD_NAME, BINOP, STORE_NAME, COMPOUND, UNIOP, DECLARE_SLOT, DECLARE_GLOBAL, RAISE}
+
+
+class Label:
+    def __init__(self):
+        self.pc = None
+
+
+class CodeObject:
+    """bytecode of the program or a function
+    """
+    def __init__(self, name, ast=None):
+        self.name = name
+        self.ast = ast              # FuncDef of a function, None for the program
+        self.ops = []
+        self.args = []
+        self.positions = []
+        self.consts = []            # NumValue, StringValue, CodeObject
+        self.refs = []              # other instruction data
+        self.slot_names = []        # identifier of each slot
+        self.slot_depths = []       # scope depth of each slot
+        self.name_slots = {}        # identifier -> slots, innermost scope first
+        self.param_slots = []
+        self.scopes = []            # slots of each scope
+        self.handlers = []          # (start, end, position), a condition being evaluated
+        self.jumps = []             # (pc, label), patched by finish
+
+    def emit(self, op, arg=0, position=-1):
+        self.ops.append(op)
+        self.args.append(arg)
+        self.positions.append(-1 if position is None else position)
+        return len(self.ops) - 1
+
+    def emit_jump(self, op, label, position=-1):
+        self.jumps.append((self.emit(op, 0, position), label))
+
+    def place(self, label):
+        label.pc = len(self.ops)
+
+    def pc(self):
+        return len(self.ops)
+
+    def add_const(self, value):
+        self.consts.append(value)
+        return len(self.consts) - 1
+
+    def add_ref(self, ref):
+        self.refs.append(ref)
+        return len(self.refs) - 1
+
+    def add_slot(self, identifier, depth):
+        self.slot_names.append(identifier)
+        self.slot_depths.append(depth)
+        return len(self.slot_names) - 1
+
+    def finish(self):
+        """resolve jumps, pack the opcodes and positions
+
+        args stay a list, indexing a list is faster than a array in the vm loop
+        """
+        for pc, label in self.jumps:
+            self.args[pc] = label.pc
+        self.jumps = None
+        self.ops = bytes(self.ops)
+        self.positions = array('i', self.positions)
+        for slot, identifier in enumerate(self.slot_names):
+            self.name_slots.setdefault(identifier, []).append(slot)
+        for identifier, slots in self.name_slots.items():
+            slots.sort(key=lambda slot: -self.slot_depths[slot])
+            self.name_slots[identifier] = tuple(slots)
+        self.nslots = len(self.slot_names)
+        return self
+
+
+class Scope:
+    """a compile time scope, slots is None for the global scope
+    """
+    def __init__(self, parent, slots, index, depth):
+        self.parent = parent
+        self.slots = slots          # identifier -> slot
+        self.index = index          # index in CodeObject.scopes, None if no slots
+        self.depth = depth
+
+
+class Compiler(AstNodeVistor):
+    def __init__(self, constants=None):
+        self.constants = constants or ConstantPool()    # values of num and string consts
+        self.code = None
+        self.scope = None
+        self.loops = []             # (scope, break label, continue label)
+
+    def compile(self, tree: Program) -> CodeObject:
+        self.code = CodeObject('program')
+        self.scope = Scope(None, None, None, 0)
+        self.visit(tree)
+        self.code.emit(HALT)
+        return self.code.finish()
+
+    def emit(self, op, arg=0, position=-1):
+        return self.code.emit(op, arg, position)
+
+    def enter_scope(self, identifiers):
+        slots = {}
+        depth = self.scope.depth + 1
+        for identifier in identifiers:
+            if identifier not in slots:
+                slots[identifier] = self.code.add_slot(identifier, depth)
+        index = None
+        if slots:
+            self.code.scopes.append(tuple(slots.values()))
+            index = len(self.code.scopes) - 1
+        self.scope = Scope(self.scope, slots, index, depth)
+        return self.scope
+
+    def exit_scope(self):
+        self.clear_scope(self.scope)
+        self.scope = self.scope.parent
+
+    def clear_scope(self, scope):
+        if scope.index is not None:
+            self.emit(EXIT_SCOPE, scope.index)
+
+    def resolve(self, identifier):
+        """slots of a identifier in the enclosing scopes, innermost first
+        """
+        slots = []
+        scope = self.scope
+        while scope is not None and scope.slots is not None:
+            slot = scope.slots.get(identifier)
+            if slot is not None:
+                slots.append(slot)
+            scope = scope.parent
+        return slots
+
+    def statement(self, node):
+        self.visit(node)
+        if node.kind == FuncCall.kind:
+            self.emit(POP_TOP)
+
+    def condition(self, node, false_label):
+        start = self.code.pc()
+        self.visit(node)
+        self.code.emit_jump(POP_JUMP_IF_FALSE, false_label, node.position)
+        self.code.handlers.append((start, self.code.pc(), node.position))
+
+    def loop(self, break_label, continue_label):
+        self.loops.append((self.scope, break_label, continue_label))
+
+    def jump_out(self, node, keyword, index):
+        """jump to the break or continue label of the innermost loop
+        """
+        if not self.loops:
+            self.emit(RAISE, self.code.add_ref(ErrorInfo.invalid_syntax(keyword)), node.position)
+            return
+        loop_scope = self.loops[-1][0]
+        scope = self.scope
+        while scope is not loop_scope:
+            self.clear_scope(scope)
+            scope = scope.parent
+        self.code.emit_jump(JUMP, self.loops[-1][index], node.position)
+
+    def visit_Program(self, node: Program):
+        for stat in node.stats:
+            self.statement(stat)
+
+    def visit_EmptyStat(self, node: EmptyStat):
+        pass
+
+    def visit_BlockStat(self, node: BlockStat):
+        self.enter_scope([identifier for stat in node.stats for identifier in declared_names(stat)])
+        for stat in node.stats:
+            self.statement(stat)
+        self.exit_scope()
+
+    def visit_VarDeclStat(self, node: VarDeclStat):
+        left_num = len(node.names)
+        right_num = len(node.exprs) if node.exprs else 0
+        for i in range(left_num):
+            if i < right_num:
+                self.visit(node.exprs[i])
+            else:
+                self.emit(LOAD_NULL)
+        if left_num > 1:
+            self.emit(REVERSE, left_num)
+        for name in node.names:
+            if self.scope.slots is None:
+                self.emit(DECLARE_GLOBAL, self.code.add_ref((name.identifier, node.const)), name.position)
+            else:
+                slot = self.scope.slots[name.identifier]
+                self.emit(DECLARE_SLOT, self.code.add_ref((slot, node.const)), name.position)
+
+    def visit_IfStat(self, node: IfStat):
+        end_label = Label()
+        for cond_expr, stat in zip(node.cond_exprs, node.stats):
+            next_label = Label()
+            self.condition(cond_expr, next_label)
+            self.statement(stat)
+            self.code.emit_jump(JUMP, end_label)
+            self.code.place(next_label)
+        self.code.place(end_label)
+
+    def visit_SwitchStat(self, node: SwitchStat):
+        end_label = Label()
+        self.visit(node.expr)
+        for case_expr, case_stat in zip(node.case_exprs, node.case_stats):
+            next_label = Label()
+            self.visit(case_expr)
+            self.code.emit_jump(JUMP_IF_NOT_EQUAL, next_label, case_expr.position)
+            self.emit(POP_TOP)
+            self.statement(case_stat)
+            self.code.emit_jump(JUMP, end_label)
+            self.code.place(next_label)
+        self.emit(POP_TOP)
+        if node.default_stat:
+            self.statement(node.default_stat)
+        self.code.place(end_label)
+
+    def visit_RepeatStat(self, node: RepeatStat):
+        body_label, continue_label, break_label = Label(), Label(), Label()
+        self.enter_scope(body_names(node.stat))
+        self.loop(break_label, continue_label)
+        self.code.place(body_label)
+        self.statement(node.stat)
+        self.loops.pop()
+        self.code.place(continue_label)
+        self.condition(node.expr, body_label)
+        self.code.place(break_label)
+        self.exit_scope()
+
+    def visit_WhileStat(self, node: WhileStat):
+        continue_label, break_label = Label(), Label()
+        self.enter_scope(body_names(node.stat))
+        self.code.place(continue_label)
+        self.condition(node.expr, break_label)
+        self.loop(break_label, continue_label)
+        self.statement(node.stat)
+        self.loops.pop()
+        self.code.emit_jump(JUMP, continue_label)
+        self.code.place(break_label)
+        self.exit_scope()
+
+    def visit_ForloopStat(self, node: ForloopStat):
+        test_label, continue_label, break_label = Label(), Label(), Label()
+        self.visit(node.start_expr)
+        self.emit(CHECK_NUM, 0, node.start_expr.position)
+        self.visit(node.end_expr)
+        self.emit(CHECK_NUM, 0, node.end_expr.position)
+        if node.step_expr:
+            self.visit(node.step_expr)
+        else:
+            self.emit(LOAD_NUM, self.code.add_const(self.constants.num('1', True)))
+        self.enter_scope([node.var_name.identifier] + body_names(node.stat))
+        self.emit(FOR_INIT, self.scope.slots[node.var_name.identifier])
+        self.code.place(test_label)
+        self.code.emit_jump(FOR_TEST, break_label)
+        self.loop(break_label, continue_label)
+        self.statement(node.stat)
+        self.loops.pop()
+        self.code.place(continue_label)
+        self.code.emit_jump(FOR_STEP, test_label)
+        self.code.place(break_label)
+        self.emit(POP_N, 3)
+        self.exit_scope()
+
+    def visit_ForeachStat(self, node: ForeachStat):
+        next_label, break_label = Label(), Label()
+        names = [node.key_name.identifier]
+        if node.val_name is not None:
+            names.append(node.val_name.identifier)
+        self.enter_scope(names + body_names(node.stat))
+        self.visit(node.expr)
+        self.emit(FOREACH_BEGIN, 0, node.position)
+        self.code.place(next_label)
+        self.code.emit_jump(FOREACH_NEXT, break_label)
+        if node.val_name is not None:
+            self.emit(SET_LOOP_VAR, self.scope.slots[node.val_name.identifier])
+            self.emit(SET_LOOP_VAR, self.scope.slots[node.key_name.identifier])
+        else:
+            self.emit(SET_LOOP_VAR, self.scope.slots[node.key_name.identifier])
+            self.emit(POP_TOP)
+        self.loop(break_label, next_label)
+        self.statement(node.stat)
+        self.loops.pop()
+        self.code.emit_jump(JUMP, next_label)
+        self.code.place(break_label)
+        self.emit(POP_N, 2)
+        self.exit_scope()
+
+    def visit_BreakStat(self, node: BreakStat):
+        self.jump_out(node, 'break', 1)
+
+    def visit_ContinueStat(self, node: ContinueStat):
+        self.jump_out(node, 'continue', 2)
+
+    def visit_ReturnStat(self, node: ReturnStat):
+        if self.code.ast is None:
+            self.emit(RAISE, self.code.add_ref(ErrorInfo.invalid_syntax('return')), node.position)
+            return
+        if node.expr is not None:
+            self.visit(node.expr)
+        else:
+            self.emit(LOAD_NULL)
+        self.emit(RETURN, 0, node.position)
+
+    def store(self, left_expr):
+        """pop the top of stack to a lvalue_expr
+        """
+        if left_expr.kind == Name.kind:
+            slots = self.resolve(left_expr.identifier)
+            if len(slots) == 1:
+                self.emit(STORE_SLOT, slots[0], left_expr.position)
+            else:
+                self.emit(STORE_NAME, self.code.add_ref((left_expr.identifier, tuple(slots))), left_expr.position)
+        else:
+            assert(left_expr.kind == AccessExpr.kind)
+            self.visit(left_expr.expr)
+            self.emit(CHECK_CONTAINER, 0, left_expr.expr.position)
+            self.visit(left_expr.field_expr)
+            self.emit(SET_MEMBER, 0, left_expr.position)
+
+    def visit_AssignStat(self, node: AssignStat):
+        left_num = len(node.left_exprs)
+        right_num = len(node.right_exprs)
+        for i in range(left_num):
+            if i < right_num:
+                self.visit(node.right_exprs[i])
+            else:
+                self.emit(LOAD_NULL)
+        if left_num > 1:
+            self.emit(REVERSE, left_num)
+        for left_expr in node.left_exprs:
+            self.store(left_expr)
+
+    def visit_CompoundAssignStat(self, node: CompoundAssignStat):
+        self.visit(node.left_expr)
+        self.visit(node.right_expr)
+        ref = (BINOP_IMPL_TABLE.get(node.operator), node.operator.value)
+        self.emit(COMPOUND, self.code.add_ref(ref), node.position)
+
+    def visit_FuncDef(self, node: FuncDef):
+        outer = (self.code, self.scope, self.loops)
+        self.code = CodeObject(FunctionValue(node).signature, ast=node)
+        self.scope = Scope(None, None, None, 0)
+        self.loops = []
+        param_names = [name.identifier for name in node.param_names] if node.param_names else []
+        self.enter_scope(param_names + [identifier for stat in node.body for identifier in declared_names(stat)])
+        self.code.param_slots = [self.scope.slots[identifier] for identifier in param_names]
+        for stat in node.body:
+            self.statement(stat)
+        self.emit(LOAD_NULL)
+        self.emit(RETURN)
+        code = self.code.finish()
+        self.code, self.scope, self.loops = outer
+        self.emit(MAKE_FUNCTION, self.code.add_const(code), node.position)
+
+    def visit_FuncCall(self, node: FuncCall):
+        call_label = Label()
+        self.visit(node.func_expr)
+        self.emit(CALL_BEGIN)
+        if node.arg_exprs:
+            for arg_expr in node.arg_exprs:
+                self.code.emit_jump(ARG_GUARD, call_label)
+                self.visit(arg_expr)
+        self.code.place(call_label)
+        self.emit(CALL, 0, node.position)
+
+    def visit_SelectExpr(self, node: SelectExpr):
+        else_label, end_label = Label(), Label()
+        self.condition(node.cond, else_label)
+        self.visit(node.expr1)
+        self.code.emit_jump(JUMP, end_label)
+        self.code.place(else_label)
+        self.visit(node.expr2)
+        self.code.place(end_label)
+
+    def visit_BinOpExpr(self, node: BinOpExpr):
+        self.visit(node.left_expr)
+        self.visit(node.right_expr)
+        operator = node.operator
+        reverse = False
+        if operator == TokenType.NE:
+            reverse = True
+            operator = TokenType.EQ
+        elif operator == TokenType.GE:
+            reverse = True
+            operator = TokenType.LT
+        elif operator == TokenType.GT:
+            reverse = True
+            operator = TokenType.LE
+        ref = (BINOP_IMPL_TABLE.get(operator), reverse, operator.value)
+        self.emit(BINOP, self.code.add_ref(ref), node.position)
+
+    def visit_UniOpExpr(self, node: UniOpExpr):
+        self.visit(node.expr)
+        ref = (UNIOP_IMPL_TABLE.get(node.operator), node.operator.value)
+        self.emit(UNIOP, self.code.add_ref(ref), node.position)
+
+    def visit_ListCtorExpr(self, node: ListCtorExpr):
+        exprs = node.exprs or []
+        for expr in exprs:
+            self.visit(expr)
+        self.emit(BUILD_LIST, len(exprs), node.position)
+
+    def visit_MapCtorExpr(self, node: MapCtorExpr):
+        self.emit(BUILD_MAP, 0, node.position)
+        for key_expr, value_expr in zip(node.key_exprs, node.value_exprs):
+            self.visit(key_expr)
+            if value_expr:
+                self.visit(value_expr)
+            else:
+                self.emit(LOAD_NULL)
+            self.emit(MAP_ADD)
+
+    def visit_SetCtorExpr(self, node: SetCtorExpr):
+        self.emit(RAISE, self.code.add_ref('TODO: set not implement!'), node.position)
+
+    def visit_AccessExpr(self, node: AccessExpr):
+        self.visit(node.expr)
+        self.visit(node.field_expr)
+        self.emit(GET_MEMBER, 0, node.position)
+
+    def visit_Name(self, node: Name):
+        slots = self.resolve(node.identifier)
+        if len(slots) == 1:
+            self.emit(LOAD_SLOT, slots[0], node.position)
+        else:
+            self.emit(LOAD_NAME, self.code.add_ref((node.identifier, tuple(slots))), node.position)
+
+    def visit_NumLiteral(self, node: NumLiteral):
+        self.emit(LOAD_NUM, self.code.add_const(self.constants.num(node.value, node.is_int)), node.position)
+
+    def visit_StringLiteral(self, node: StringLiteral):
+        self.emit(LOAD_STRING, self.code.add_const(self.constants.string(node.value)), node.position)
+
+    def visit_BoolLiteral(self, node: BoolLiteral):
+        self.emit(LOAD_BOOL, 1 if node.value == 'true' else 0, node.position)
+
+    def visit_NullLiteral(self, node: NullLiteral):
+        self.emit(LOAD_NULL, 0, node.position)
+
+
+class Frame:
+    __slots__ = ('code', 'slots', 'stack', 'calls', 'pc', 'caller')
+
+    def __init__(self, code, slots, caller):
+        self.code = code
+        self.slots = slots
+        self.stack = []
+        self.calls = []         # stack index of each function being called
+        self.pc = 0
+        self.caller = caller
+
+
+class VMInterpreter(Interpreter):
+    """Interpreter which compiles the tree to bytecode and runs it on a vm
+    """
+    def __init__(self):
+        super().__init__(resolve=False)
+        self.globals = self.call_stack.current_ar.members
+
+    def interpret(self, tree):
+        self.run(Compiler(self.constants).compile(tree))
+
+    def lookup(self, frame, identifier):
+        """value of a name in frame and its callers, then the globals
+        """
+        while frame is not None:
+            slots = frame.slots
+            for slot in frame.code.name_slots.get(identifier, ()):
+                vv = slots[slot]
+                if vv is not None and vv[0] is not None:
+                    return vv[0]
+            frame = frame.caller
+        vv = self.globals.get(identifier)
+        if vv is not None:
+            return vv[0]
+        return None
+
+    def assign(self, frame, identifier, value, position):
+        while frame is not None:
+            slots = frame.slots
+            for slot in frame.code.name_slots.get(identifier, ()):
+                vv = slots[slot]
+                if vv is not None:
+                    if vv[1]:
+                        self.error(position, ErrorInfo.name_not_assignable(identifier))
+                    vv[0] = value
+                    return
+            frame = frame.caller
+        vv = self.globals.get(identifier)
+        if vv is None:
+            self.error(position, ErrorInfo.name_not_declared(identifier))
+        if vv[1]:
+            self.error(position, ErrorInfo.name_not_assignable(identifier))
+        vv[0] = value
+
+    def run(self, code: CodeObject):
+        frame = Frame(code, [None] * code.nslots, None)
+        ops, args, positions = code.ops, code.args, code.positions
+        consts, refs = code.consts, code.refs
+        slots, stack, calls = frame.slots, frame.stack, frame.calls
+        push, pop = stack.append, stack.pop
+        error = self.error
+        true, false, null = self.constants.true, self.constants.false, self.constants.null
+        pc = 0
+        try:
+            while True:
+                op = ops[pc]
+                arg = args[pc]
+                pc += 1
+                if op == LOAD_SLOT:
+                    vv = slots[arg]
+                    if vv is not None and vv[0] is not None:
+                        push(vv[0])
+                    else:
+                        identifier = code.slot_names[arg]
+                        value = self.lookup(frame.caller, identifier)
+                        if value is None:
+                            error(positions[pc - 1], ErrorInfo.name_not_declared(identifier))
+                        push(value)
+                elif op == LOAD_NAME:
+                    identifier, name_slots = refs[arg]
+                    for slot in name_slots:
+                        vv = slots[slot]
+                        if vv is not None and vv[0] is not None:
+                            push(vv[0])
+                            break
+                    else:
+                        value = self.lookup(frame.caller, identifier)
+                        if value is None:
+                            error(positions[pc - 1], ErrorInfo.name_not_declared(identifier))
+                        push(value)
+                elif op == LOAD_NUM:
+                    push(consts[arg])
+                elif op == BINOP:
+                    impl, reverse, operator = refs[arg]
+                    right_val = pop()
+                    left_val = pop()
+                    if impl is None:
+                        error(positions[pc - 1], ErrorInfo.op_not_implemented(operator))
+                    try:
+                        result = impl(left_val, right_val)
+                        if reverse:
+                            result._val = not result._val
+                    except ValueTypeError as e:
+                        error(positions[pc - 1], ErrorInfo.expr_value_error(e.message))
+                    push(result)
+                elif op == POP_JUMP_IF_FALSE:
+                    if not OpImpl.convert_to_bool(pop())._val:
+                        pc = arg
+                elif op == JUMP:
+                    pc = arg
+                elif op == CALL_BEGIN:
+                    func_val = stack[-1]
+                    if type(func_val) != HostFunctionValue:
+                        assert(type(func_val) == FunctionValue)
+                    calls.append(len(stack) - 1)
+                elif op == ARG_GUARD:
+                    base = calls[-1]
+                    func_val = stack[base]
+                    if type(func_val) == FunctionValue and len(stack) - base - 1 >= len(func_val.code.param_slots):
+                        pc = arg
+                elif op == CALL:
+                    base = calls.pop()
+                    func_val = stack[base]
+                    argv = [unshare(value) for value in stack[base + 1:]]
+                    del stack[base:]
+                    if type(func_val) == HostFunctionValue:
+                        try:
+                            result = func_val._func(argv)
+                        except ValueTypeError as e:
+                            error(positions[pc - 1], ErrorInfo.general(e.message))
+                        if result:
+                            if not isinstance(result, Value):
+                                error(positions[pc - 1], ErrorInfo.general("host function return invalid type value"))
+                            push(result)
+                        else:
+                            push(NullValue())
+                        continue
+                    # enter the function frame
+                    code = func_val.code
+                    new_slots = [None] * code.nslots
+                    argc = len(argv)
+                    for i, slot in enumerate(code.param_slots):
+                        new_slots[slot] = [argv[i] if i < argc else None, False]
+                    frame.pc = pc
+                    frame = Frame(code, new_slots, frame)
+                    ops, args, positions = code.ops, code.args, code.positions
+                    consts, refs = code.consts, code.refs
+                    slots, stack, calls = frame.slots, frame.stack, frame.calls
+                    push, pop = stack.append, stack.pop
+                    pc = 0
+                elif op == RETURN:
+                    value = pop()
+                    frame = frame.caller
+                    code = frame.code
+                    ops, args, positions = code.ops, code.args, code.positions
+                    consts, refs = code.consts, code.refs
+                    slots, stack, calls = frame.slots, frame.stack, frame.calls
+                    push, pop = stack.append, stack.pop
+                    pc = frame.pc
+                    push(value)
+                elif op == POP_TOP:
+                    pop()
+                elif op == STORE_SLOT:
+                    vv = slots[arg]
+                    if vv is not None:
+                        if vv[1]:
+                            error(positions[pc - 1], ErrorInfo.name_not_assignable(code.slot_names[arg]))
+                        vv[0] = unshare(pop())
+                    else:
+                        self.assign(frame.caller, code.slot_names[arg], unshare(pop()), positions[pc - 1])
+                elif op == STORE_NAME:
+                    identifier, name_slots = refs[arg]
+                    for slot in name_slots:
+                        vv = slots[slot]
+                        if vv is not None:
+                            if vv[1]:
+                                error(positions[pc - 1], ErrorInfo.name_not_assignable(identifier))
+                            vv[0] = unshare(pop())
+                            break
+                    else:
+                        self.assign(frame.caller, identifier, unshare(pop()), positions[pc - 1])
+                elif op == COMPOUND:
+                    impl, operator = refs[arg]
+                    right_val = pop()
+                    left_val = pop()
+                    if impl is None:
+                        error(positions[pc - 1], ErrorInfo.op_not_implemented(operator))
+                    try:
+                        impl(left_val, right_val)
+                    except ValueTypeError as e:
+                        error(positions[pc - 1], ErrorInfo.expr_value_error(e.message))
+                elif op == FOR_TEST:
+                    if not OpImpl.lt(stack[-1][0], stack[-3])._val:
+                        pc = arg
+                elif op == FOR_STEP:
+                    cell = stack[-1]
+                    cell[0] = OpImpl.add(cell[0], stack[-2])
+                    pc = arg
+                elif op == FOREACH_NEXT:
+                    key, value = OpImpl.next(stack[-2], stack[-1])
+                    if type(key) == NullValue:
+                        pc = arg
+                    else:
+                        stack[-1] = key
+                        push(key)
+                        push(value)
+                elif op == SET_LOOP_VAR:
+                    slots[arg] = [pop(), True]
+                elif op == LOAD_STRING:
+                    push(consts[arg])
+                elif op == LOAD_BOOL:
+                    push(true if arg == 1 else false)
+                elif op == LOAD_NULL:
+                    push(null)
+                elif op == GET_MEMBER:
+                    key = pop()
+                    container = pop()
+                    if type(container) not in (ListValue, MapValue):
+                        error(positions[pc - 1], 'TODO: built-in field access not implement!')
+                    try:
+                        push(OpImpl.get_member(container, key))
+                    except MemberAccessError as e:
+                        error(positions[pc - 1], ErrorInfo.general(e.message))
+                elif op == UNIOP:
+                    impl, operator = refs[arg]
+                    value = pop()
+                    if impl is None:
+                        error(positions[pc - 1], ErrorInfo.op_not_implemented(operator))
+                    try:
+                        push(impl(value))
+                    except ValueTypeError as e:
+                        error(positions[pc - 1], ErrorInfo.expr_value_error(e.message))
+                elif op == DECLARE_SLOT:
+                    slot, const = refs[arg]
+                    if slots[slot] is not None:
+                        error(positions[pc - 1], ErrorInfo.name_duplicate_declared(code.slot_names[slot]))
+                    slots[slot] = [unshare(pop()), const]
+                elif op == DECLARE_GLOBAL:
+                    identifier, const = refs[arg]
+                    if identifier in self.globals:
+                        error(positions[pc - 1], ErrorInfo.name_duplicate_declared(identifier))
+                    self.globals[identifier] = [unshare(pop()), const]
+                elif op == EXIT_SCOPE:
+                    for slot in code.scopes[arg]:
+                        slots[slot] = None
+                elif op == JUMP_IF_NOT_EQUAL:
+                    case_val = pop()
+                    if not OpImpl.eq(stack[-1], case_val)._val:
+                        pc = arg
+                elif op == REVERSE:
+                    stack[-arg:] = stack[:-arg - 1:-1]
+                elif op == MAKE_FUNCTION:
+                    func_code = consts[arg]
+                    func_val = FunctionValue(_ast=func_code.ast)
+                    func_val.code = func_code
+                    push(func_val)
+                elif op == BUILD_LIST:
+                    if arg:
+                        values = [unshare(value) for value in stack[-arg:]]
+                        del stack[-arg:]
+                    else:
+                        values = []
+                    push(ListValue(_val=values))
+                elif op == BUILD_MAP:
+                    push(MapValue(_val={}))
+                elif op == MAP_ADD:
+                    value = unshare(pop())
+                    key = unshare(pop())
+                    OpImpl.set_member(stack[-1], key, value)
+                elif op == CHECK_CONTAINER:
+                    if type(stack[-1]) not in (ListValue, MapValue):
+                        error(positions[pc - 1], ErrorInfo.general('expr not list or map'))
+                elif op == SET_MEMBER:
+                    key = pop()
+                    container = pop()
+                    try:
+                        OpImpl.set_member(container=container, key=key, value=unshare(pop()))
+                    except MemberAccessError as e:
+                        error(positions[pc - 1], ErrorInfo.general(e.message))
+                elif op == CHECK_NUM:
+                    if not isinstance(stack[-1], NumValue):
+                        error(positions[pc - 1], ErrorInfo.expr_type_error('num'))
+                elif op == FOR_INIT:
+                    step_val = pop()
+                    end_val = pop()
+                    cell = [unshare(pop()), True]
+                    slots[arg] = cell
+                    push(end_val)
+                    push(step_val)
+                    push(cell)
+                elif op == FOREACH_BEGIN:
+                    if type(stack[-1]) not in (ListValue, MapValue):
+                        error(positions[pc - 1], 'TODO: foreach now only support list and map')
+                    push(NullValue())
+                elif op == POP_N:
+                    del stack[-arg:]
+                elif op == RAISE:
+                    error(positions[pc - 1], refs[arg])
+                elif op == HALT:
+                    return
+                else:
+                    raise Exception(f'unknown opcode {op}')
+        except ValueTypeError as e:
+            # a condition being evaluated turns it to a expr value error, like Interpreter
+            frame.pc = pc
+            while frame is not None:
+                for start, end, position in frame.code.handlers:
+                    if start <= frame.pc - 1 < end:
+                        error(position, ErrorInfo.expr_value_error(e.message))
+                frame = frame.caller
+            raise
+
+
+def disassemble(code: CodeObject, line_table=None):
+    """print the instructions of code and the functions in it
+    """
+    def location(position):
+        if position < 0:
+            return ''
+        if line_table is None:
+            return str(position)
+        line, col = line_table.resolve(position)
+        return f'{line}:{col}'
+
+    print(f'code {code.name}: {len(code.ops)} ops, {code.nslots} slots, {len(code.consts)} consts')
+    for pc, (op, arg, position) in enumerate(zip(code.ops, code.args, code.positions)):
+        info = ''
+        if op in JUMP_OPS:
+            info = f'-> {arg}'
+        elif op in SLOT_OPS:
+            info = f'({code.slot_names[arg]})'
+        elif op in CONST_OPS:
+            const = code.consts[arg]
+            info = f'({const.name})' if isinstance(const, CodeObject) else f'({const!r})'
+        elif op in REF_OPS:
+            ref = code.refs[arg]
+            if op in (BINOP, UNIOP, COMPOUND):
+                info = f'({ref[-1]})'
+            elif op in (LOAD_NAME, STORE_NAME):
+                info = f'({ref[0]})'
+            elif op == DECLARE_SLOT:
+                info = f'({code.slot_names[ref[0]]}{", const" if ref[1] else ""})'
+            elif op == DECLARE_GLOBAL:
+                info = f'({ref[0]}{", const" if ref[1] else ""})'
+            else:
+                info = f'({ref})'
+        elif op == EXIT_SCOPE:
+            info = '(' + ', '.join(code.slot_names[slot] for slot in code.scopes[arg]) + ')'
+        print(f'{pc:>6} {location(position):>8}  {OPNAMES[op]:<18} {arg:<6} {info}')
+    for const in code.consts:
+        if isinstance(const, CodeObject):
+            print()
+            disassemble(const, line_table)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='toylang bytecode compiler')
+    parser.add_argument('file', help='source file')
+    args = parser.parse_args()
+
+    with open(args.file, 'r', encoding='utf-8') as f:
+        text = f.read()
+    tree = Parser(Lexer(text)).parse()
+    disassemble(Compiler().compile(tree), LineTable.from_text(text))
@@ -61,7 +61,8 @@ class Displayer(AstNodeVistor):
         for case, stat in zip(node.case_exprs, node.case_stats):
             data['children'].append({'name': 'case', 'children': [self.visit(case), self.visit(stat)]})
         # default
-        data['children'].append({'name': 'default', 'children': [self.visit(node.default_stat)]})
+        if node.default_stat:
+            data['children'].append({'name': 'default', 'children': [self.visit(node.default_stat)]})
         return data
 
     def visit_RepeatStat(self, node: RepeatStat):
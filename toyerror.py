@@ -83,11 +83,21 @@ class Error(Exception):
 
 class GrammarError(Error):
     def __init__(self, position, message):
-        self.position = position
+        self.position = position        # source offset
+        self.line_table = None
         super().__init__(message)
 
+    def locate(self, line_table):
+        """set the line table of the source, used to show the position as line:col
+        """
+        self.line_table = line_table
+        return self
+
     def __str__(self):
-        return f'{self.__class__.__name__}: <{self.position[0]}:{self.position[1]}>: {self.message}'
+        if self.line_table is None:
+            return f'{self.__class__.__name__}: <@{self.position}>: {self.message}'
+        line, col = self.line_table.resolve(self.position)
+        return f'{self.__class__.__name__}: <{line}:{col}>: {self.message}'
 
 
 class LexerError(GrammarError):
@@ -111,3 +121,6 @@ class ValueTypeError(Error):
 
 class MemberAccessError(Error):
     pass
+
+class SerialError(Error):
+    pass
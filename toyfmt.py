@@ -12,6 +12,7 @@ from toyvalue import *
 from toylib import *
 import toylog
 import argparse
+import sys
 
 
 class Formator(AstNodeVistor):
@@ -34,7 +35,7 @@ class Formator(AstNodeVistor):
             self.output('    ' * self.level)
 
     def branch(self, stat):
-        if type(stat) == BlockStat:
+        if stat.kind == BlockStat.kind:
             self.output(f' ')
             self.visit(stat)
         else:
@@ -98,7 +99,7 @@ class Formator(AstNodeVistor):
 
         if i < len(node.cond_exprs):
             expr = node.cond_exprs[i]
-            if type(expr) == BoolLiteral and expr.value == 'true':
+            if expr.kind == BoolLiteral.kind and expr.value == 'true':
                 self.newline()
                 self.indent()
                 self.output('else')
@@ -221,14 +222,17 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='toylang formator')
     parser.add_argument('file', help='source file')
     parser.add_argument('--tight', action='store_true', help='tight mode')
+    parser.add_argument('--optimize', action='store_true', help='format the source after toyoptimizer passes, print what they changed to stderr')
     args = parser.parse_args()
 
     with open(args.file, 'r', encoding='utf-8') as f:
-        code = f.read()
+        lexer = Lexer.from_file(f)
+        parser = Parser(lexer)
+        tree = parser.parse()
 
-    lexer = Lexer(code)
-    parser = Parser(lexer)
-    tree = parser.parse()
+    if args.optimize:
+        from toyoptimizer import optimize
+        print(f'optimize: {optimize(tree)}', file=sys.stderr)
 
     formator = Formator(tree, tight=args.tight)
     formator.format()
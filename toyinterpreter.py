@@ -9,6 +9,8 @@ from toyast import *
 from toydisplayer import *
 from toyvalue import *
 from toylib import *
+from toycache import parse_file
+from toyresolver import Resolver, GLOBAL_DEPTH
 import toylog
 
 import argparse
@@ -22,11 +24,31 @@ class ARType(Enum):
     FUNCTION  = 'FUNCTION'
 
 
-class ARState(Enum):
-    NORMAL    = 'NORMAL'
-    BREAKED   = 'BREAKED'
-    CONTINUED = 'CONTINUED'
-    RETURNED  = 'RETURNED'
+class BreakSignal(Exception):
+    """raised by break, caught by the loop it stops
+    """
+
+
+class ContinueSignal(Exception):
+    """raised by continue, caught by the loop it continues
+    """
+
+
+class ReturnSignal(Exception):
+    """raised by return, caught by the function call it returns from
+    """
+    def __init__(self, value):
+        self.value = value
+
+
+class TailCallSignal(Exception):
+    """raised by `return f(args)` with the args evaluated, caught by the
+    function call it returns from, which calls f in its place
+    """
+    def __init__(self, func_val, arg_vals, node):
+        self.func_val = func_val
+        self.arg_vals = arg_vals
+        self.node = node
 
 
 class ActivationRecord:
@@ -35,13 +57,10 @@ class ActivationRecord:
         self.members = {}       # identifier -> [value, const]
         self.outer = None
         self.nesting_level = 0
-        # below used for function and loop
         self.type = type
-        self.state = ARState.NORMAL
-        self.retval = None
 
     def __str__(self) -> str:
-        lines = [f'{self.nesting_level}: {self.name} {self.type.value} {self.state.value}']
+        lines = [f'{self.nesting_level}: {self.name} {self.type.value}']
         for name, vv in self.members.items():
             lines.append(f'    {name:<20}: {vv[0].type():<12}: {vv[0]} {"const" if vv[1] else ""}')
         return 'ACTIVATION RECORD:\n' + '\n'.join(lines)
@@ -78,6 +97,42 @@ class ActivationRecord:
         ToyLib.register(self.set_values)
 
 
+class SlotActivationRecord(ActivationRecord):
+    """activation record with members in slots, laid out by a toyresolver scope
+    """
+    def __init__(self, name, type, scope):
+        self.name = name
+        self.scope = scope                  # identifier -> slot
+        self.slots = [None] * len(scope)    # [value, const], None until declared
+        self.outer = None
+        self.nesting_level = 0
+        self.type = type
+
+    @property
+    def members(self):
+        return {identifier: self.slots[slot] for identifier, slot in self.scope.items() if self.slots[slot] is not None}
+
+    def set(self, key, value, const):
+        self.slots[self.scope[key]] = [value, const]
+
+    def get(self, key):
+        slot = self.scope.get(key)
+        vv = self.slots[slot] if slot is not None else None
+        if vv is None:
+            return None, None
+        else:
+            return vv[0], vv[1]
+
+    def has(self, key):
+        slot = self.scope.get(key)
+        return slot is not None and self.slots[slot] is not None
+
+    def set_values(self, keys, values, const):
+        assert(len(keys) == len(values))
+        for k, v in zip(keys, values):
+            self.set(k, v, const)
+
+
 class CallStack:
     def __init__(self):
         self.stack = []
@@ -96,18 +151,27 @@ class CallStack:
         self.current_ar = self.current_ar.outer
         return self.stack.pop()
 
+    def unwind(self, ar: ActivationRecord):
+        """pop records until ar is the current one
+        """
+        while self.current_ar is not ar:
+            self.pop()
+
     def __str__(self):
         s = '\n----------------------------------------\n'.join(repr(ar) for ar in reversed(self.stack))
         return f'CALL STACK:\n========================================\n{s}\n========================================\n'
 
 
 class Interpreter(AstNodeVistor):
-    def __init__(self):
+    def __init__(self, resolve=True):
         self.call_stack = CallStack()
+        self.resolver = Resolver() if resolve else None
+        self.constants = ConstantPool()
 
         ar = ActivationRecord('__global', type=ARType.PROGRAM)
         ar.init_builtins()
         self.enter_ar(ar)
+        self.global_ar = ar
 
     def error(self, position, message):
         raise InterpreterError(position, message)
@@ -122,6 +186,18 @@ class Interpreter(AstNodeVistor):
         toylog.debug(self.call_stack)
         self.call_stack.pop()
 
+    def new_ar(self, name, type, scope):
+        """slot record for a resolved scope, dict record otherwise
+        """
+        if scope is None:
+            return ActivationRecord(name, type)
+        return SlotActivationRecord(name, type, scope)
+
+    def unwind(self):
+        """drop records left by an error, back to the global record
+        """
+        self.call_stack.unwind(self.global_ar)
+
     def visit_Program(self, node: Program):
         for stat in node.stats:
             self.visit(stat)
@@ -130,22 +206,13 @@ class Interpreter(AstNodeVistor):
         pass
 
     def visit_BlockStat(self, node: BlockStat):
-        ar = ActivationRecord(f'block<{node.position[0]}:{node.position[1]}>', ARType.BLOCK)
-        self.enter_ar(ar)
+        if node.elided:             # runs in the enclosing record
+            for stat in node.stats:
+                self.visit(stat)
+            return
+        self.enter_ar(self.new_ar(f'block<{node.position}>', ARType.BLOCK, node.scope))
         for stat in node.stats:
             self.visit(stat)
-            if ar.state == ARState.RETURNED:
-                ar.state = ARState.NORMAL
-                toylog.info(f'[!] {ar.name:<12} pass return')
-                break
-            elif ar.state == ARState.BREAKED:
-                ar.state = ARState.NORMAL
-                toylog.info(f'[!] {ar.name:<12} pass break')
-                break
-            elif ar.state == ARState.CONTINUED:
-                ar.state = ARState.NORMAL
-                toylog.info(f'[!] {ar.name:<12} pass continue')
-                break
         self.exit_ar()
 
     def visit_VarDeclStat(self, node: VarDeclStat):
@@ -153,7 +220,7 @@ class Interpreter(AstNodeVistor):
         right_num = len(node.exprs) if node.exprs else 0
         values = []
         for i in range(left_num):
-            values.append(self.visit(node.exprs[i]) if i < right_num else NullValue())
+            values.append(unshare(self.visit(node.exprs[i])) if i < right_num else NullValue())
         ar = self.call_stack.current_ar
         for i in range(left_num):
             name = node.names[i]
@@ -185,58 +252,58 @@ class Interpreter(AstNodeVistor):
             self.visit(node.default_stat)
 
     def visit_RepeatStat(self, node: RepeatStat):
-        ar = ActivationRecord(f'repeat<{node.position[0]}:{node.position[1]}>', ARType.LOOP)
-        self.enter_ar(ar)
+        if node.elided:             # no break or continue of its own
+            ar = self.call_stack.current_ar
+        else:
+            ar = self.new_ar(f'repeat<{node.position}>', ARType.LOOP, node.scope)
+            self.enter_ar(ar)
         while True:
-            self.visit(node.stat)
-            if ar.state == ARState.RETURNED:
-                ar.state = ARState.NORMAL
-                toylog.info(f'[!] {ar.name:<12} pass return')
-                break
-            elif ar.state == ARState.BREAKED:
-                ar.state = ARState.NORMAL
+            try:
+                self.visit(node.stat)
+            except BreakSignal:
+                self.call_stack.unwind(ar)
                 toylog.info(f'[!] {ar.name:<12} handle break')
                 break
-            elif ar.state == ARState.CONTINUED:
-                ar.state = ARState.NORMAL
+            except ContinueSignal:
+                self.call_stack.unwind(ar)
                 toylog.info(f'[!] {ar.name:<12} handle continue')
-                # do nothing
             try:
                 expr_val = OpImpl.convert_to_bool(self.visit(node.expr))
             except ValueTypeError as e:
                 self.error(node.expr.position, ErrorInfo.expr_value_error(e.message))
             if expr_val._val:
                 break
-        self.exit_ar()
+        if not node.elided:
+            self.exit_ar()
 
     def visit_WhileStat(self, node: WhileStat):
-        ar = ActivationRecord(f'while<{node.position[0]}:{node.position[1]}>', ARType.LOOP)
-        self.enter_ar(ar)
+        if node.elided:             # no break or continue of its own
+            ar = self.call_stack.current_ar
+        else:
+            ar = self.new_ar(f'while<{node.position}>', ARType.LOOP, node.scope)
+            self.enter_ar(ar)
         while True:
             try:
                 expr_val = OpImpl.convert_to_bool(self.visit(node.expr))
             except ValueTypeError as e:
                 self.error(node.expr.position, ErrorInfo.expr_value_error(e.message))
             if expr_val._val:
-                self.visit(node.stat)
-                if ar.state == ARState.RETURNED:
-                    ar.state = ARState.NORMAL
-                    toylog.info(f'[!] {ar.name:<12} pass return')
-                    break
-                elif ar.state == ARState.BREAKED:
-                    ar.state = ARState.NORMAL
+                try:
+                    self.visit(node.stat)
+                except BreakSignal:
+                    self.call_stack.unwind(ar)
                     toylog.info(f'[!] {ar.name:<12} handle break')
                     break
-                elif ar.state == ARState.CONTINUED:
-                    ar.state = ARState.NORMAL
+                except ContinueSignal:
+                    self.call_stack.unwind(ar)
                     toylog.info(f'[!] {ar.name:<12} handle continue')
-                    # do nothing
             else:
                 break
-        self.exit_ar()
+        if not node.elided:
+            self.exit_ar()
 
     def visit_ForloopStat(self, node: ForloopStat):
-        ar = ActivationRecord(f'for<{node.position[0]}:{node.position[1]}>', ARType.LOOP)
+        ar = self.new_ar(f'for<{node.position}>', ARType.LOOP, node.scope)
         # cal start_val, end_val, step_val
         start_val = self.visit(node.start_expr)
         if not isinstance(start_val, NumValue):
@@ -244,27 +311,23 @@ class Interpreter(AstNodeVistor):
         end_val = self.visit(node.end_expr)
         if not isinstance(end_val, NumValue):
             self.error(node.end_expr.position, ErrorInfo.expr_type_error('num'))
-        step_val = self.visit(node.step_expr) if node.step_expr else NumValue(1, is_int=True)
+        step_val = self.visit(node.step_expr) if node.step_expr else self.constants.num('1', True)
         # create index var
-        ar.set(node.var_name.identifier, start_val, const=True)
+        ar.set(node.var_name.identifier, unshare(start_val), const=True)
         # enter loop
         self.enter_ar(ar)
         while True:
             val = self.visit(node.var_name)
             if OpImpl.lt(val, end_val)._val:
-                self.visit(node.stat)
-                if ar.state == ARState.RETURNED:
-                    ar.state = ARState.NORMAL
-                    toylog.info(f'[!] {ar.name:<12} pass return')
-                    break
-                elif ar.state == ARState.BREAKED:
-                    ar.state = ARState.NORMAL
+                try:
+                    self.visit(node.stat)
+                except BreakSignal:
+                    self.call_stack.unwind(ar)
                     toylog.info(f'[!] {ar.name:<12} handle break')
                     break
-                elif ar.state == ARState.CONTINUED:
-                    ar.state = ARState.NORMAL
+                except ContinueSignal:
+                    self.call_stack.unwind(ar)
                     toylog.info(f'[!] {ar.name:<12} handle continue')
-                    # do nothing
                 self.set_Name(node.var_name, OpImpl.add(val, step_val), force=True)
             else:
                 break
@@ -272,7 +335,7 @@ class Interpreter(AstNodeVistor):
         self.exit_ar()
 
     def visit_ForeachStat(self, node: ForeachStat):
-        ar = ActivationRecord(f'for<{node.position[0]}:{node.position[1]}>', ARType.LOOP)
+        ar = self.new_ar(f'for<{node.position}>', ARType.LOOP, node.scope)
         self.enter_ar(ar)
         # check value type
         c = self.visit(node.expr)
@@ -291,62 +354,57 @@ class Interpreter(AstNodeVistor):
             else:
                 ar.set(node.key_name.identifier, v, const=True)
             # do
-            self.visit(node.stat)
-            if ar.state == ARState.RETURNED:
-                ar.state = ARState.NORMAL
-                toylog.info(f'[!] {ar.name:<12} pass return')
-                break
-            elif ar.state == ARState.BREAKED:
-                ar.state = ARState.NORMAL
+            try:
+                self.visit(node.stat)
+            except BreakSignal:
+                self.call_stack.unwind(ar)
                 toylog.info(f'[!] {ar.name:<12} handle break')
                 break
-            elif ar.state == ARState.CONTINUED:
-                ar.state = ARState.NORMAL
+            except ContinueSignal:
+                self.call_stack.unwind(ar)
                 toylog.info(f'[!] {ar.name:<12} handle continue')
-                # do nothing
         self.exit_ar()
 
-    def visit_BreakStat(self, node: BreakStat):
+    def jump_target(self, type):
+        """nearest record of type in the current function, None if there's none
+        """
         ar = self.call_stack.current_ar
         while ar is not None:
-            ar.state = ARState.BREAKED
-            toylog.info(f'[!] {ar.name:<12} set break')
-            if ar.type == ARType.LOOP:
-                return
+            if ar.type == type:
+                return ar
             elif ar.type == ARType.FUNCTION:
-                break
+                return None
             ar = ar.outer
-        self.error(node.position, ErrorInfo.invalid_syntax('break'))
+        return None
+
+    def visit_BreakStat(self, node: BreakStat):
+        if self.jump_target(ARType.LOOP) is None:
+            self.error(node.position, ErrorInfo.invalid_syntax('break'))
+        raise BreakSignal()
 
     def visit_ContinueStat(self, node: ContinueStat):
-        ar = self.call_stack.current_ar
-        while ar is not None:
-            ar.state = ARState.CONTINUED
-            toylog.info(f'[!] {ar.name:<12} set continue')
-            if ar.type == ARType.LOOP:
-                return
-            elif ar.type == ARType.FUNCTION:
-                break
-            ar = ar.outer
-        self.error(node.position, ErrorInfo.invalid_syntax('continue'))
+        if self.jump_target(ARType.LOOP) is None:
+            self.error(node.position, ErrorInfo.invalid_syntax('continue'))
+        raise ContinueSignal()
 
     def visit_ReturnStat(self, node: ReturnStat):
-        ar = self.call_stack.current_ar
-        while ar is not None:
-            ar.state = ARState.RETURNED
-            toylog.info(f'[!] {ar.name:<12} set return')
-            if ar.type == ARType.FUNCTION:
-                ar.retval = self.visit(node.expr) if node.expr is not None else NullValue()
-                return
-            ar = ar.outer
-        self.error(node.position, ErrorInfo.invalid_syntax('return'))
+        if self.jump_target(ARType.FUNCTION) is None:
+            self.error(node.position, ErrorInfo.invalid_syntax('return'))
+        expr = node.expr
+        if expr is not None and type(expr) == FuncCall:
+            func_val = self.visit(expr.func_expr)
+            if type(func_val) == FunctionValue:
+                raise TailCallSignal(func_val, self.eval_args(func_val, expr), expr)
+            assert(type(func_val) == HostFunctionValue)
+            raise ReturnSignal(self.call_host(func_val, expr))
+        raise ReturnSignal(self.visit(expr) if expr is not None else NullValue())
 
     def visit_AssignStat(self, node: AssignStat):
         left_num = len(node.left_exprs)
         right_num = len(node.right_exprs)
         values = []
         for i in range(left_num):
-            values.append(self.visit(node.right_exprs[i]) if i < right_num else NullValue())
+            values.append(unshare(self.visit(node.right_exprs[i])) if i < right_num else NullValue())
         for i in range(len(node.left_exprs)):
             left_expr = node.left_exprs[i]
             # name
@@ -386,50 +444,103 @@ class Interpreter(AstNodeVistor):
 
         func_val = self.visit(node.func_expr)
         if type(func_val) == HostFunctionValue:
-            args = []
-            if node.arg_exprs:
-                for arg_expr in node.arg_exprs:
-                    args.append(self.visit(arg_expr))
-            try:
-                result = func_val._func(args)
-            except ValueTypeError as e:
-                self.error(node.position, ErrorInfo.general(e.message))
+            return self.call_host(func_val, node)
+        assert(type(func_val) == FunctionValue)
+        return self.call_function(func_val, self.eval_args(func_val, node), node)
+
+    def call_host(self, func_val, node: FuncCall):
+        args = []
+        if node.arg_exprs:
+            for arg_expr in node.arg_exprs:
+                args.append(unshare(self.visit(arg_expr)))
+        try:
+            result = func_val._func(args)
+        except ValueTypeError as e:
+            self.error(node.position, ErrorInfo.general(e.message))
 
-            if result:
-                if isinstance(result, Value):
-                    return result
-                else:
-                    self.error(node.position, ErrorInfo.general("host function return invalid type value"))
+        if result:
+            if isinstance(result, Value):
+                return result
             else:
-                return NullValue()
+                self.error(node.position, ErrorInfo.general("host function return invalid type value"))
         else:
-            assert(type(func_val) == FunctionValue)
+            return NullValue()
+
+    def eval_args(self, func_val, node: FuncCall):
+        """values of the args bound to the parameters, None for a missing arg
+        """
+        func_ast = func_val._ast
+        arg_vals = []
+        i = 0
+        if func_ast.param_names:
+            while i < len(func_ast.param_names):
+                arg_expr = node.arg_exprs[i] if node.arg_exprs and i < len(node.arg_exprs) else None
+                arg_vals.append(unshare(self.visit(arg_expr)) if arg_expr else None)
+                i += 1
+        if func_ast.vararg and i < len(node.arg_exprs):
+            self.error(node.position, "TODO: vararg")
+        return arg_vals
+
+    def call_function(self, func_val, arg_vals, node: FuncCall):
+        """run a function, and the functions it tail calls in its place
+
+        a function returning `f(args)` has nothing left to do, its records are
+        dropped before f runs. names are looked up through the records of the
+        callers (dynamic scope), so what f could find in them is moved to one
+        record of the tail calls, which f's record is entered on
+        """
+        base = self.call_stack.current_ar
+        while True:
             func_ast = func_val._ast
-            ar = ActivationRecord(f'{func_val.signature}<{node.position[0]}:{node.position[1]}>', ARType.FUNCTION)
-            # set args
-            i = 0
-            if func_ast.param_names:
-                while i < len(func_ast.param_names):
-                    identifier = func_ast.param_names[i].identifier
-                    arg_expr = node.arg_exprs[i] if node.arg_exprs and i < len(node.arg_exprs) else None
-                    arg_val = self.visit(arg_expr) if arg_expr else None
-                    ar.set(identifier, arg_val, const=False)
-                    i += 1
-            if func_ast.vararg and i < len(node.arg_exprs):
-                self.error(node.position, "TODO: vararg")
-            # exec func body
+            ar = self.new_ar(f'{func_val.signature}<{node.position}>', ARType.FUNCTION, func_ast.scope)
+            for name, arg_val in zip(func_ast.param_names or [], arg_vals):
+                ar.set(name.identifier, arg_val, const=False)
             self.enter_ar(ar)
-            # similar to block
-            for stat in func_ast.body:
-                self.visit(stat)
-                if ar.state == ARState.RETURNED:
-                    ar.state = ARState.NORMAL
-                    toylog.info(f'[!] {ar.name:<12} handle return')
-                    break
-            retval = ar.retval if ar.retval else NullValue()
-            self.exit_ar()
+            try:
+                for stat in func_ast.body:
+                    self.visit(stat)
+                retval = NullValue()
+            except ReturnSignal as signal:
+                toylog.info(f'[!] {ar.name:<12} handle return')
+                retval = signal.value
+            except TailCallSignal as signal:
+                toylog.info(f'[!] {ar.name:<12} handle tail call')
+                self.drop_records(ar, base)
+                func_val, arg_vals, node = signal.func_val, signal.arg_vals, signal.node
+                continue
+            self.call_stack.unwind(base)
             return retval
 
+    def drop_records(self, ar, base):
+        """pop the records of a function making a tail call, from the current
+        one to its record ar, keep their members in one record of tail calls
+        above base
+        """
+        records = []
+        while True:
+            records.append(self.call_stack.current_ar)
+            if self.call_stack.pop() is ar:
+                break
+        tail_ar = self.call_stack.current_ar
+        if tail_ar is not base:     # the record of earlier tail calls
+            records.append(tail_ar)
+        else:
+            tail_ar = ActivationRecord(f'tail calls<{ar.name}>', ARType.FUNCTION)
+            self.enter_ar(tail_ar)
+
+        # one [value, const] for the members of a name in the records, inner
+        # first: a lookup skips a missing arg (None), an assignment goes to
+        # the inner one
+        members = {}
+        for record in records:
+            for identifier, vv in record.members.items():
+                found = members.get(identifier)
+                if found is None:
+                    members[identifier] = vv
+                elif found[0] is None and vv[0] is not None:
+                    members[identifier] = [vv[0], found[1]]
+        tail_ar.members = members
+
     def visit_SelectExpr(self, node: SelectExpr):
         try:
             cond_val = OpImpl.convert_to_bool(self.visit(node.cond))
@@ -484,14 +595,14 @@ class Interpreter(AstNodeVistor):
         value = ListValue(_val=[])
         if node.exprs:
             for expr in node.exprs:
-                value._val.append(self.visit(expr))
+                value._val.append(unshare(self.visit(expr)))
         return value
 
     def visit_MapCtorExpr(self, node: MapCtorExpr):
         value = MapValue(_val={})
         for key_expr, value_expr in zip(node.key_exprs, node.value_exprs):
-            key = self.visit(key_expr)
-            OpImpl.set_member(value, key, self.visit(value_expr) if value_expr else NullValue())
+            key = unshare(self.visit(key_expr))
+            OpImpl.set_member(value, key, unshare(self.visit(value_expr)) if value_expr else NullValue())
         return value
 
     def visit_SetCtorExpr(self, node: SetCtorExpr):
@@ -512,20 +623,25 @@ class Interpreter(AstNodeVistor):
     def visit_Name(self, node: Name):
         return self.get_Name(node)
 
+    # number and string literals are converted on the first evaluation, then the value is shared
+
     def visit_NumLiteral(self, node: NumLiteral):
-        if node.is_int:
-            return NumValue(int(node.value), is_int=True)
-        else:
-            return NumValue(float(node.value), is_int=False)
+        value = node.constant
+        if value is None:
+            value = node.constant = self.constants.num(node.value, node.is_int)
+        return value
 
     def visit_StringLiteral(self, node: StringLiteral):
-        return StringValue(node.value)
+        value = node.constant
+        if value is None:
+            value = node.constant = self.constants.string(node.value)
+        return value
 
     def visit_BoolLiteral(self, node: BoolLiteral):
-        return BoolValue(True if node.value == 'true' else False)
+        return self.constants.true if node.value == 'true' else self.constants.false
 
     def visit_NullLiteral(self, node: NullLiteral):
-        return NullValue()
+        return self.constants.null
 
     def set_Name(self, name: Name, value: Value, force=False):
         '''set value to a name
@@ -533,6 +649,21 @@ class Interpreter(AstNodeVistor):
         Args:
           force: set value to a constant forcibly
         '''
+        depth = name.depth
+        if depth is not None:       # resolved, see toyresolver
+            if depth == GLOBAL_DEPTH:
+                slots, slot = self.global_ar.members, name.identifier
+            else:
+                ar = self.call_stack.current_ar
+                for _ in range(depth):
+                    ar = ar.outer
+                slots, slot = ar.slots, name.slot
+            vv = slots.get(slot) if depth == GLOBAL_DEPTH else slots[slot]
+            if vv is not None:
+                if vv[1] and not force:
+                    self.error(name.position, ErrorInfo.name_not_assignable(name.identifier))
+                slots[slot] = [value, vv[1]]
+                return
         ar = self.call_stack.current_ar
         identifier = name.identifier
         while ar is not None:
@@ -547,6 +678,17 @@ class Interpreter(AstNodeVistor):
         self.error(name.position, ErrorInfo.name_not_declared(identifier))
 
     def get_Name(self, name: Name):
+        depth = name.depth
+        if depth is not None:       # resolved, see toyresolver
+            if depth == GLOBAL_DEPTH:
+                vv = self.global_ar.members.get(name.identifier)
+            else:
+                ar = self.call_stack.current_ar
+                for _ in range(depth):
+                    ar = ar.outer
+                vv = ar.slots[name.slot]
+            if vv is not None and vv[0] is not None:
+                return vv[0]
         ar = self.call_stack.current_ar
         identifier = name.identifier
         while ar is not None:
@@ -558,6 +700,8 @@ class Interpreter(AstNodeVistor):
         self.error(name.position, ErrorInfo.name_not_declared(identifier))
 
     def interpret(self, tree):
+        if self.resolver is not None:
+            self.resolver.resolve(tree)
         self.visit(tree)
 
     def finish(self):
@@ -569,22 +713,31 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='toylang interpreter')
     parser.add_argument('--src', help='source file')
     parser.add_argument('--repl', action='store_true', help='repl mode')
+    parser.add_argument('--no-cache', action='store_true', help='always parse the source, skip __toycache__')
+    parser.add_argument('--engine', choices=['tree', 'closure', 'vm'], default='tree', help='execution engine')
+    parser.add_argument('--optimize', action='store_true', help='run toyoptimizer passes on the source before executing')
     parser.add_argument('--level', type=int, help='log level')
     args = parser.parse_args()
 
     if args.level:
         toylog.set_log_level(args.level)
 
-    interpreter = Interpreter()
+    if args.engine == 'closure':
+        from toyclosure import ClosureInterpreter
+        interpreter = ClosureInterpreter()
+    elif args.engine == 'vm':
+        from toycompiler import VMInterpreter
+        interpreter = VMInterpreter()
+    else:
+        interpreter = Interpreter()
 
     if args.src:
+        line_table = None
         try:
-            with open(args.src, 'r', encoding='utf-8') as f:
-                code = f.read()
-
-            lexer = Lexer(code)
-            parser = Parser(lexer)
-            tree = parser.parse()
+            tree, line_table = parse_file(args.src, use_cache=not args.no_cache)
+            if args.optimize:
+                from toyoptimizer import optimize
+                toylog.info(f'optimize: {optimize(tree)}')
 
             displayer = Displayer(tree, 'ast.html')
             displayer.display()
@@ -592,11 +745,14 @@ if __name__ == '__main__':
             interpreter.interpret(tree)
             interpreter.finish()
         except (LexerError, ParserError, SemanticError, InterpreterError) as e:
+            if line_table is not None:      # parse errors are located by parse_file
+                e.locate(line_table)
             print(e)
             interpreter.finish()
     # elif args.repl:
     else:
         text = ''
+        source = ''         # all inputs, so positions in functions defined earlier stay valid
         while True:
             try:
                 line = input('toy> ').strip()
@@ -619,8 +775,10 @@ if __name__ == '__main__':
                 else:
                     text += ' ' + line
 
-                lexer = Lexer(text)
+                start = len(source)
+                source += text + '\n'
                 text = ''
+                lexer = Lexer(source, start)
                 parser = Parser(lexer)
                 tree = parser.parse()
 
@@ -630,5 +788,6 @@ if __name__ == '__main__':
                 interpreter.interpret(tree)
                 print()
             except (LexerError, ParserError, SemanticError, InterpreterError) as e:
-                print(e)
+                interpreter.unwind()
+                print(e.locate(LineTable.from_text(source)))
                 # raise e
@@ -4,43 +4,134 @@ toylang lexer
 """
 from toytoken import *
 from toyerror import *
+import bisect
+import codecs
+import re
 import sys
 
+LEXER_CHUNK_SIZE = 64 * 1024
+NEWLINE_PATTERN = re.compile('\n')
+
+
+class LineTable:
+    """source offset -> (line, col), built once per source
+
+    positions of tokens and ast nodes are source offsets, they are only
+    converted to line:col when an error or the displayer needs it
+    """
+    def __init__(self, line_starts):
+        self.line_starts = line_starts      # offset of the first char of each line
+
+    @classmethod
+    def from_text(cls, text: str):
+        return cls([0] + [m.end() for m in NEWLINE_PATTERN.finditer(text)])
+
+    def resolve(self, offset):
+        line = bisect.bisect_right(self.line_starts, offset)
+        return line, offset - self.line_starts[line - 1] + 1
+
+
 class Lexer:
-    def __init__(self, text: str):
+    def __init__(self, text: str, start=0):
         self.text = text
-        self.residual = len(text)
-        self.current_char = self.text[0]
-        # self.pos  = 0
-        self.line = 1
-        self.col  = 1
+        self.length = len(text)
+        self.pos  = start
+        self.current_char = self.text[start] if start < self.length else None
+        self.lines = None       # LineTable, built on demand
+        # below used for streaming source, see `from_file`
+        self.reader = None      # read next chunk, '' at the end of input
+        self.mark = None        # start of the token being sliced, kept when refilling
+        self.base = 0           # source offset of text[0]
+
+    @classmethod
+    def from_file(cls, f, chunk_size=LEXER_CHUNK_SIZE):
+        """lex a text/binary file object or a mmap chunk by chunk
+
+        only the unconsumed part of the source is kept in the buffer, so
+        tokens (and multi-line strings) may straddle chunk boundaries
+        """
+        decoder = codecs.getincrementaldecoder('utf-8')()
+
+        def read():
+            while True:
+                chunk = f.read(chunk_size)
+                if isinstance(chunk, str):
+                    return chunk
+                text = decoder.decode(chunk, final=not chunk)
+                if text or not chunk:
+                    return text
+
+        lexer = cls('')
+        lexer.reader = read
+        lexer.lines = LineTable([0])
+        if lexer.fill():
+            lexer.current_char = lexer.text[0]
+        return lexer
+
+    def fill(self):
+        """append next chunk to the buffer, drop the consumed part
+
+        Returns:
+          False if there is no more input
+        """
+        if self.reader is None:
+            return False
+        chunk = self.reader()
+        if not chunk:
+            self.reader = None
+            return False
+
+        # the source is not kept, record its line starts while reading
+        chunk_offset = self.base + self.length
+        self.lines.line_starts.extend(chunk_offset + m.end() for m in NEWLINE_PATTERN.finditer(chunk))
+
+        keep = self.pos if self.mark is None else self.mark
+        self.text = self.text[keep:] + chunk
+        self.length = len(self.text)
+        self.base += keep
+        self.pos -= keep
+        if self.mark is not None:
+            self.mark -= keep
+        return True
+
+    def line_table(self):
+        if self.lines is None:
+            self.lines = LineTable.from_text(self.text)
+        return self.lines
 
     def error(self, message):
         raise LexerError(self.position(), message)
 
     def position(self):
-        return self.line, self.col
+        return self.base + self.pos
 
     def advance(self, n=1):
         """advance n char, refresh current_char
-        """
-        assert(n <= self.residual)
 
-        for i in range(n):
-            self.col += 1
-            if self.text[i] == '\n':
-                self.line += 1
-                self.col = 1
+        the source is never re-sliced, only the cursor `pos` moves
+        """
+        end = self.pos + n
+        assert(end <= self.length)
 
-        self.residual -= n
-        self.text = self.text[n:]
-        if self.residual == 0:
+        self.pos = end
+        if end == self.length and not self.fill():
             self.current_char = None
         else:
-            self.current_char = self.text[0]
+            self.current_char = self.text[self.pos]
+
+    def __iter__(self):
+        """yield all tokens, ended with EOF
+        """
+        while True:
+            token = self.next_token()
+            yield token
+            if token.type == TokenType.EOF:
+                break
 
     def start_with(self, s):
-        return self.text.startswith(s)
+        while self.pos + len(s) > self.length and self.fill():
+            pass
+        return self.text.startswith(s, self.pos)
 
     def next_token(self):
         """get next token
@@ -63,12 +154,11 @@ class Lexer:
             return self.identifier_keyword()
 
         # operators
-        for op in OPERATOR_TOKEN_LIST:
-            if self.current_char == op.start:
-                if self.start_with(op.content):
-                    token = Token(op.type, op.content, self.position())
-                    self.advance(op.len)
-                    return token
+        for op in OPERATOR_TOKEN_TABLE.get(self.current_char, ()):
+            if self.start_with(op.content):
+                token = Token(op.type, op.content, self.position())
+                self.advance(op.len)
+                return token
 
         # other
         self.error(ErrorInfo.unrecognized_char(self.current_char))
@@ -109,24 +199,22 @@ class Lexer:
         """
         token = Token(None, None, self.position())
 
-        result = ''
+        self.mark = self.pos
         while self.current_char is not None and self.current_char.isdigit():
-            result += self.current_char
             self.advance()
 
         if self.current_char != '.' or self.current_char == None:
             token.type = TokenType.INT_LITERAL
         else:
-            result += '.'
             self.advance()
 
             while self.current_char is not None and self.current_char.isdigit():
-                result += self.current_char
                 self.advance()
 
             token.type = TokenType.FLOAT_LITERAL
 
-        token.value = result
+        token.value = self.text[self.mark:self.pos]
+        self.mark = None
         return token
 
     def string_literal(self):
@@ -161,8 +249,9 @@ class Lexer:
         """
         self.advance(1)         # eat '\'
         if self.current_char in ('"', "'", "`"):
+            quote = self.current_char
             self.advance(1)
-            return self.current_char
+            return quote
 
         if self.current_char == 'n':
             self.advance(1)
@@ -174,14 +263,14 @@ class Lexer:
         """parse a identifier/keyword
         """
         token = Token(None, None, self.position())
-        result = ''
+        self.mark = self.pos
         while self.current_char is not None:
             if self.current_char.isalnum() or self.current_char == '_':
-                result += self.current_char
                 self.advance()
             else:
                 break
-        token.value = result
+        result = self.text[self.mark:self.pos]
+        self.mark = None
 
         # keyword or idetifier
         token.type = RESERVED_KEYWORDS.get(result, TokenType.IDENTIFIER)
@@ -189,21 +278,150 @@ class Lexer:
         return token
 
 
+
+def _build_token_pattern():
+    operators = sorted((op.content for op in OPERATOR_TOKEN_LIST), key=len, reverse=True)
+    return re.compile('|'.join([
+        r'(?P<skip>(?:\s+|//[^\n]*\n?|/\*[\s\S]*?(?:\*/|\Z))+)',
+        r'(?P<number>\d+(?:\.\d*)?)',
+        r'(?P<name>[^\W\d]\w*)',
+        r'(?P<string>[\'"`])',
+        r'(?P<operator>' + '|'.join(re.escape(op) for op in operators) + ')',
+    ]))
+
+
+TOKEN_PATTERN = _build_token_pattern()
+OPERATOR_TOKEN_TYPES = {op.content: op.type for op in OPERATOR_TOKEN_LIST}
+STRING_BODY_PATTERNS = {
+    "'": re.compile(r"[^'\\\n]*"),
+    '"': re.compile(r'[^"\\\n]*'),
+    '`': re.compile(r'[^`\\]*'),
+}
+
+
+def iter_tokens(text: str, start=0):
+    """tokenize text with the compiled TOKEN_PATTERN, yield the same tokens as Lexer
+
+    the token stream ends with a EOF token, can be consumed by Parser directly
+    """
+    pos = start
+    length = len(text)
+    match = TOKEN_PATTERN.match
+
+    while pos < length:
+        m = match(text, pos)
+        if m is None:
+            raise LexerError(pos, ErrorInfo.unrecognized_char(text[pos]))
+        kind = m.lastgroup
+        end = m.end()
+
+        if kind == 'skip':
+            pass
+        elif kind == 'number':
+            value = m.group()
+            yield Token(TokenType.FLOAT_LITERAL if '.' in value else TokenType.INT_LITERAL, value, pos)
+        elif kind == 'name':
+            value = m.group()
+            yield Token(RESERVED_KEYWORDS.get(value, TokenType.IDENTIFIER), value, pos)
+        elif kind == 'operator':
+            value = m.group()
+            yield Token(OPERATOR_TOKEN_TYPES[value], value, pos)
+        else:
+            quote = m.group()
+            body = STRING_BODY_PATTERNS[quote].match
+            chunks = []
+            while True:
+                m = body(text, end)
+                chunks.append(m.group())
+                end = m.end()
+                char = text[end] if end < length else None
+                if char == quote:
+                    end += 1
+                    break
+                if char != '\\':          # EOF or newline
+                    raise LexerError(end, ErrorInfo.literal_string_not_end())
+                char = text[end + 1] if end + 1 < length else None
+                if char in ('"', "'", "`"):
+                    chunks.append(char)
+                elif char == 'n':
+                    chunks.append('\n')
+                else:
+                    raise LexerError(end + 1, ErrorInfo.unsupport_escape(char))
+                end += 2
+            yield Token(TokenType.STRING_LITERAL, ''.join(chunks).replace('\r', ''), pos)
+        pos = end
+
+    yield Token(TokenType.EOF, None, pos)
+
+
+def tokenize(text: str):
+    """lex the whole text into a TokenBuffer which remembers its source
+    """
+    buffer = TokenBuffer.from_tokens(iter_tokens(text))
+    buffer.text = text
+    return buffer
+
+
+def relex(buffer: TokenBuffer, offset, removed, inserted):
+    """re-tokenize a TokenBuffer after an edit of its source
+
+    the edit replaces `removed` chars at `offset` with the `inserted` text.
+    lexing restarts at a token start before the edit (no comment or string
+    is open at a token start, and two tokens back covers the lookahead of
+    operators like `...`), and stops as soon as a new token starts where a
+    old token started after the edit: the rest of the source is the same,
+    so the old tokens are reused with shifted offsets.
+
+    Returns:
+      new TokenBuffer of the edited source
+    """
+    old_text = buffer.text
+    text = old_text[:offset] + inserted + old_text[offset + removed:]
+    delta = len(inserted) - removed
+    edit_end = offset + len(inserted)       # in new source
+
+    restart = max(0, bisect.bisect_left(buffer.offsets, offset) - 2)
+    result = TokenBuffer()
+    result.kinds = buffer.kinds[:restart]
+    result.offsets = buffer.offsets[:restart]
+    result.values = buffer.values[:restart]
+    result.strings = buffer.strings[:]
+    result.string_ids = dict(buffer.string_ids)
+    result.text = text
+
+    old_offsets = buffer.offsets
+    old_count = len(old_offsets)
+    j = restart
+    start = old_offsets[restart] if restart > 0 else 0
+    for token in iter_tokens(text, start):
+        if token.position >= edit_end:
+            old_position = token.position - delta
+            while j < old_count and old_offsets[j] < old_position:
+                j += 1
+            if j < old_count and old_offsets[j] == old_position:
+                # synchronized, reuse the old tokens
+                result.kinds.extend(buffer.kinds[j:])
+                result.values.extend(buffer.values[j:])
+                result.offsets.extend(o + delta for o in old_offsets[j:])
+                return result
+        result.append(token)
+    return result
+
+
 if __name__ == '__main__':
     if len(sys.argv) < 2:
         print('usage: python toy.py <src.toy>')
         sys.exit(0)
 
     with open(sys.argv[1], 'r') as f:
-        code = f.read()
-
-    try:
-        lexer = Lexer(code)
-
-        while True:
-            token = lexer.next_token()
-            print(token)
-            if token.type == TokenType.EOF:
-                break
-    except LexerError as e:
-        print(e)
+        try:
+            lexer = Lexer.from_file(f)
+
+            while True:
+                token = lexer.next_token()
+                line, col = lexer.line_table().resolve(token.position)
+                print(f'{line}:{col}', token)
+                if token.type == TokenType.EOF:
+                    break
+        except LexerError as e:
+            print(e.locate(lexer.line_table()))
@@ -0,0 +1,655 @@
+# -*- coding: utf-8 -*-
+"""
+toylang ast optimizer
+
+passes rewrite a tree in place and count what they changed:
+- constant folding: operators on literals are evaluated with OpImpl, the
+  same way Interpreter does, and replaced by a literal. an operator which
+  would fail (a ValueTypeError, a division by zero) is kept, so the error
+  is raised where it was
+- constant propagation: reads of a program-level `const` with a literal
+  value are replaced by the literal, then folded
+- function inlining: calls of small program-level functions are replaced
+  by their bodies, see FunctionInliner
+- dead code elimination: branches of `if` and `switch` which can't run,
+  loops with a constant false condition and statements after a `return`,
+  `break` or `continue` are removed, nodes pruned are counted
+
+`+=` and `-=` change values in place, through every name or container
+which shares the value.
+"""
+from toytoken import *
+from toyerror import *
+from toyast import *
+from toyvalue import *
+
+from toyresolver import has_loop_jump
+
+import re
+
+
+FLOAT_LITERAL = re.compile(r'-?\d+\.\d+')
+
+# errors evaluating an operator on literal values may raise, the operator
+# is not folded and raises it at run time. OpImpl.eq reads `_val` of both
+# values, which null has not
+EVALUATION_ERRORS = (ValueTypeError, ZeroDivisionError, OverflowError, ValueError, TypeError, AttributeError)
+
+REVERSED_OPERATORS = {
+    TokenType.NE: TokenType.EQ,
+    TokenType.GE: TokenType.LT,
+    TokenType.GT: TokenType.LE,
+}
+
+LITERAL_KINDS = (NumLiteral.kind, StringLiteral.kind, BoolLiteral.kind, NullLiteral.kind)
+
+
+def literal_value(node):
+    """value of a literal node, as Interpreter evaluates it
+    """
+    if node.kind == NumLiteral.kind:
+        return NumValue(int(node.value) if node.is_int else float(node.value), is_int=node.is_int)
+    elif node.kind == StringLiteral.kind:
+        return StringValue(node.value)
+    elif node.kind == BoolLiteral.kind:
+        return BoolValue(node.value == 'true')
+    else:
+        return NullValue()
+
+
+def value_literal(value, position):
+    """literal node of a value, None if the value can't be written as one
+    """
+    if type(value) == NumValue:
+        if value.is_int:
+            return NumLiteral(str(value._val), is_int=True, position=position)
+        text = repr(value._val)
+        if FLOAT_LITERAL.fullmatch(text):       # no exponent, inf or nan
+            return NumLiteral(text, is_int=False, position=position)
+    elif type(value) == StringValue:
+        return StringLiteral(value._val, position)
+    elif type(value) == BoolValue:
+        return BoolLiteral('true' if value._val else 'false', position)
+    elif type(value) == NullValue:
+        return NullLiteral(position)
+    return None
+
+
+def copy_literal(node, position):
+    return value_literal(literal_value(node), position)
+
+
+class ConstantFolder(AstNodeVistor):
+    """fold operators on literals, replace reads of `constants` by their literals
+    """
+    def __init__(self, constants=None):
+        self.constants = constants or {}    # identifier -> literal node
+        self.folded = 0
+        self.propagated = 0
+
+    def fold(self, node, compute):
+        try:
+            literal = value_literal(compute(), node.position)
+        except EVALUATION_ERRORS:       # not folded, fails at run time as before
+            return node
+        if literal is None:
+            return node
+        self.folded += 1
+        return literal
+
+    def generic_visitor(self, node):
+        for field in node._fields:
+            value = getattr(node, field)
+            if isinstance(value, AST):
+                setattr(node, field, self.visit(value))
+            elif isinstance(value, list):
+                setattr(node, field, [self.visit(item) if isinstance(item, AST) else item for item in value])
+        return node
+
+    def visit_VarDeclStat(self, node: VarDeclStat):
+        if node.exprs:
+            node.exprs = [self.visit(expr) for expr in node.exprs]
+        return node
+
+    def visit_ForloopStat(self, node: ForloopStat):
+        node.start_expr = self.visit(node.start_expr)
+        node.end_expr = self.visit(node.end_expr)
+        if node.step_expr:
+            node.step_expr = self.visit(node.step_expr)
+        node.stat = self.visit(node.stat)
+        return node
+
+    def visit_ForeachStat(self, node: ForeachStat):
+        node.expr = self.visit(node.expr)
+        node.stat = self.visit(node.stat)
+        return node
+
+    def visit_AssignStat(self, node: AssignStat):
+        node.left_exprs = [expr if expr.kind == Name.kind else self.visit(expr) for expr in node.left_exprs]
+        node.right_exprs = [self.visit(expr) for expr in node.right_exprs]
+        return node
+
+    def visit_CompoundAssignStat(self, node: CompoundAssignStat):
+        if node.left_expr.kind != Name.kind:
+            node.left_expr = self.visit(node.left_expr)
+        node.right_expr = self.visit(node.right_expr)
+        return node
+
+    def visit_FuncDef(self, node: FuncDef):
+        node.body = [self.visit(stat) for stat in node.body]
+        return node
+
+    def visit_BinOpExpr(self, node: BinOpExpr):
+        node.left_expr = self.visit(node.left_expr)
+        node.right_expr = self.visit(node.right_expr)
+        if node.left_expr.kind not in LITERAL_KINDS or node.right_expr.kind not in LITERAL_KINDS:
+            return node
+        operator = REVERSED_OPERATORS.get(node.operator, node.operator)
+        if operator not in BINOP_IMPL_TABLE or operator in (TokenType.SELF_ADD, TokenType.SELF_SUB):
+            return node
+
+        def compute():
+            result = BINOP_IMPL_TABLE[operator](literal_value(node.left_expr), literal_value(node.right_expr))
+            if operator is not node.operator:
+                result._val = not result._val
+            return result
+        return self.fold(node, compute)
+
+    def visit_UniOpExpr(self, node: UniOpExpr):
+        node.expr = self.visit(node.expr)
+        if node.expr.kind not in LITERAL_KINDS or node.operator not in UNIOP_IMPL_TABLE:
+            return node
+        return self.fold(node, lambda: UNIOP_IMPL_TABLE[node.operator](literal_value(node.expr)))
+
+    def visit_Name(self, node: Name):
+        literal = self.constants.get(node.identifier)
+        if literal is None:
+            return node
+        self.propagated += 1
+        return copy_literal(literal, node.position)
+
+
+def bound_names(node):
+    """names a node declares: variables, parameters, loop variables
+    """
+    if node.kind == VarDeclStat.kind:
+        return node.names
+    elif node.kind == FuncDef.kind:
+        return node.param_names or []
+    elif node.kind == ForloopStat.kind:
+        return [node.var_name]
+    elif node.kind == ForeachStat.kind:
+        return [node.key_name] if node.val_name is None else [node.key_name, node.val_name]
+    return []
+
+
+def find_bindings(tree: Program, kinds):
+    """program-level `const` names bound to a node of kinds, which every read
+    is known to find
+
+    scope is dynamic and `+=` changes values in place, so a name is returned
+    only if:
+    - its identifier is declared once in the tree
+    - it is never assigned or compound-assigned (which would fail or change it)
+    - every read is in a program-level stat after the declaration, which
+      includes functions defined there, so a read never runs before it.
+      a function which reads its own name (recursion) is left out
+    """
+    candidates = {}     # identifier -> (index of the stat, node)
+    for index, stat in enumerate(tree.stats):
+        if stat.kind == VarDeclStat.kind and stat.const and stat.exprs:
+            for name, expr in zip(stat.names, stat.exprs):
+                if expr.kind in kinds:
+                    candidates[name.identifier] = (index, expr)
+    if not candidates:
+        return {}
+
+    declarations = {}
+    excluded = set()
+    for index, stat in enumerate(tree.stats):
+        not_read = set()    # names which are declared or assigned, not read
+        for node in walk(stat):
+            if node.kind == Name.kind:
+                if id(node) not in not_read and node.identifier in candidates and index <= candidates[node.identifier][0]:
+                    excluded.add(node.identifier)
+                continue
+            for name in bound_names(node):
+                declarations[name.identifier] = declarations.get(name.identifier, 0) + 1
+                not_read.add(id(name))
+            if node.kind == AssignStat.kind:
+                targets = node.left_exprs
+            elif node.kind == CompoundAssignStat.kind:
+                targets = [node.left_expr]
+            else:
+                continue
+            for target in targets:
+                if target.kind == Name.kind:
+                    excluded.add(target.identifier)
+                    not_read.add(id(target))
+    return {identifier: node for identifier, (_, node) in candidates.items()
+            if identifier not in excluded and declarations.get(identifier) == 1}
+
+
+def escaping_names(tree: Program):
+    """names read where their value is bound to another name or stored in a
+    container, so `+=` on it there changes the value of the name too
+
+    the args of a host function call are copied, the callee is taken to be
+    one when its name is declared nowhere in the tree
+    """
+    declared = {name.identifier for node in walk(tree) for name in bound_names(node)}
+    exprs = []
+    for node in walk(tree):
+        if node.kind == VarDeclStat.kind:
+            exprs.extend(node.exprs or [])
+        elif node.kind == AssignStat.kind:
+            exprs.extend(node.right_exprs)
+        elif node.kind == ReturnStat.kind:
+            exprs.append(node.expr)
+        elif node.kind == FuncCall.kind:
+            if node.func_expr.kind != Name.kind or node.func_expr.identifier in declared:
+                exprs.extend(node.arg_exprs or [])
+        elif node.kind == ListCtorExpr.kind:
+            exprs.extend(node.exprs or [])
+        elif node.kind == MapCtorExpr.kind:
+            exprs.extend(node.key_exprs or [])
+            exprs.extend(node.value_exprs or [])
+
+    names = set()
+    while exprs:
+        expr = exprs.pop()
+        if expr is None:
+            continue
+        elif expr.kind == Name.kind:
+            names.add(expr.identifier)
+        elif expr.kind == SelectExpr.kind:
+            exprs.extend((expr.expr1, expr.expr2))
+        elif expr.kind == UniOpExpr.kind and expr.operator == TokenType.ADD:    # `+x` is x
+            exprs.append(expr.expr)
+    return names
+
+
+def find_constants(tree: Program):
+    """program-level `const` names with literal values, which all reads can be replaced by
+    """
+    constants = find_bindings(tree, LITERAL_KINDS)
+    if constants:
+        escaping = escaping_names(tree)
+        constants = {identifier: node for identifier, node in constants.items() if identifier not in escaping}
+    return constants
+
+
+def fold_constants(tree: Program):
+    """fold literal operators, then propagate constants and fold again
+
+    Returns:
+      (nodes folded, names propagated)
+    """
+    folder = ConstantFolder()
+    tree = folder.visit(tree)
+    constants = find_constants(tree)
+    if constants:
+        propagator = ConstantFolder(constants)
+        tree = propagator.visit(tree)
+        return folder.folded + propagator.folded, propagator.propagated
+    return folder.folded, 0
+
+
+def count_nodes(node):
+    return sum(1 for _ in walk(node))
+
+
+INLINE_MAX_NODES = 64         # nodes in a function body inlined at most
+
+INLINE_EXPR_KINDS = LITERAL_KINDS + (Name.kind, BinOpExpr.kind, UniOpExpr.kind)
+
+STAT_FIELDS = ('stats', 'stat', 'body', 'case_stats', 'default_stat')
+
+
+def evaluation_order(expr):
+    """nodes of an expression in the order they are evaluated, operands before their operator
+    """
+    for child in expr.children():
+        yield from evaluation_order(child)
+    yield expr
+
+
+def replace_names(node, args):
+    """copy of node with names in args replaced by copies of their args
+    """
+    if node.kind == Name.kind and node.identifier in args:
+        return copy_tree(args[node.identifier])
+    copy = copy_tree(node)
+    for field in node._fields:
+        value = getattr(node, field)
+        if isinstance(value, AST):
+            setattr(copy, field, replace_names(value, args))
+    return copy
+
+
+def is_guard(stat):
+    """whether stat is `if cond return;`
+    """
+    if stat.kind != IfStat.kind or len(stat.stats) != 1:
+        return False
+    branch = stat.stats[0]
+    if branch.kind == BlockStat.kind and len(branch.stats) == 1:
+        branch = branch.stats[0]
+    return branch.kind == ReturnStat.kind and branch.expr is None
+
+
+def without_returns(stats):
+    """stats of a function body with `if cond return;` at its top level turned
+    into `if not cond { the stats after }`, and a last `return;` dropped
+    """
+    for index, stat in enumerate(stats):
+        if is_guard(stat):
+            cond_expr = stat.cond_exprs[0]
+            rest = BlockStat(without_returns(stats[index + 1:]), stat.position)
+            negated = UniOpExpr(TokenType.NOT, cond_expr, cond_expr.position)
+            return stats[:index] + [IfStat([negated], [rest], stat.position)]
+    if stats and stats[-1].kind == ReturnStat.kind and stats[-1].expr is None:
+        return stats[:-1]
+    return stats
+
+
+class FunctionInliner(AstNodeVistor):
+    """replace calls of small functions by their bodies
+
+    scope is dynamic: a function runs in a record whose outer is the
+    caller's, the same as a block at the call site. two kinds of functions
+    are inlined:
+    - `return expr` of operators, literals and names, called in an
+      expression: the call is replaced by expr with each parameter replaced
+      by its arg, which must be a literal or a name. names in args are read
+      first, in the order of the args, so a name which isn't declared fails
+      as before
+    - without a return, besides `if cond return;` at its top level and a
+      last `return;`, called as a stat: the call is replaced by a block
+      which declares the parameters as `var`, then runs the body. args
+      can't call functions or read the names of parameters, which the block
+      declares before them
+    """
+    def __init__(self, functions):
+        self.functions = functions      # identifier -> FuncDef
+        self.bodies = {}                # identifier -> body of a function inlined as a stat, None if it can't be
+        self.inlined = 0
+
+    def generic_visitor(self, node):
+        for field in node._fields:
+            value = getattr(node, field)
+            if isinstance(value, AST):
+                setattr(node, field, self.stat(value) if field in STAT_FIELDS else self.visit(value))
+            elif isinstance(value, list):
+                visit = self.stat if field in STAT_FIELDS else self.visit
+                setattr(node, field, [visit(item) if isinstance(item, AST) else item for item in value])
+        return node
+
+    def stat(self, stat):
+        if stat.kind != FuncCall.kind:
+            return self.visit(stat)
+        self.generic_visitor(stat)
+        func = self.inlined_function(stat)
+        if func is None:
+            return stat
+        body = self.stat_body(stat.func_expr.identifier, func)
+        params = [name.identifier for name in func.param_names or []]
+        if body is None or any(node.kind in (FuncCall.kind, FuncDef.kind) or
+                               (node.kind == Name.kind and node.identifier in params)
+                               for arg_expr in stat.arg_exprs or [] for node in walk(arg_expr)):
+            return stat
+        self.inlined += 1
+        decls = [VarDeclStat([Name(name.identifier, name.position)], [arg_expr], False, stat.position)
+                 for name, arg_expr in zip(func.param_names or [], stat.arg_exprs or [])]
+        return BlockStat(decls + [copy_tree(body_stat) for body_stat in body], stat.position)
+
+    def visit_FuncCall(self, node: FuncCall):
+        self.generic_visitor(node)
+        func = self.inlined_function(node)
+        if func is None or len(func.body) != 1 or func.body[0].kind != ReturnStat.kind or func.body[0].expr is None:
+            return node
+        expr = func.body[0].expr
+        if any(child.kind not in INLINE_EXPR_KINDS for child in walk(expr)):
+            return node
+        args = {name.identifier: arg_expr for name, arg_expr in zip(func.param_names or [], node.arg_exprs or [])}
+        if any(arg_expr.kind not in LITERAL_KINDS + (Name.kind,) for arg_expr in args.values()):
+            return node
+        # parameters with a name for arg, read first and in order
+        names = [name.identifier for name in func.param_names or [] if args[name.identifier].kind == Name.kind]
+        read = 0
+        for child in evaluation_order(expr):
+            if child.kind in LITERAL_KINDS:
+                continue
+            if child.kind == Name.kind and child.identifier in args:
+                if child.identifier not in names[:read] and args[child.identifier].kind == Name.kind:
+                    if child.identifier != names[read]:
+                        return node
+                    read += 1
+            elif read < len(names):
+                return node
+        if read < len(names):
+            return node
+        self.inlined += 1
+        return replace_names(expr, args)
+
+    def inlined_function(self, node: FuncCall):
+        """FuncDef a call can be replaced by, None if it can't
+        """
+        if node.func_expr.kind != Name.kind:
+            return None
+        func = self.functions.get(node.func_expr.identifier)
+        if func is None or func.vararg:
+            return None
+        params = [name.identifier for name in func.param_names or []]
+        if len(params) != len(node.arg_exprs or []) or len(set(params)) != len(params):
+            return None     # a missing arg is looked up through the callers, an extra one isn't evaluated
+        if sum(count_nodes(stat) for stat in func.body) > INLINE_MAX_NODES:
+            return None
+        return func
+
+    def stat_body(self, identifier, func):
+        if identifier not in self.bodies:
+            body = without_returns(func.body)
+            if any(node.kind in (ReturnStat.kind, FuncDef.kind) for stat in body for node in walk(stat)) or \
+                    any(has_loop_jump(stat) for stat in body):
+                body = None     # a break or continue of no loop fails in a function
+            self.bodies[identifier] = body
+        return self.bodies[identifier]
+
+
+def inline_functions(tree: Program):
+    """inline calls of program-level functions, return the number of calls inlined
+    """
+    functions = find_bindings(tree, (FuncDef.kind,))
+    if not functions:
+        return 0
+    inliner = FunctionInliner(functions)
+    inliner.visit(tree)
+    return inliner.inlined
+
+
+def literal_truth(node):
+    """whether a literal condition is true, None if it's not a literal or
+    not convertible to bool (the error is raised at run time)
+    """
+    if node.kind not in LITERAL_KINDS:
+        return None
+    try:
+        return OpImpl.convert_to_bool(literal_value(node))._val
+    except ValueTypeError:
+        return None
+
+
+def literal_equal(left, right):
+    """whether two literal values are equal as `switch` compares them, None if it fails
+    """
+    try:
+        return OpImpl.eq(left, right)._val
+    except EVALUATION_ERRORS:       # fails at run time as before
+        return None
+
+
+class DeadCodeEliminator(AstNodeVistor):
+    """remove statements which never run
+
+    visit returns the node, its replacement, or None if a stat is removed.
+    a stat in a list is dropped, a stat in the place of one (a loop body,
+    a branch) becomes an EmptyStat. a branch which replaces an `if` or a
+    `switch` declares its names into the same scope as before.
+    """
+    def __init__(self):
+        self.pruned = 0         # nodes removed from the tree
+
+    def prune(self, *nodes):
+        for node in nodes:
+            if node is not None:
+                self.pruned += count_nodes(node)
+
+    def stats(self, stats):
+        """a list of stats without removed ones and the ones after a jump
+        """
+        result = []
+        for index, stat in enumerate(stats):
+            stat = self.visit(stat)
+            if stat is None:
+                continue
+            result.append(stat)
+            if always_jumps(stat):
+                self.prune(*stats[index + 1:])
+                break
+        return result
+
+    def stat(self, stat):
+        stat = self.visit(stat)
+        return EmptyStat() if stat is None else stat
+
+    def replace(self, node, stat, *pruned):
+        """replace node by one of its stats, None if there's none
+        """
+        self.pruned += 1
+        self.prune(*pruned)
+        return None if stat is None or stat.kind == EmptyStat.kind else stat
+
+    def generic_visitor(self, node):
+        for field in node._fields:
+            value = getattr(node, field)
+            if isinstance(value, AST):
+                setattr(node, field, self.stat(value))
+            elif isinstance(value, list):
+                setattr(node, field, [self.stat(item) if isinstance(item, AST) else item for item in value])
+        return node
+
+    def visit_Program(self, node: Program):
+        node.stats = self.stats(node.stats)
+        return node
+
+    def visit_BlockStat(self, node: BlockStat):
+        node.stats = self.stats(node.stats)
+        return node
+
+    def visit_FuncDef(self, node: FuncDef):
+        node.body = self.stats(node.body)
+        return node
+
+    def visit_IfStat(self, node: IfStat):
+        cond_exprs, stats = [], []
+        for index, (cond_expr, stat) in enumerate(zip(node.cond_exprs, node.stats)):
+            truth = literal_truth(cond_expr)
+            if truth is False:
+                self.prune(cond_expr, stat)
+                continue
+            cond_exprs.append(self.visit(cond_expr))
+            stats.append(self.stat(stat))
+            if truth:                   # the branches after never run
+                self.prune(*node.cond_exprs[index + 1:], *node.stats[index + 1:])
+                break
+        if not stats:
+            return self.replace(node, None)
+        if literal_truth(cond_exprs[0]):
+            return self.replace(node, stats[0], cond_exprs[0])
+        node.cond_exprs, node.stats = cond_exprs, stats
+        return node
+
+    def visit_SwitchStat(self, node: SwitchStat):
+        node.expr = self.visit(node.expr)
+        switch_val = literal_value(node.expr) if node.expr.kind in LITERAL_KINDS else None
+        literal_switch = switch_val is not None
+        case_vals = []          # values of the literal cases kept
+        case_exprs, case_stats = [], []
+        matched = False
+        for index, (case_expr, case_stat) in enumerate(zip(node.case_exprs, node.case_stats)):
+            if case_expr.kind in LITERAL_KINDS:
+                case_val = literal_value(case_expr)
+                equal = literal_equal(switch_val, case_val) if switch_val is not None else None
+                if equal is False or any(literal_equal(val, case_val) for val in case_vals):
+                    self.prune(case_expr, case_stat)    # a case before matches first
+                    continue
+                if equal is None:       # compared at run time, or fails there
+                    switch_val = None
+                matched = equal is True
+                case_vals.append(case_val)
+            case_exprs.append(self.visit(case_expr))
+            case_stats.append(self.stat(case_stat))
+            if matched:
+                self.prune(*node.case_exprs[index + 1:], *node.case_stats[index + 1:], node.default_stat)
+                break
+        default_stat = self.stat(node.default_stat) if node.default_stat and not matched else None
+
+        if literal_switch and not case_exprs:
+            return self.replace(node, default_stat, node.expr)
+        if literal_switch and matched and len(case_exprs) == 1:
+            return self.replace(node, case_stats[0], node.expr, case_exprs[0])
+        node.case_exprs, node.case_stats, node.default_stat = case_exprs, case_stats, default_stat
+        return node
+
+    def visit_WhileStat(self, node: WhileStat):
+        if literal_truth(node.expr) is False:
+            self.prune(node)
+            return None
+        node.expr = self.visit(node.expr)
+        node.stat = self.stat(node.stat)
+        return node
+
+
+def always_jumps(stat):
+    """whether stat always ends in a return, break or continue
+    """
+    if stat.kind in (ReturnStat.kind, BreakStat.kind, ContinueStat.kind):
+        return True
+    return stat.kind == BlockStat.kind and bool(stat.stats) and always_jumps(stat.stats[-1])
+
+
+def eliminate_dead_code(tree: Program):
+    """remove dead code from tree, return the number of nodes pruned
+    """
+    eliminator = DeadCodeEliminator()
+    eliminator.visit(tree)
+    return eliminator.pruned
+
+
+def optimize(tree: Program):
+    """run all passes over tree, return a dict of statistics
+    """
+    folded, propagated = fold_constants(tree)
+    inlined = inline_functions(tree)
+    if inlined:                 # args in the bodies inlined
+        folder = ConstantFolder()
+        folder.visit(tree)
+        folded += folder.folded
+    pruned = eliminate_dead_code(tree)
+    return {'folded': folded, 'propagated': propagated, 'inlined': inlined, 'pruned': pruned}
+
+
+if __name__ == '__main__':
+    from toylexer import *
+    from toyparser import *
+    import argparse
+
+    parser = argparse.ArgumentParser(description='toylang ast optimizer, print what the passes changed')
+    parser.add_argument('file', help='source file')
+    args = parser.parse_args()
+
+    with open(args.file, 'r', encoding='utf-8') as f:
+        tree = Parser(Lexer.from_file(f)).parse()
+    for key, value in optimize(tree).items():
+        print(f'{key:<12} {value}')
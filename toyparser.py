@@ -9,10 +9,46 @@ from toyast import *
 from toydisplayer import *
 import sys
 
+
+# binary operator precedence, from logic_or_expr (lowest) to multiple_expr (highest)
+BINOP_PRECEDENCE = {
+    TokenType.OR        : 1,
+    TokenType.AND       : 2,
+    TokenType.IN        : 3,
+    TokenType.IS        : 3,
+    TokenType.EQ        : 4,
+    TokenType.NE        : 4,
+    TokenType.LT        : 4,
+    TokenType.LE        : 4,
+    TokenType.GT        : 4,
+    TokenType.GE        : 4,
+    TokenType.BOR       : 5,
+    TokenType.BXOR      : 6,
+    TokenType.BAND      : 7,
+    TokenType.BSHL      : 8,
+    TokenType.BSHR      : 8,
+    TokenType.ADD       : 9,
+    TokenType.SUB       : 9,
+    TokenType.MUL       : 10,
+    TokenType.DIV       : 10,
+    TokenType.MOD       : 10,
+}
+BINOP_MAX_PRECEDENCE = 10
+RELATION_PRECEDENCE = 4     # relation_expr is not chained: `a < b < c` is not a expr
+
+
 class Parser:
-    def __init__(self, lexer: Lexer):
+    def __init__(self, lexer, pratt=False):
+        """lexer: a Lexer, or a token iterable like `iter_tokens(text)` or a TokenBuffer
+        pratt: parse binary exprs by precedence climbing, see `binary_expr`
+        """
         self.lexer = lexer
-        self.current_token = self.lexer.next_token()
+        self.pratt = pratt
+        if hasattr(lexer, 'next_token'):
+            self.next_token = lexer.next_token
+        else:
+            self.next_token = iter(lexer).__next__
+        self.current_token = self.next_token()
 
     def error(self, token: Token, message):
         raise ParserError(token.position, message)
@@ -21,7 +57,7 @@ class Parser:
         """verify the token type
         """
         if self.current_token.type == token_type:
-            self.current_token = self.lexer.next_token()
+            self.current_token = self.next_token()
         else:
             self.error(self.current_token, f'expect {token_type}')
 
@@ -400,7 +436,7 @@ class Parser:
         select_expr : logic_or_expr (QUERY expr COLON expr)?
         """
 
-        lor_expr = self.logic_or_expr()
+        lor_expr = self.binary_expr(1) if self.pratt else self.logic_or_expr()
         if self.current_token.type != TokenType.QUERY:
             return lor_expr
 
@@ -412,6 +448,26 @@ class Parser:
         s_expr.expr2 = self.expr()
         return s_expr
 
+    def binary_expr(self, min_precedence):
+        """parse logic_or_expr ... multiple_expr by precedence climbing
+
+        builds the same BinOpExpr trees as the logic_or_expr -> multiple_expr
+        descent, without a method call per precedence level
+        """
+        expr = self.unary_expr()
+        max_precedence = BINOP_MAX_PRECEDENCE
+        while True:
+            token = self.current_token
+            precedence = BINOP_PRECEDENCE.get(token.type)
+            if precedence is None or precedence < min_precedence or precedence > max_precedence:
+                return expr
+            expr = BinOpExpr(operator=token.type, left_expr=expr, right_expr=None,
+                             position=token.position)
+            self.eat(token.type)
+            expr.right_expr = self.binary_expr(precedence + 1)
+            # left-assoc: no higher operator may follow, relation_expr: no other relation
+            max_precedence = precedence - 1 if precedence == RELATION_PRECEDENCE else precedence
+
     def logic_or_expr(self):
         """parse logic_or_expr
 
@@ -762,20 +818,499 @@ class Parser:
         return result
 
 
+class IterativeParser(Parser):
+    """parse with a explicit stack instead of python recursion
+
+    the grammar methods below are generators with the same names as the
+    Parser methods. a nested rule is parsed by `yield self.rule()`, `run`
+    pushes that generator to its stack and sends the result back, so the
+    nesting depth of the source is only bounded by memory. rules which never
+    nest (name, name_list, empty/break/continue_stat) are the Parser methods.
+
+    binary exprs are always parsed by precedence climbing, the trees are the
+    same as Parser builds. `python toyparser.py --check` compares the trees
+    and errors of both parsers, run it after changing the grammar.
+    """
+    def run(self, rule):
+        """drive a generator rule to its result
+        """
+        stack = [rule]
+        value = None
+        while True:
+            try:
+                child = stack[-1].send(value)
+            except StopIteration as e:
+                stack.pop()
+                value = e.value
+                if not stack:
+                    return value
+            else:
+                stack.append(child)
+                value = None
+
+    def parse(self):
+        result = self.run(self.program())
+        if self.current_token.type != TokenType.EOF:
+            self.error(self.current_token, ErrorInfo.unexpected_token(self.current_token, 'EOF'))
+        return result
+
+    def program(self):
+        return Program(stats=(yield self.stat_list()))
+
+    def stat_list(self):
+        result = []
+        while self.current_token.type not in (TokenType.RBRACE, TokenType.EOF):
+            stat = yield self.stat()
+            if type(stat) is not EmptyStat:
+                result.append(stat)
+        return result
+
+    def stat(self):
+        if self.current_token.type == TokenType.SEMI:
+            return self.empty_stat()
+        elif self.current_token.type == TokenType.LBRACE:
+            return (yield self.block_stat())
+        elif self.current_token.type in (TokenType.VAR, TokenType.CONST):
+            return (yield self.var_decl_stat())
+        elif self.current_token.type == TokenType.IF:
+            return (yield self.if_stat())
+        elif self.current_token.type == TokenType.SWITCH:
+            return (yield self.switch_stat())
+        elif self.current_token.type == TokenType.REPEAT:
+            return (yield self.repeat_stat())
+        elif self.current_token.type == TokenType.WHILE:
+            return (yield self.while_stat())
+        elif self.current_token.type == TokenType.FOR:
+            return (yield self.for_prefix_stat())
+        elif self.current_token.type == TokenType.BREAK:
+            return self.break_stat()
+        elif self.current_token.type == TokenType.CONTINUE:
+            return self.continue_stat()
+        elif self.current_token.type == TokenType.FUNC:
+            return (yield self.func_prefix_stat())
+        elif self.current_token.type == TokenType.RETURN:
+            return (yield self.return_stat())
+        else:
+            return (yield self.identifier_prefix_stat())
+
+    def block_stat(self):
+        stat = BlockStat(stats=None,
+                         position=self.current_token.position)
+        self.eat(TokenType.LBRACE)
+        stat.stats = yield self.stat_list()
+        self.eat(TokenType.RBRACE)
+        return stat
+
+    def var_decl_stat(self):
+        const = True if self.current_token.type == TokenType.CONST else False
+        stat = VarDeclStat(names=None, exprs=None, const=const,
+                           position=self.current_token.position)
+        self.eat(self.current_token.type)
+        stat.names = self.name_list()
+        if self.current_token.type == TokenType.ASSIGN:
+            self.eat(TokenType.ASSIGN)
+            stat.exprs = yield self.expr_list()
+        return stat
+
+    def if_stat(self):
+        stat = IfStat(cond_exprs=[], stats=[],
+                      position=self.current_token.position)
+
+        self.eat(TokenType.IF)
+        stat.cond_exprs.append((yield self.expr()))
+        if self.current_token.type == TokenType.COLON:
+            self.eat(TokenType.COLON)
+        stat.stats.append((yield self.stat()))
+
+        while self.current_token.type == TokenType.ELIF:
+            self.eat(TokenType.ELIF)
+            stat.cond_exprs.append((yield self.expr()))
+            if self.current_token.type == TokenType.COLON:
+                self.eat(TokenType.COLON)
+            stat.stats.append((yield self.stat()))
+
+        if self.current_token.type == TokenType.ELSE:
+            stat.cond_exprs.append(BoolLiteral('true', self.current_token.position))
+            self.eat(TokenType.ELSE)
+            if self.current_token.type == TokenType.COLON:
+                self.eat(TokenType.COLON)
+            stat.stats.append((yield self.stat()))
+
+        return stat
+
+    def switch_stat(self):
+        stat = SwitchStat(expr=None, case_exprs=[], case_stats=[], default_stat=None,
+                          position=self.current_token.position)
+        self.eat(TokenType.SWITCH)
+        stat.expr = yield self.expr()
+        if self.current_token.type == TokenType.COLON:
+            self.eat(TokenType.COLON)
+
+        if self.current_token.type != TokenType.CASE:
+            self.error(self.current_token, ErrorInfo.unexpected_token(self.current_token.value, "case"))
+
+        while self.current_token.type == TokenType.CASE:
+            self.eat(TokenType.CASE)
+            stat.case_exprs.append((yield self.expr()))
+            if self.current_token.type == TokenType.COLON:
+                self.eat(TokenType.COLON)
+            stat.case_stats.append((yield self.stat()))
+
+        if self.current_token.type == TokenType.DEFAULT:
+            self.eat(TokenType.DEFAULT)
+            if self.current_token.type == TokenType.COLON:
+                self.eat(TokenType.COLON)
+            stat.default_stat = yield self.stat()
+        return stat
+
+    def repeat_stat(self):
+        stat = RepeatStat(stat=None, expr=None,
+                          position=self.current_token.position)
+        self.eat(TokenType.REPEAT)
+        if self.current_token.type == TokenType.COLON:
+            self.eat(TokenType.COLON)
+        stat.stat = yield self.stat()
+
+        self.eat(TokenType.UNTIL)
+        stat.expr = yield self.expr()
+        return stat
+
+    def while_stat(self):
+        stat = WhileStat(expr=None, stat=None,
+                         position=self.current_token.position)
+        self.eat(TokenType.WHILE)
+        stat.expr = yield self.expr()
+        if self.current_token.type == TokenType.COLON:
+            self.eat(TokenType.COLON)
+        stat.stat = yield self.stat()
+        return stat
+
+    def for_prefix_stat(self):
+        position = self.current_token.position
+        self.eat(TokenType.FOR)
+        name = self.name()
+
+        if self.current_token.type == TokenType.IS:
+            return (yield self.complete_forloop_stat(name, position))
+        else:
+            return (yield self.complete_foreach_stat(name, position))
+
+    def complete_forloop_stat(self, name, position):
+        stat = ForloopStat(var_name=name, start_expr=None, end_expr=None, step_expr=None, stat=None,
+                           position=position)
+
+        self.eat(TokenType.IS)
+        stat.start_expr = yield self.expr()
+        self.eat(TokenType.COMMA)
+        stat.end_expr = yield self.expr()
+        if self.current_token.type == TokenType.COMMA:
+            self.eat(TokenType.COMMA)
+            stat.step_expr = yield self.expr()
+        if self.current_token.type == TokenType.COLON:
+            self.eat(TokenType.COLON)
+        stat.stat = yield self.stat()
+        return stat
+
+    def complete_foreach_stat(self, name, position):
+        stat = ForeachStat(key_name=name, val_name=None, expr=None, stat=None,
+                           position=position)
+
+        if self.current_token.type == TokenType.COMMA:
+            self.eat(TokenType.COMMA)
+            stat.val_name = self.name()
+        self.eat(TokenType.IN)
+
+        stat.expr = yield self.expr()
+        if self.current_token.type == TokenType.COLON:
+            self.eat(TokenType.COLON)
+        stat.stat = yield self.stat()
+        return stat
+
+    def func_prefix_stat(self):
+        self.eat(TokenType.FUNC)
+        if self.current_token.type == TokenType.IDENTIFIER:
+            name = self.name()
+            func_def = yield self.func_def()
+            stat = VarDeclStat(names=[name], exprs=[func_def], const=True,
+                               position=self.current_token.position)
+        else:
+            func = yield self.func_def()
+            stat = yield self.complete_func_call(func)
+        return stat
+
+    def return_stat(self):
+        stat = ReturnStat(expr=None, position=self.current_token.position)
+        self.eat(TokenType.RETURN)
+        if self.current_token.type == TokenType.SEMI:
+            self.eat(TokenType.SEMI)
+        else:
+            stat.expr = yield self.expr()
+        return stat
+
+    def identifier_prefix_stat(self):
+        lve = yield self.lvalue_expr()
+        if self.current_token.type in (TokenType.COMMA, TokenType.ASSIGN):
+            return (yield self.complete_assign_stat(lve))
+        elif self.current_token.type == TokenType.LPAREN:
+            return (yield self.complete_func_call(lve))
+        else:
+            return (yield self.complete_compoundassign_stat(lve))
+
+    def complete_assign_stat(self, lvalue_expr):
+        lexprs = [lvalue_expr]
+        while self.current_token.type == TokenType.COMMA:
+            self.eat(TokenType.COMMA)
+            lexprs.append((yield self.lvalue_expr()))
+
+        stat = AssignStat(left_exprs=lexprs, right_exprs=None,
+                          position=self.current_token.position)
+        self.eat(TokenType.ASSIGN)
+
+        stat.right_exprs = yield self.expr_list()
+        return stat
+
+    def complete_compoundassign_stat(self, lvalue_expr):
+        if self.current_token.type in (TokenType.SELF_ADD, TokenType.SELF_ADD,
+                                       TokenType.SELF_SUB, TokenType.SELF_MUL,
+                                       TokenType.SELF_DIV, TokenType.SELF_POW,
+                                       TokenType.SELF_MOD, TokenType.SELF_BSHL,
+                                       TokenType.SELF_BSHR, TokenType.SELF_BAND,
+                                       TokenType.SELF_BXOR, TokenType.SELF_BOR):
+            stat = CompoundAssignStat(operator=self.current_token.type,
+                                      left_expr=lvalue_expr,
+                                      right_expr=None,
+                                      position=self.current_token.position)
+            self.eat(self.current_token.type)
+            stat.right_expr = yield self.expr()
+            return stat
+        else:
+            self.error(self.current_token, ErrorInfo.unexpected_token(self.current_token.value, 'compoundassign'))
+
+    def complete_func_call(self, func):
+        call = FuncCall(func_expr=func, arg_exprs=None, position=self.current_token.position)
+        self.eat(TokenType.LPAREN)
+        if self.current_token.type != TokenType.RPAREN:
+            call.arg_exprs = yield self.expr_list()
+        self.eat(TokenType.RPAREN)
+        return call
+
+    def expr(self):
+        return (yield self.select_expr())
+
+    def select_expr(self):
+        lor_expr = yield self.binary_expr(1)
+        if self.current_token.type != TokenType.QUERY:
+            return lor_expr
+
+        s_expr = SelectExpr(cond=lor_expr, expr1=None, expr2=None,
+                            position=self.current_token.position)
+        self.eat(TokenType.QUERY)
+        s_expr.expr1 = yield self.expr()
+        self.eat(TokenType.COLON)
+        s_expr.expr2 = yield self.expr()
+        return s_expr
+
+    def binary_expr(self, min_precedence):
+        expr = yield self.unary_expr()
+        max_precedence = BINOP_MAX_PRECEDENCE
+        while True:
+            token = self.current_token
+            precedence = BINOP_PRECEDENCE.get(token.type)
+            if precedence is None or precedence < min_precedence or precedence > max_precedence:
+                return expr
+            expr = BinOpExpr(operator=token.type, left_expr=expr, right_expr=None,
+                             position=token.position)
+            self.eat(token.type)
+            expr.right_expr = yield self.binary_expr(precedence + 1)
+            max_precedence = precedence - 1 if precedence == RELATION_PRECEDENCE else precedence
+
+    def unary_expr(self):
+        if self.current_token.type in (TokenType.ADD, TokenType.SUB, TokenType.NOT,
+                                       TokenType.LEN, TokenType.BNOT):
+            expr = UniOpExpr(operator=self.current_token.type, expr=None,
+                             position=self.current_token.position)
+            self.eat(self.current_token.type)
+            expr.expr = yield self.unary_expr()
+            return expr
+
+        return (yield self.pow_expr())
+
+    def pow_expr(self):
+        expr = yield self.primary_expr()
+        while self.current_token.type == TokenType.POW:
+            expr = BinOpExpr(operator=self.current_token.type, left_expr=expr, right_expr=None,
+                             position=self.current_token.position)
+            self.eat(self.current_token.type)
+            expr.right_expr = yield self.primary_expr()
+        return expr
+
+    def primary_expr(self):
+        if self.current_token.type == TokenType.INT_LITERAL:
+            expr = NumLiteral(self.current_token.value, is_int=True,
+                              position=self.current_token.position)
+            self.eat(self.current_token.type)
+            return expr
+        elif self.current_token.type == TokenType.FLOAT_LITERAL:
+            expr = NumLiteral(self.current_token.value, is_int=False,
+                              position=self.current_token.position)
+            self.eat(self.current_token.type)
+            return expr
+        elif self.current_token.type == TokenType.STRING_LITERAL:
+            expr = StringLiteral(self.current_token.value, self.current_token.position)
+            self.eat(self.current_token.type)
+            return expr
+        elif self.current_token.type in (TokenType.TRUE, TokenType.FALSE):
+            expr = BoolLiteral(self.current_token.value, self.current_token.position)
+            self.eat(self.current_token.type)
+            return expr
+        elif self.current_token.type == TokenType.NULL:
+            expr = NullLiteral(self.current_token.position)
+            self.eat(self.current_token.type)
+            return expr
+        elif self.current_token.type == TokenType.LPAREN:
+            self.eat(TokenType.LPAREN)
+            expr = yield self.expr()
+            self.eat(TokenType.RPAREN)
+            return expr
+        elif self.current_token.type == TokenType.LBRACK:
+            return (yield self.list_ctor_expr())
+        elif self.current_token.type == TokenType.LBRACE:
+            return (yield self.map_set_ctor_expr())
+        elif self.current_token.type == TokenType.FUNC:
+            self.eat(TokenType.FUNC)
+            expr = yield self.func_def()
+            if self.current_token.type == TokenType.LPAREN:
+                expr = yield self.complete_func_call(expr)
+            return expr
+        else:
+            if self.current_token.type != TokenType.IDENTIFIER:
+                self.error(self.current_token, ErrorInfo.unexpected_token(self.current_token.value, 'IDENTIFIER'))
+            expr = yield self.lvalue_expr()
+            if self.current_token.type == TokenType.LPAREN:
+                return (yield self.complete_func_call(expr))
+            return expr
+
+    def list_ctor_expr(self):
+        expr = ListCtorExpr(exprs=None, position=self.current_token.position)
+        self.eat(TokenType.LBRACK)
+        if self.current_token.type != TokenType.RBRACK:
+            expr.exprs = yield self.expr_list()
+        self.eat(TokenType.RBRACK)
+        return expr
+
+    def map_set_ctor_expr(self):
+        position = self.current_token.position
+        self.eat(TokenType.LBRACE)
+        key_exprs = []
+        value_exprs = []
+        is_set = False
+        if self.current_token.type != TokenType.RBRACE:
+            key_exprs.append((yield self.expr()))
+            if self.current_token.type == TokenType.COLON:
+                self.eat(TokenType.COLON)
+                value_exprs.append((yield self.expr()))
+            else:
+                is_set = True
+            while self.current_token.type == TokenType.COMMA:
+                self.eat(TokenType.COMMA)
+                key_exprs.append((yield self.expr()))
+                if not is_set:
+                    self.eat(TokenType.COLON)
+                    value_exprs.append((yield self.expr()))
+        self.eat(TokenType.RBRACE)
+        if is_set:
+            return SetCtorExpr(key_exprs, position)
+        return MapCtorExpr(key_exprs, value_exprs, position)
+
+    def lvalue_expr(self):
+        lve = self.name()
+        while self.current_token.type in (TokenType.LBRACK, TokenType.DOT):
+            lve = AccessExpr(expr=lve, field_expr=None, dot=False,
+                             position=self.current_token.position)
+            if self.current_token.type == TokenType.LBRACK:
+                self.eat(TokenType.LBRACK)
+                lve.field_expr = yield self.expr()
+                self.eat(TokenType.RBRACK)
+            else:
+                self.eat(TokenType.DOT)
+                lve.dot = True
+                lve.field_expr = StringLiteral(self.current_token.value, self.current_token.position)
+                self.eat(TokenType.IDENTIFIER)
+        return lve
+
+    def expr_list(self):
+        exprs = [(yield self.expr())]
+        while self.current_token.type == TokenType.COMMA:
+            self.eat(TokenType.COMMA)
+            exprs.append((yield self.expr()))
+        return exprs
+
+    def func_def(self):
+        func = FuncDef(param_names=None, vararg=False, body=None,
+                       position=self.current_token.position)
+        self.eat(TokenType.LPAREN)
+        if self.current_token.type != TokenType.RPAREN:
+            if self.current_token.type != TokenType.VARARG:
+                func.param_names = self.name_list()
+        self.eat(TokenType.RPAREN)
+        self.eat(TokenType.LBRACE)
+        func.body = yield self.stat_list()
+        self.eat(TokenType.RBRACE)
+        return func
+
+
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print('usage: python toy.py <src.toy>')
-        sys.exit(0)
+    from toyserial import same_tree
+    import argparse
+    import glob
+    import os
 
-    with open(sys.argv[1], 'r') as f:
-        code = f.read()
+    def parse_result(parser_type, text):
+        """the tree, or (error type, position, message)
+        """
+        try:
+            return parser_type(Lexer(text)).parse()
+        except (LexerError, ParserError) as e:
+            return (type(e).__name__, e.position, e.message)
+
+    def check_parsers(text):
+        """line number of the first line Parser and IterativeParser disagree
+        on text cut after it or text without it, 0 if they always agree
+        """
+        lines = text.splitlines(keepends=True)
+        for i in range(len(lines)):
+            for variant in (''.join(lines[:i + 1]), ''.join(lines[:i] + lines[i + 1:])):
+                if not same_tree(parse_result(Parser, variant), parse_result(IterativeParser, variant)):
+                    return i + 1
+        return 0
+
+    parser = argparse.ArgumentParser(description='toylang parser, show the ast of a source in ast.html')
+    parser.add_argument('file', nargs='?', help='source file')
+    parser.add_argument('--check', nargs='*', metavar='FILE',
+                        help='check IterativeParser gives the same trees and errors as Parser on the files cut after or without each line, default test/*.toy')
+    args = parser.parse_args()
+
+    if args.check is not None:
+        paths = args.check or sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test', '*.toy')))
+        failed = 0
+        for path in paths:
+            with open(path, 'r', encoding='utf-8') as f:
+                line = check_parsers(f.read())
+            failed += line != 0
+            print(f'{os.path.basename(path):<24} {f"FAILED at line {line}" if line else "ok"}')
+        sys.exit(1 if failed else 0)
+
+    if args.file is None:
+        parser.print_usage()
+        sys.exit(0)
 
     try:
-        lexer = Lexer(code)
-        parser = Parser(lexer)
-        tree = parser.parse()
+        with open(args.file, 'r') as f:
+            lexer = Lexer.from_file(f)
+            parser = Parser(lexer)
+            tree = parser.parse()
 
         displayer = Displayer(tree, 'ast.html')
         displayer.display()
     except (LexerError, ParserError) as e:
-        print(e)
+        print(e.locate(lexer.line_table()))
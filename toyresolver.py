@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+toylang name resolver
+
+annotates a tree, so Interpreter finds most names without walking the
+activation records by name:
+- BlockStat, loops, FuncDef: `scope`, identifier -> slot of the record they create
+- BlockStat, RepeatStat, WhileStat: `elided`, true if it declares nothing (and
+  a loop has no break or continue of its own), it runs in the enclosing record
+- Name: `depth` and `slot`
+    depth >= 0          : the record `depth` levels out of the current one, at `slot`
+    depth == GLOBAL_DEPTH: the global record
+    depth is None       : looked up by name through the records
+
+scopes are toyanalyzer.ScopeSymbolTable, with all names declared in a scope
+inserted when it's entered. a slot is empty until its declaration runs, the
+interpreter looks the name up by name then.
+
+a function starts a new chain of scopes: the records of its callers are only
+known at run time (dynamic scope). a name which the function doesn't declare
+goes to the global record directly only if no block, loop or function
+declares it anywhere.
+"""
+from toyast import *
+from toyanalyzer import ScopeSymbolTable, VarSymbol
+
+
+GLOBAL_DEPTH = -1
+
+
+def declared_names(stat):
+    """yield names a stat declares into the current scope
+    """
+    if stat.kind == VarDeclStat.kind:
+        for name in stat.names:
+            yield name.identifier
+    elif stat.kind == IfStat.kind:
+        for branch in stat.stats:
+            if branch.kind != BlockStat.kind:
+                yield from declared_names(branch)
+    elif stat.kind == SwitchStat.kind:
+        for branch in stat.case_stats + ([stat.default_stat] if stat.default_stat else []):
+            if branch.kind != BlockStat.kind:
+                yield from declared_names(branch)
+
+
+def body_names(stat):
+    """names the body of a loop declares into the loop scope
+    """
+    return [] if stat.kind == BlockStat.kind else list(declared_names(stat))
+
+
+def has_loop_jump(stat):
+    """whether stat has a break or continue of the loop it's the body of
+    """
+    if stat.kind in (BreakStat.kind, ContinueStat.kind):
+        return True
+    if stat.kind in (RepeatStat.kind, WhileStat.kind, ForloopStat.kind, ForeachStat.kind, FuncDef.kind):
+        return False
+    return any(has_loop_jump(child) for child in stat.children())
+
+
+class Resolver(AstNodeVistor):
+    def __init__(self, elide=True):
+        self.elide = elide          # no records for blocks and loops which declare nothing
+        self.scope = None           # None at program level, names there are global
+        self.in_function = False
+        self.local_names = set()    # declared in a non-global record, in all resolved trees
+        self.global_refs = {}       # identifier -> names in functions resolved to the global record
+        self.function_refs = []     # names in functions not declared in the function
+
+    def resolve(self, tree):
+        """annotate tree, names resolved to the global record by earlier trees
+        are reset if tree declares them in a non-global scope (repl)
+        """
+        self.function_refs = []
+        self.visit(tree)
+        for name in self.function_refs:
+            if name.identifier in self.local_names:
+                name.depth = None
+            else:
+                name.depth = GLOBAL_DEPTH
+                self.global_refs.setdefault(name.identifier, []).append(name)
+        for identifier in [identifier for identifier in self.global_refs if identifier in self.local_names]:
+            for name in self.global_refs.pop(identifier):
+                name.depth = None
+        return tree
+
+    def enter_scope(self, identifier, identifiers, parent):
+        """enter a new scope with identifiers declared, return identifier -> slot
+        """
+        scope = ScopeSymbolTable(identifier, level=parent.level + 1 if parent else 0, parent=parent)
+        for identifier in identifiers:
+            if scope.lookup(identifier, current_scope_only=True) is None:
+                symbol = VarSymbol(identifier)
+                symbol.slot = len(scope.symbols)
+                scope.insert(symbol)
+            self.local_names.add(identifier)
+        self.scope = scope
+        return {symbol.identifier: symbol.slot for symbol in scope.symbols.values()}
+
+    def exit_scope(self):
+        self.scope = self.scope.parent
+
+    def declare(self, name: Name):
+        """annotate a name declared in the current scope
+        """
+        if self.scope is None:
+            name.depth, name.slot = GLOBAL_DEPTH, None
+        else:
+            name.depth, name.slot = 0, self.scope.lookup(name.identifier, current_scope_only=True).slot
+
+    def generic_visitor(self, node):
+        for child in node.children():
+            self.visit(child)
+
+    def visit_BlockStat(self, node: BlockStat):
+        identifiers = [identifier for stat in node.stats for identifier in declared_names(stat)]
+        node.elided = self.elide and not identifiers
+        node.scope = None if node.elided else self.enter_scope('block', identifiers, self.scope)
+        for stat in node.stats:
+            self.visit(stat)
+        if not node.elided:
+            self.exit_scope()
+
+    def visit_VarDeclStat(self, node: VarDeclStat):
+        if node.exprs:
+            for expr in node.exprs:
+                self.visit(expr)
+        for name in node.names:
+            self.declare(name)
+
+    def visit_RepeatStat(self, node: RepeatStat):
+        identifiers = body_names(node.stat)
+        node.elided = self.elide and not identifiers and not has_loop_jump(node.stat)
+        node.scope = None if node.elided else self.enter_scope('repeat', identifiers, self.scope)
+        self.visit(node.stat)
+        self.visit(node.expr)
+        if not node.elided:
+            self.exit_scope()
+
+    def visit_WhileStat(self, node: WhileStat):
+        identifiers = body_names(node.stat)
+        node.elided = self.elide and not identifiers and not has_loop_jump(node.stat)
+        node.scope = None if node.elided else self.enter_scope('while', identifiers, self.scope)
+        self.visit(node.expr)
+        self.visit(node.stat)
+        if not node.elided:
+            self.exit_scope()
+
+    def visit_ForloopStat(self, node: ForloopStat):
+        self.visit(node.start_expr)
+        self.visit(node.end_expr)
+        if node.step_expr:
+            self.visit(node.step_expr)
+        node.scope = self.enter_scope('for', [node.var_name.identifier] + body_names(node.stat), self.scope)
+        self.declare(node.var_name)
+        self.visit(node.stat)
+        self.exit_scope()
+
+    def visit_ForeachStat(self, node: ForeachStat):
+        names = [node.key_name] if node.val_name is None else [node.key_name, node.val_name]
+        node.scope = self.enter_scope('for', [name.identifier for name in names] + body_names(node.stat), self.scope)
+        for name in names:
+            self.declare(name)
+        self.visit(node.expr)
+        self.visit(node.stat)
+        self.exit_scope()
+
+    def visit_FuncDef(self, node: FuncDef):
+        outer = (self.scope, self.in_function)
+        param_names = node.param_names or []
+        identifiers = [name.identifier for name in param_names]
+        identifiers += [identifier for stat in node.body for identifier in declared_names(stat)]
+        node.scope = self.enter_scope('function', identifiers, None)
+        self.in_function = True
+        for name in param_names:
+            self.declare(name)
+        for stat in node.body:
+            self.visit(stat)
+        self.scope, self.in_function = outer
+
+    def visit_Name(self, node: Name):
+        symbol = self.scope.lookup(node.identifier) if self.scope is not None else None
+        if symbol is not None:
+            node.depth, node.slot = self.scope.level - symbol.scope_level, symbol.slot
+        elif self.in_function:
+            node.depth, node.slot = None, None
+            self.function_refs.append(node)
+        else:
+            node.depth, node.slot = GLOBAL_DEPTH, None
+
+
+if __name__ == '__main__':
+    from toylexer import *
+    from toyparser import *
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='toylang name resolver, print how each name is found and elided records')
+    parser.add_argument('file', help='source file')
+    args = parser.parse_args()
+
+    with open(args.file, 'r', encoding='utf-8') as f:
+        lexer = Lexer.from_file(f)
+        try:
+            tree = Resolver().resolve(Parser(lexer).parse())
+        except (LexerError, ParserError) as e:
+            print(e.locate(lexer.line_table()))
+            sys.exit(1)
+    line_table = lexer.line_table()
+
+    for node in walk(tree):
+        if node.kind in (BlockStat.kind, RepeatStat.kind, WhileStat.kind) and node.elided:
+            line, col = line_table.resolve(node.position)
+            print(f'{line:>4}:{col:<4} {type(node).__name__:<16} no record')
+        elif node.kind == Name.kind:
+            line, col = line_table.resolve(node.position)
+            if node.depth is None:
+                how = 'by name'
+            elif node.depth == GLOBAL_DEPTH:
+                how = 'global'
+            else:
+                how = f'depth {node.depth}, slot {node.slot}'
+            print(f'{line:>4}:{col:<4} {node.identifier:<16} {how}')
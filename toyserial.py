@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+toylang binary ast format
+
+layout:
+    header      : MAGIC, FORMAT_VERSION byte
+    string pool : varint count, then (varint utf-8 length, bytes) for each
+    root node   : node
+
+    node        : kind byte (AST.kind), then a value per field in AST._fields
+    value       : tag byte, then
+        TAG_NONE/TAG_TRUE/TAG_FALSE  -
+        TAG_NODE                     node
+        TAG_LIST                     varint count, values
+        TAG_STR                      varint index in string pool
+        TAG_OP                       varint code of TokenType
+        TAG_INT                      zigzag varint
+
+identifiers and literals (numbers are kept as source text in the ast) are
+interned in the string pool, positions are varints.
+"""
+from toytoken import *
+from toyerror import *
+from toyast import *
+
+import mmap
+import sys
+
+
+MAGIC = b'TOYA'
+FORMAT_VERSION = 1
+
+TAG_NONE  = 0
+TAG_NODE  = 1
+TAG_LIST  = 2
+TAG_STR   = 3
+TAG_TRUE  = 4
+TAG_FALSE = 5
+TAG_OP    = 6
+TAG_INT   = 7
+
+
+def append_varint(buffer: bytearray, n):
+    while n >= 0x80:
+        buffer.append((n & 0x7f) | 0x80)
+        n >>= 7
+    buffer.append(n)
+
+
+class AstWriter:
+    def __init__(self):
+        self.body = bytearray()
+        self.strings = []
+        self.string_ids = {}
+
+    def write_node(self, node):
+        self.body.append(node.kind)
+        for field in node._fields:
+            self.write_value(getattr(node, field))
+
+    def write_value(self, value):
+        body = self.body
+        if value is None:
+            body.append(TAG_NONE)
+        elif value is True:
+            body.append(TAG_TRUE)
+        elif value is False:
+            body.append(TAG_FALSE)
+        elif isinstance(value, AST):
+            body.append(TAG_NODE)
+            self.write_node(value)
+        elif isinstance(value, list):
+            body.append(TAG_LIST)
+            append_varint(body, len(value))
+            for item in value:
+                self.write_value(item)
+        elif isinstance(value, str):
+            string_id = self.string_ids.get(value)
+            if string_id is None:
+                string_id = self.string_ids[value] = len(self.strings)
+                self.strings.append(value)
+            body.append(TAG_STR)
+            append_varint(body, string_id)
+        elif isinstance(value, TokenType):
+            body.append(TAG_OP)
+            append_varint(body, TOKEN_TYPE_CODES[value])
+        elif isinstance(value, int):
+            body.append(TAG_INT)
+            append_varint(body, value << 1 if value >= 0 else (-value << 1) - 1)
+        else:
+            raise SerialError(f'unsupported value type `{type(value).__name__}`')
+
+    def getvalue(self):
+        """header + string pool + nodes written
+        """
+        head = bytearray(MAGIC)
+        head.append(FORMAT_VERSION)
+        append_varint(head, len(self.strings))
+        for s in self.strings:
+            data = s.encode('utf-8')
+            append_varint(head, len(data))
+            head += data
+        return bytes(head + self.body)
+
+
+class AstReader:
+    def __init__(self, data, pos=0):
+        """data: bytes, memoryview or mmap
+        """
+        self.data = data
+        self.pos = pos
+        self.strings = []
+
+    def read_varint(self):
+        data = self.data
+        pos = self.pos
+        result = 0
+        shift = 0
+        while True:
+            byte = data[pos]
+            pos += 1
+            result |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        self.pos = pos
+        return result
+
+    def read_header(self):
+        end = self.pos + len(MAGIC)
+        if self.data[self.pos:end] != MAGIC:
+            raise SerialError('not a toylang ast')
+        if self.data[end] != FORMAT_VERSION:
+            raise SerialError(f'unsupported ast format version {self.data[end]}')
+        self.pos = end + 1
+        for _ in range(self.read_varint()):
+            length = self.read_varint()
+            self.strings.append(str(self.data[self.pos:self.pos + length], 'utf-8'))
+            self.pos += length
+
+    def read_node(self):
+        kind = self.data[self.pos]
+        self.pos += 1
+        node_type = NODE_TYPES[kind]
+        node = node_type.__new__(node_type)
+        read_value = self.read_value
+        for field in node_type._fields:
+            setattr(node, field, read_value())
+        for annotation in node_type._annotations:
+            setattr(node, annotation, None)
+        return node
+
+    def read_value(self):
+        data = self.data
+        tag = data[self.pos]
+        self.pos += 1
+        if tag == TAG_NODE:
+            return self.read_node()
+        elif tag == TAG_STR:
+            if data[self.pos] < 0x80:       # most varints are one byte
+                self.pos += 1
+                return self.strings[data[self.pos - 1]]
+            return self.strings[self.read_varint()]
+        elif tag == TAG_INT:
+            n = self.read_varint()
+            return n >> 1 if not n & 1 else -((n + 1) >> 1)
+        elif tag == TAG_LIST:
+            read_value = self.read_value
+            return [read_value() for _ in range(self.read_varint())]
+        elif tag == TAG_NONE:
+            return None
+        elif tag == TAG_TRUE:
+            return True
+        elif tag == TAG_FALSE:
+            return False
+        elif tag == TAG_OP:
+            return TOKEN_TYPE_LIST[self.read_varint()]
+        raise SerialError(f'bad value tag {tag} at {self.pos - 1}')
+
+
+def dumps(tree):
+    writer = AstWriter()
+    writer.write_node(tree)
+    return writer.getvalue()
+
+
+def loads(data, pos=0):
+    """load a tree from bytes, memoryview or mmap, starting at pos
+    """
+    reader = AstReader(data, pos)
+    try:
+        reader.read_header()
+        return reader.read_node()
+    except IndexError:
+        raise SerialError('ast data truncated')
+
+
+def dump(tree, f):
+    f.write(dumps(tree))
+
+
+def load(f):
+    """load a tree from a binary file object, the file is memory-mapped
+    """
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return loads(data)
+
+
+def same_tree(a, b):
+    """compare two trees field by field
+    """
+    if isinstance(a, AST):
+        return type(a) is type(b) and all(same_tree(getattr(a, field), getattr(b, field)) for field in a._fields)
+    if isinstance(a, list):
+        return isinstance(b, list) and len(a) == len(b) and all(same_tree(x, y) for x, y in zip(a, b))
+    return type(a) is type(b) and a == b
+
+
+if __name__ == '__main__':
+    from toylexer import *
+    from toyparser import *
+    import glob
+    import os
+    import pickle
+    import tempfile
+
+    paths = sys.argv[1:] or sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test', '*.toy')))
+    failed = 0
+    print(f'{"file":<24} {"pickle":>8} {"toyserial":>10}  round-trip')
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            try:
+                tree = Parser(Lexer.from_file(f)).parse()
+            except (LexerError, ParserError) as e:
+                print(f'{os.path.basename(path):<24} {"-":>8} {"-":>10}  skipped, {e.__class__.__name__}')
+                continue
+
+        data = dumps(tree)
+        with tempfile.TemporaryFile() as f:
+            dump(tree, f)
+            f.flush()
+            ok = same_tree(tree, loads(data)) and same_tree(tree, load(f))
+        failed += not ok
+        print(f'{os.path.basename(path):<24} {len(pickle.dumps(tree, pickle.HIGHEST_PROTOCOL)):>8} {len(data):>10}  {"ok" if ok else "FAILED"}')
+    sys.exit(1 if failed else 0)
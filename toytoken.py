@@ -2,6 +2,7 @@
 """
 toylang token define
 """
+from array import array
 from enum import Enum
 
 class TokenType(Enum):
@@ -100,7 +101,7 @@ class OperatorTokenCfg:
 
 
 OPERATOR_TOKEN_LIST = [
-    #                start  content    type             len     顺序应该会影响解析效率
+    #                start  content    type             len     顺序不影响解析效率, 见 OPERATOR_TOKEN_TABLE
     OperatorTokenCfg('=',   '==',  TokenType.EQ,        len('==')  ),
     OperatorTokenCfg('=',   '=',   TokenType.ASSIGN,    len('=')   ),
     OperatorTokenCfg('.',   '...', TokenType.VARARG,    len('...') ),
@@ -109,12 +110,12 @@ OPERATOR_TOKEN_LIST = [
     OperatorTokenCfg('+',   '+',   TokenType.ADD,       len('+')   ),
     OperatorTokenCfg('-',   '-=',  TokenType.SELF_SUB,  len('-=')  ),
     OperatorTokenCfg('-',   '-',   TokenType.SUB,       len('-')   ),
+    OperatorTokenCfg('*',   '**=', TokenType.SELF_POW,  len('**=') ),
+    OperatorTokenCfg('*',   '**',  TokenType.POW,       len('**')  ),
     OperatorTokenCfg('*',   '*=',  TokenType.SELF_MUL,  len('*=')  ),
     OperatorTokenCfg('*',   '*',   TokenType.MUL,       len('*')   ),
     OperatorTokenCfg('/',   '/=',  TokenType.SELF_DIV,  len('/=')  ),
     OperatorTokenCfg('/',   '/',   TokenType.DIV,       len('/')   ),
-    OperatorTokenCfg('*',   '**=', TokenType.SELF_POW,  len('**=') ),
-    OperatorTokenCfg('*',   '**',  TokenType.POW,       len('**')  ),
     OperatorTokenCfg('%',   '%=',  TokenType.SELF_MOD,  len('%=')  ),
     OperatorTokenCfg('%',   '%',   TokenType.MOD,       len('%')   ),
     OperatorTokenCfg('<',   '<<=', TokenType.SELF_BSHL, len('<<=') ),
@@ -148,13 +149,17 @@ OPERATOR_TOKEN_LIST = [
 
 
 class Token:
-    def __init__(self, type: TokenType, value: str, position: tuple[int, int]):
+    __slots__ = ('type', 'value', 'position')
+
+    def __init__(self, type: TokenType, value: str, position: int):
+        """position: source offset, see `toylexer.LineTable` for line:col
+        """
         self.type  = type
         self.value = value
         self.position = position
 
     def __str__(self):
-        return f'Token({self.type}, {repr(self.value)}, pos={self.position[0]}:{self.position[1]})'
+        return f'Token({self.type}, {repr(self.value)}, pos={self.position})'
 
     def __repr__(self):
         return self.__str__()
@@ -171,3 +176,76 @@ def _build_reserved_keywords():
 
 
 RESERVED_KEYWORDS = _build_reserved_keywords()
+
+
+def _build_operator_token_table():
+    """map first char -> operator token cfgs, longest content first
+
+    so the lexer only checks the few candidates of the current char,
+    and the longest operator always wins regardless of the list order
+    """
+    table = {}
+    for op in OPERATOR_TOKEN_LIST:
+        table.setdefault(op.start, []).append(op)
+    return {
+        start: tuple(sorted(ops, key=lambda op: op.len, reverse=True))
+        for start, ops in table.items()
+    }
+
+
+OPERATOR_TOKEN_TABLE = _build_operator_token_table()
+
+
+TOKEN_TYPE_LIST = list(TokenType)
+TOKEN_TYPE_CODES = {token_type: code for code, token_type in enumerate(TOKEN_TYPE_LIST)}
+
+
+class TokenBuffer:
+    """compact token storage
+
+    kinds   : TokenType code of each token, array('B')
+    offsets : source offset of each token, array('I')
+    values  : index of each token value in `strings`, array('I'), 0 is None
+    strings : interned token values
+    text    : source of the tokens if known, used by `toylexer.relex`
+    """
+    def __init__(self):
+        self.kinds = array('B')
+        self.offsets = array('I')
+        self.values = array('I')
+        self.strings = [None]
+        self.string_ids = {None: 0}
+        self.text = None
+
+    @classmethod
+    def from_tokens(cls, tokens):
+        """tokens: iterable of Token ended with EOF, like a Lexer or `iter_tokens(text)`
+        """
+        buffer = cls()
+        for token in tokens:
+            buffer.append(token)
+        return buffer
+
+    def append(self, token: Token):
+        value_id = self.string_ids.get(token.value)
+        if value_id is None:
+            value_id = len(self.strings)
+            self.strings.append(token.value)
+            self.string_ids[token.value] = value_id
+        self.kinds.append(TOKEN_TYPE_CODES[token.type])
+        self.offsets.append(token.position)
+        self.values.append(value_id)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, i):
+        return Token(TOKEN_TYPE_LIST[self.kinds[i]], self.strings[self.values[i]], self.offsets[i])
+
+    def __iter__(self):
+        """yield tokens, so a Parser can consume the buffer directly
+        """
+        types = TOKEN_TYPE_LIST
+        strings = self.strings
+        for kind, value_id, offset in zip(self.kinds, self.values, self.offsets):
+            yield Token(types[kind], strings[value_id], offset)
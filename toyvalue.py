@@ -11,14 +11,20 @@ ObjectValue       : _val
 TypeValue         : _val (type str)
 FunctionValue     : _ast
 HostFunctionValue : _func: f(argc, argv: list[Value]) -> Value    # argc not need in py
+
+`+=` and `-=` change a number or a string in place. the values of literals
+are shared from a ConstantPool, they are copied by `unshare` when bound to
+a name or stored in a container
 """
 
 from toytoken import *
 from toyerror import *
-from toyast import FuncDef
+from toyast import FuncDef, NumLiteral, StringLiteral, BoolLiteral
 
 
 class Value:
+    pooled = False          # shared from a ConstantPool
+
     def __str__(self):
         pass
 
@@ -160,6 +166,55 @@ def init_builtin_typevalues(register_cb):
     register_cb(keys, BUILTIN_TYPEVALUES, True)
 
 
+class ConstantPool:
+    """values of literals, made once and shared by every evaluation,
+    equal literals share one value. true, false and null never change, nums
+    and strings are marked `pooled`
+    """
+    def __init__(self):
+        self.nums = {}          # (source text, is_int) -> NumValue
+        self.strings = {}
+        self.true = BoolValue(True)
+        self.false = BoolValue(False)
+        self.null = NullValue()
+
+    def num(self, text, is_int):
+        value = self.nums.get((text, is_int))
+        if value is None:
+            value = NumValue(int(text) if is_int else float(text), is_int=is_int)
+            value.pooled = True
+            self.nums[(text, is_int)] = value
+        return value
+
+    def string(self, s):
+        value = self.strings.get(s)
+        if value is None:
+            value = self.strings[s] = StringValue(s)
+            value.pooled = True
+        return value
+
+    def literal(self, node):
+        """value of a literal node
+        """
+        if node.kind == NumLiteral.kind:
+            return self.num(node.value, node.is_int)
+        elif node.kind == StringLiteral.kind:
+            return self.string(node.value)
+        elif node.kind == BoolLiteral.kind:
+            return self.true if node.value == 'true' else self.false
+        else:
+            return self.null
+
+
+def unshare(value):
+    """the value to bind to a name or store in a container, a copy of a
+    pooled value, which `+=` must not change
+    """
+    if value.pooled:
+        return NumValue(value._val, value.is_int) if type(value) == NumValue else StringValue(value._val)
+    return value
+
+
 class OpImpl:
     @staticmethod
     def eq(l, r):